@@ -1,16 +1,23 @@
 import os
 import datetime
-from .static_funcs import load_model_ensemble, load_model, store_kge, create_constraints
+from .static_funcs import load_model_ensemble, load_model, store_kge, create_constraints, get_er_vocab, \
+    load_indexed_triples, load_entity_indexes
+from .filter_index import FilterIndex
+from .inference_engine import KvsAllInferenceEngine
+from .quantization import quantize_entity_embeddings, entity_embeddings_nbytes
+from .vocabulary import Vocabulary
 import torch
 from typing import List, Tuple, Generator
 import pandas as pd
+import numpy as np
 
 
 class BaseInteractiveKGE:
     """ Base class for interactive KGE """
 
     def __init__(self, path_of_pretrained_model_dir, construct_ensemble=False, model_name=None,
-                 apply_semantic_constraint=False):
+                 apply_semantic_constraint=False, query_cache_size=1024, use_ann_index=True, ann_num_probes=None,
+                 quantize=False):
         try:
             assert os.path.isdir(path_of_pretrained_model_dir)
         except AssertionError:
@@ -19,99 +26,239 @@ class BaseInteractiveKGE:
         # (1) Load model...
         self.construct_ensemble = construct_ensemble
         if construct_ensemble:
-            self.model, self.entity_to_idx, self.relation_to_idx = load_model_ensemble(self.path + '/')
+            self.model, self.entity_vocabulary, self.relation_vocabulary = load_model_ensemble(self.path + '/')
         else:
             if model_name:
-                self.model, self.entity_to_idx, self.relation_to_idx = load_model(self.path + '/',
-                                                                                  model_name=model_name)
+                self.model, self.entity_vocabulary, self.relation_vocabulary = load_model(self.path + '/',
+                                                                                          model_name=model_name)
             else:
-                self.model, self.entity_to_idx, self.relation_to_idx = load_model(self.path + '/')
+                self.model, self.entity_vocabulary, self.relation_vocabulary = load_model(self.path + '/')
 
-        self.num_entities = len(self.entity_to_idx)
-        self.num_relations = len(self.relation_to_idx)
+        # DataFrames of vocabularies are constructed at the first access.
+        self._entity_to_idx, self._relation_to_idx = None, None
+        self.num_entities = len(self.entity_vocabulary)
+        self.num_relations = len(self.relation_vocabulary)
+        # Number of scores computed at once in batched top-k predictions.
+        self.max_scores_per_chunk = 2 ** 24
+        # Tail entities are predicted via cached k vs all queries if the model computes them.
+        if KvsAllInferenceEngine.is_applicable(self.model):
+            # Approximate nearest neighbour indexes are built only for a single model, see store_entity_indexes.
+            if use_ann_index and not construct_ensemble and model_name is None:
+                tail_entity_index, head_entity_index = load_entity_indexes(self.path)
+            else:
+                tail_entity_index, head_entity_index = None, None
+            for index in [tail_entity_index, head_entity_index]:
+                if index is not None and ann_num_probes is not None:
+                    index.num_probes = ann_num_probes
+            self.inference_engine = KvsAllInferenceEngine(self.model, cache_size=query_cache_size,
+                                                          tail_entity_index=tail_entity_index,
+                                                          head_entity_index=head_entity_index)
+        else:
+            self.inference_engine = None
         print('Loading indexed training data...')
-        self.train_set = pd.read_parquet(self.path + '/idx_train_df.gzip')
+        # Memory-map train_triples.npy if it exists. Otherwise, read idx_train_df.gzip into memory.
+        train_set = load_indexed_triples(self.path, 'train', mmap_mode='r')
+        if train_set is not None:
+            self.train_set = pd.DataFrame(train_set, columns=['subject', 'relation', 'object'], copy=False)
+        else:
+            self.train_set = pd.read_parquet(self.path + '/idx_train_df.gzip')
+        # (h,r) => t index over the training data is constructed at the first access.
+        self._er_vocab = None
         if apply_semantic_constraint:
             # TODO: 1 Obtain a mapping from a relation to its ranges
             # TODO: 2 Convert 2 into a mapping from relations to entities outside of their ranges
             self.domain_constraints_per_rel, self.range_constraints_per_rel = create_constraints(
                 self.train_set.to_numpy())
             # TODO 3 Use 2 at predicting scores.
+        # Memory savings and top-k overlap of quantized entity embeddings.
+        self.quantization_report = None
+        if quantize:
+            self.quantize()
+
+    @property
+    def entity_to_idx(self) -> pd.DataFrame:
+        """ DataFrame of the entity vocabulary, i.e., entity_to_idx.iloc[i].name is the i-th entity """
+        if self._entity_to_idx is None:
+            self._entity_to_idx = self.entity_vocabulary.to_dataframe()
+        return self._entity_to_idx
+
+    @property
+    def relation_to_idx(self) -> pd.DataFrame:
+        """ DataFrame of the relation vocabulary, i.e., relation_to_idx.iloc[i].name is the i-th relation """
+        if self._relation_to_idx is None:
+            self._relation_to_idx = self.relation_vocabulary.to_dataframe()
+        return self._relation_to_idx
+
+    @property
+    def er_vocab(self) -> FilterIndex:
+        if self._er_vocab is None:
+            self._er_vocab = get_er_vocab(self.train_set.to_numpy())
+        return self._er_vocab
 
     def set_model_train_mode(self):
+        assert self.model.head_entity_embeddings is None, 'A model exported for inference cannot be trained'
+        self.clear_inference_cache()
+        if self.inference_engine is not None:
+            # Indexes of entity embeddings are outdated after training.
+            self.inference_engine.tail_entity_index, self.inference_engine.head_entity_index = None, None
         self.model.train()
         for parameter in self.model.parameters():
             parameter.requires_grad = True
 
     def set_model_eval_mode(self):
+        self.clear_inference_cache()
         self.model.eval()
         for parameter in self.model.parameters():
             parameter.requires_grad = False
 
+    def export_for_inference(self) -> None:
+        """ Replace the model with a copy whose dropout and normalization are folded into embedding tables """
+        self.model = self.model.export_for_inference()
+        if self.inference_engine is not None:
+            self.inference_engine = KvsAllInferenceEngine(self.model, cache_size=self.inference_engine.cache_size,
+                                                          tail_entity_index=self.inference_engine.tail_entity_index,
+                                                          head_entity_index=self.inference_engine.head_entity_index)
+
+    def quantize(self, k: int = 10, num_queries: int = 1000) -> dict:
+        """
+        Replace the model with a copy for inference whose entity embeddings are quantized per row into int8,
+        see quantize_entity_embeddings. predict_topk and triple_score use the quantized model.
+
+        (1) Top k tail entities of (head entity, relation) pairs of at most num_queries training triples are
+        predicted with the float model.
+        (2) Entity embeddings are quantized. Memory is compared with float entity embeddings of the model exported for
+        inference, i.e., having normalization folded into head and tail entity embeddings.
+        (3) Memory of entity embeddings and the average overlap of top k tail entities of (1) and the quantized model.
+        :param k:
+        :param num_queries:
+        :return: a report
+        """
+        # (1) Top k of the float model.
+        queries = self.train_set.sample(n=min(num_queries, len(self.train_set)), random_state=1)
+        x = torch.LongTensor(queries[['subject', 'relation']].to_numpy(dtype=np.int64))
+        _, float_topk = self.__predict_tail_topk(x, k)
+        # (2) Quantize.
+        if self.model.head_entity_embeddings is None:
+            self.model = self.model.export_for_inference()
+        float_nbytes = entity_embeddings_nbytes(self.model)
+        self.model = quantize_entity_embeddings(self.model)
+        if self.inference_engine is not None:
+            self.inference_engine = KvsAllInferenceEngine(self.model, cache_size=self.inference_engine.cache_size,
+                                                          tail_entity_index=self.inference_engine.tail_entity_index,
+                                                          head_entity_index=self.inference_engine.head_entity_index)
+        # (3) Memory savings and top k overlap.
+        quantized_nbytes = entity_embeddings_nbytes(self.model)
+        _, quantized_topk = self.__predict_tail_topk(x, k)
+        overlap = np.mean([len(set(a) & set(b)) / len(a)
+                           for a, b in zip(float_topk.tolist(), quantized_topk.tolist())])
+        self.quantization_report = {'EntityEmbeddingsMB': float_nbytes / 1024 ** 2,
+                                    'QuantizedEntityEmbeddingsMB': quantized_nbytes / 1024 ** 2,
+                                    'MemorySaving': 1 - quantized_nbytes / float_nbytes,
+                                    f'Top{k}Overlap': float(overlap)}
+        print(self.quantization_report)
+        return self.quantization_report
+
+    def clear_inference_cache(self):
+        if self.inference_engine is not None:
+            self.inference_engine.clear()
+
+    @staticmethod
+    def __pairs(first: torch.LongTensor, second: torch.LongTensor) -> torch.LongTensor:
+        """ (N, 2) pairs of indexes, where an index given once is paired with each index of the other """
+        n = max(len(first), len(second))
+        assert len(first) in (1, n) and len(second) in (1, n)
+        return torch.stack((first.expand(n), second.expand(n)), dim=1)
+
+    @staticmethod
+    def __labels(vocabulary: Vocabulary, idx: torch.LongTensor) -> np.ndarray:
+        """ Labels of (N, k) indexes, None for the padding index -1 """
+        idx = idx.numpy()
+        return np.where(idx >= 0, vocabulary.decode(np.maximum(idx, 0)).astype(object), None)
+
+    def __topk_of_stacked_triples(self, pairs: torch.LongTensor, position: int, num_candidates: int,
+                                  k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k candidates at a position of triples by scoring triples of all candidates, i.e., model(x).
+        :param pairs: (N, 2) indexes of the other two positions of triples in order
+        :param position: 0 for head entities, 1 for relations, 2 for tail entities
+        :param num_candidates:
+        :param k:
+        :return: (N, k) scores in descending order and (N, k) indexes of candidates
+        """
+        # Scores of at most max_scores_per_chunk triples are kept in memory.
+        chunk_size = max(1, self.max_scores_per_chunk // num_candidates)
+        other_positions = [i for i in range(3) if i != position]
+        top_scores, top_idx = [], []
+        for i in range(0, len(pairs), chunk_size):
+            chunk = pairs[i:i + chunk_size]
+            x = torch.empty(len(chunk) * num_candidates, 3, dtype=torch.long)
+            x[:, other_positions] = chunk.repeat_interleave(num_candidates, dim=0)
+            x[:, position] = torch.arange(num_candidates).repeat(len(chunk))
+            with torch.no_grad():
+                scores = self.model(x).view(len(chunk), num_candidates)
+            scores, idx = torch.topk(scores, min(k, num_candidates), dim=1)
+            top_scores.append(scores)
+            top_idx.append(idx)
+        return torch.cat(top_scores), torch.cat(top_idx)
+
     def __predict_missing_head_entity(self, relation: List[str], tail_entity: List[str], k: int) -> Tuple:
         """ f(? r t) for all entities.
         :param k:
         :param relation: list of URIs
         :param tail_entity: list of URIs
-        :return:
+        :return: (N, k) scores and (N, k) entities
         """
         assert k >= 0
-
-        head_entity = torch.LongTensor(self.entity_to_idx['entity'].values.tolist())
-        relation = torch.LongTensor(self.relation_to_idx.loc[relation]['relation'].values.tolist())
-        tail_entity = torch.LongTensor(self.entity_to_idx.loc[tail_entity]['entity'].values.tolist())
-        x = torch.stack((head_entity,
-                         relation.repeat(self.num_entities, ),
-                         tail_entity.repeat(self.num_entities, )), dim=1)
-        scores = self.model(x)
-        entities = self.entity_to_idx.index.values
-        # sort_scores, sort_idxs = torch.sort(scores, descending=True)
-        sort_scores, sort_idxs = torch.topk(scores, k)
-        return sort_scores, entities[sort_idxs]
+        relation = torch.from_numpy(self.relation_vocabulary.encode(relation))
+        tail_entity = torch.from_numpy(self.entity_vocabulary.encode(tail_entity))
+        x = self.__pairs(relation, tail_entity)
+        if self.inference_engine is not None and self.inference_engine.predicts_head_entities(self.model):
+            # Chunked matrix multiplications or index search with queries of (relation, tail entity).
+            sort_scores, sort_idxs = self.inference_engine.predict_head_topk_batch(x, k)
+        else:
+            sort_scores, sort_idxs = self.__topk_of_stacked_triples(x, 0, self.num_entities, k)
+        return sort_scores, self.__labels(self.entity_vocabulary, sort_idxs)
 
     def __predict_missing_relations(self, head_entity: List[str], tail_entity: List[str], k: int = 3) -> Tuple:
         assert k >= 0
-
-        head_entity = torch.LongTensor(self.entity_to_idx.loc[head_entity]['entity'].values.tolist())
-        relation = torch.LongTensor(self.relation_to_idx['relation'].values.tolist())
-        tail_entity = torch.LongTensor(self.entity_to_idx.loc[tail_entity]['entity'].values.tolist())
-        x = torch.stack((head_entity.repeat(self.num_relations, ),
-                         relation,
-                         tail_entity.repeat(self.num_relations, )), dim=1)
-        scores = self.model(x)
-        relations = self.relation_to_idx.index.values
-        # sort_scores, sort_idxs = torch.sort(scores, descending=True)
-        sort_scores, sort_idxs = torch.topk(scores, k)
-        return sort_scores, relations[sort_idxs]
+        head_entity = torch.from_numpy(self.entity_vocabulary.encode(head_entity))
+        tail_entity = torch.from_numpy(self.entity_vocabulary.encode(tail_entity))
+        sort_scores, sort_idxs = self.__topk_of_stacked_triples(self.__pairs(head_entity, tail_entity), 1,
+                                                                self.num_relations, k)
+        return sort_scores, self.__labels(self.relation_vocabulary, sort_idxs)
 
     def __predict_missing_tail_entity(self, head_entity: List[str], relation: List[str], k: int = 3) -> Tuple:
         assert k >= 0
         # Get index of head entity
-        head_entity = torch.LongTensor(self.entity_to_idx.loc[head_entity]['entity'].values.tolist())
+        head_entity = torch.from_numpy(self.entity_vocabulary.encode(head_entity))
         # Get index of relation
-        relation = torch.LongTensor(self.relation_to_idx.loc[relation]['relation'].values.tolist())
-        # Get all entity indexes.
-        tail_entity = torch.LongTensor(self.entity_to_idx['entity'].values.tolist())
-
-        x = torch.stack((head_entity.repeat(self.num_entities, ),
-                         relation.repeat(self.num_entities, ),
-                         tail_entity), dim=1)
-        scores = self.model(x)
-        entities = self.entity_to_idx.index.values
-        # sort_scores, sort_idxs = torch.sort(scores, descending=True)
-        sort_scores, sort_idxs = torch.topk(scores, k)
-        return sort_scores, entities[sort_idxs]
+        relation = torch.from_numpy(self.relation_vocabulary.encode(relation))
+        sort_scores, sort_idxs = self.__predict_tail_topk(self.__pairs(head_entity, relation), k)
+        return sort_scores, self.__labels(self.entity_vocabulary, sort_idxs)
+
+    def __predict_tail_topk(self, x: torch.LongTensor, k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """ (N, k) scores and (N, k) indexes of top k tail entities of (N, 2) head entity and relation indexes """
+        if self.inference_engine is not None:
+            # Chunked matrix multiplications or index search with cached queries of (head entity, relation).
+            return self.inference_engine.predict_tail_topk_batch(x, k)
+        return self.__topk_of_stacked_triples(x, 2, self.num_entities, k)
 
     def predict_topk(self, *, head_entity: List[str] = None, relation: List[str] = None, tail_entity: List[str] = None,
-                     k: int = 10) -> Generator:
+                     k: int = 10) -> Tuple:
         """
         Predict missing triples
 
+        Given N head entities and N relations, N relations and N tail entities or N head entities and
+        N tail entities, top k candidates of N queries are predicted at once. An item given once is used
+        in all queries.
+
         :param k: top k prediction
         :param head_entity:
         :param relation:
         :param tail_entity:
-        :return:
+        :return: (N, k) scores and (N, k) candidates. (k,) scores and (k,) candidates if N=1.
+        Queries having less than k candidates found in an approximate nearest neighbour index are padded with
+        zero scores and None.
         """
         # (1) Sanity checking.
         if head_entity is not None:
@@ -125,40 +272,36 @@ class BaseInteractiveKGE:
             assert relation is not None
             assert tail_entity is not None
             # ? r, t
-            scores, entities = self.__predict_missing_head_entity(relation, tail_entity, k)
-            return torch.sigmoid(scores), entities
+            scores, candidates = self.__predict_missing_head_entity(relation, tail_entity, k)
         # (3) Predict missing relation given a head entity and a tail entity.
         elif relation is None:
             assert head_entity is not None
             assert tail_entity is not None
             # h ? t
-            scores, relations = self.__predict_missing_relations(head_entity, tail_entity, k)
-            return torch.sigmoid(scores), relations
+            scores, candidates = self.__predict_missing_relations(head_entity, tail_entity, k)
         # (4) Predict missing tail entity given a head entity and a relation
         elif tail_entity is None:
             assert head_entity is not None
             assert relation is not None
             # h r ?t
-            scores, entities = self.__predict_missing_tail_entity(head_entity, relation, k)
-            return torch.sigmoid(scores), entities
+            scores, candidates = self.__predict_missing_tail_entity(head_entity, relation, k)
         else:
-
             assert len(head_entity) == len(relation) == len(tail_entity)
-        # @TODO:replace with triple_score
-        head = self.entity_to_idx.loc[head_entity]['entity'].values.tolist()
-        relation = self.relation_to_idx.loc[relation]['relation'].values.tolist()
-        tail = self.entity_to_idx.loc[tail_entity]['entity'].values.tolist()
-        x = torch.tensor((head, relation, tail)).reshape(len(head), 3)
-        return torch.sigmoid(self.model(x))
+            # @TODO:replace with triple_score
+            x = torch.from_numpy(np.stack((self.entity_vocabulary.encode(head_entity),
+                                           self.relation_vocabulary.encode(relation),
+                                           self.entity_vocabulary.encode(tail_entity)), axis=1))
+            return torch.sigmoid(self.model(x))
+        # (5) A single query is not batched.
+        if len(scores) == 1:
+            return torch.sigmoid(scores[0]), candidates[0]
+        return torch.sigmoid(scores), candidates
 
     def triple_score(self, *, head_entity: List[str] = None, relation: List[str] = None,
                      tail_entity: List[str] = None, logits=False, without_norm=False) -> torch.tensor:
-        head_entity = torch.LongTensor(self.entity_to_idx.loc[head_entity]['entity'].values).reshape(len(head_entity),
-                                                                                                     1)
-        relation = torch.LongTensor(self.relation_to_idx.loc[relation]['relation'].values).reshape(len(relation), 1)
-        tail_entity = torch.LongTensor(self.entity_to_idx.loc[tail_entity]['entity'].values).reshape(len(tail_entity),
-                                                                                                     1)
-        x = torch.hstack((head_entity, relation, tail_entity))
+        x = torch.from_numpy(np.stack((self.entity_vocabulary.encode(head_entity),
+                                       self.relation_vocabulary.encode(relation),
+                                       self.entity_vocabulary.encode(tail_entity)), axis=1))
         # @ TODO: Apply semantic filtering
         with torch.no_grad():
             if without_norm:
@@ -178,20 +321,21 @@ class BaseInteractiveKGE:
     def sample_entity(self, n: int) -> List[str]:
         assert isinstance(n, int)
         assert n >= 0
-        return self.entity_to_idx.sample(n=n).index.to_list()
+        return self.entity_vocabulary.sample(n)
 
     def sample_relation(self, n: int) -> List[str]:
         assert isinstance(n, int)
         assert n >= 0
-        return self.relation_to_idx.sample(n=n).index.to_list()
+        return self.relation_vocabulary.sample(n)
 
     def is_seen(self, entity: str = None, relation: str = None) -> bool:
         if entity is not None:
-            return True if entity in self.entity_to_idx.index else False
+            return entity in self.entity_vocabulary
         if relation is not None:
-            return True if relation in self.relation_to_idx.index else False
+            return relation in self.relation_vocabulary
 
     def save(self) -> None:
+        assert self.model.head_entity_embeddings is None, 'A model exported for inference cannot be stored'
         t = str(datetime.datetime.now())
         if self.construct_ensemble:
             store_kge(self.model, path=self.path + f'/model_ensemble_interactive_{str(t)}.pt')
@@ -209,16 +353,16 @@ class BaseInteractiveKGE:
         print('Index inputs...')
         n = len(head_entity)
         assert n == len(relation) == len(tail_entity)
-        idx_head_entity = torch.LongTensor(self.entity_to_idx.loc[head_entity]['entity'].values).reshape(n, 1)
-        idx_relation = torch.LongTensor(self.relation_to_idx.loc[relation]['relation'].values).reshape(n, 1)
-        idx_tail_entity = torch.LongTensor(self.entity_to_idx.loc[tail_entity]['entity'].values).reshape(n, 1)
+        idx_head_entity = torch.from_numpy(self.entity_vocabulary.encode(head_entity)).reshape(n, 1)
+        idx_relation = torch.from_numpy(self.relation_vocabulary.encode(relation)).reshape(n, 1)
+        idx_tail_entity = torch.from_numpy(self.entity_vocabulary.encode(tail_entity)).reshape(n, 1)
         return idx_head_entity, idx_relation, idx_tail_entity
 
     def construct_input_and_output_k_vs_all(self, head_entity, relation):
         # @TODO: Add explanation
         try:
-            idx_head_entity = self.entity_to_idx.loc[head_entity]['entity'].values[0]
-            idx_relation = self.relation_to_idx.loc[relation]['relation'].values[0]
+            idx_head_entity = self.entity_vocabulary.encode(head_entity)[0]
+            idx_relation = self.relation_vocabulary.encode(relation)[0]
         except KeyError as e:
             print(f'Exception:\t {str(e)}')
             return None
@@ -226,10 +370,8 @@ class BaseInteractiveKGE:
         print('\nKvsAll Training...')
         print(f'Start:{head_entity}\t {relation}')
         idx_tails: np.array
-        idx_tails = self.train_set[
-            (self.train_set['subject'] == idx_head_entity) & (self.train_set['relation'] == idx_relation)][
-            'object'].values
-        print('Num. Tails:\t', self.entity_to_idx.iloc[idx_tails].values.size)
+        idx_tails = self.er_vocab[(idx_head_entity, idx_relation)].astype(np.int64)
+        print('Num. Tails:\t', idx_tails.size)
         # Hard Labels
         labels = torch.zeros(1, self.num_entities)
         labels[0, idx_tails] = 1
@@ -242,17 +384,16 @@ class BaseInteractiveKGE:
         :param entity:
         :return:
         """
-        idx_entity = self.entity_to_idx.loc[entity].values[0]
+        idx_entity = self.entity_vocabulary.encode([entity])[0]
         idx_relations = self.train_set[
             (self.train_set['subject'] == idx_entity) | (self.train_set['object'] == idx_entity)][
             'relation'].unique()
-        # => relation_to_idx must be a dataframe with monotonically increasing
-        return self.relation_to_idx.iloc[idx_relations].index.values.tolist()
+        return self.relation_vocabulary.decode(idx_relations).tolist()
 
     def get_entity_embeddings(self, uri: List[str]):
         """ Return embedding of an URI"""
-        return self.model.entity_embeddings(torch.LongTensor(self.entity_to_idx.loc[uri]['entity'].values))
+        return self.model.entity_embeddings(torch.from_numpy(self.entity_vocabulary.encode(uri)))
 
     def get_relation_embeddings(self, uri: List[str]):
         """ Return embedding of an URI"""
-        return self.model.relation_to_idx(torch.LongTensor(self.relation_to_idx.loc[uri]['relation'].values))
+        return self.model.relation_embeddings(torch.from_numpy(self.relation_vocabulary.encode(uri)))
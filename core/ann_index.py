@@ -0,0 +1,203 @@
+import json
+import numpy as np
+import torch
+from typing import Tuple
+
+
+def kmeans(x: torch.FloatTensor, num_clusters: int, num_iterations: int = 10, max_points: int = 65_536,
+           chunk_size: int = 65_536, generator: torch.Generator = None) -> torch.FloatTensor:
+    """
+    Lloyd's algorithm with centroids initialized from random points.
+    Centroids are fitted on at most min(max_points, 64 * num_clusters) random points.
+    Empty clusters keep their previous centroids.
+
+    :param x: (n, d) tensor
+    :param num_clusters:
+    :param num_iterations:
+    :param max_points:
+    :param chunk_size: number of points assigned at once
+    :param generator:
+    :return: (num_clusters, d) tensor
+    """
+    assert 0 < num_clusters <= len(x)
+    max_points = min(max_points, 64 * num_clusters)
+    if len(x) > max_points:
+        x = x[torch.randperm(len(x), generator=generator)[:max_points]]
+    centroids = x[torch.randperm(len(x), generator=generator)[:num_clusters]].clone()
+    for _ in range(num_iterations):
+        assignments = assign_to_centroids(x, centroids, chunk_size)
+        counts = torch.bincount(assignments, minlength=num_clusters).to(x.dtype)
+        sums = torch.zeros_like(centroids).index_add_(0, assignments, x)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty].unsqueeze(1)
+    return centroids
+
+
+def assign_to_centroids(x: torch.FloatTensor, centroids: torch.FloatTensor,
+                        chunk_size: int = 65_536) -> torch.LongTensor:
+    """ Index of the closest centroid in Euclidean distance for each point, i.e., argmin ||c||^2 - 2 <x, c> """
+    squared_norms = (centroids ** 2).sum(dim=1)
+    return torch.cat([torch.argmin(squared_norms - 2 * torch.mm(x[i:i + chunk_size], centroids.transpose(1, 0)),
+                                   dim=1) for i in range(0, len(x), chunk_size)])
+
+
+class IVFPQIndex:
+    """ Inverted file index with product quantized residuals for maximum inner product search over entity embeddings
+
+    (1) centroids: (num_lists, d) coarse k-means centroids. Every entity is stored in the list of its closest centroid.
+    (2) codebooks: (num_subspaces, num_codes, d / num_subspaces) k-means centroids of residuals in each subspace.
+    (3) codes: (|E|, num_subspaces) uint8 array of codes of residuals in the order of inverted lists.
+    (4) ids: int64 entity indexes in the order of inverted lists.
+    (5) offsets: int64 array of size num_lists + 1. Entities of the i-th list are ids[offsets[i]:offsets[i + 1]].
+
+    The inner product of a query q with an entity e in the i-th list is approximated by
+    <q, centroids[i]> + \\sum_m <q_m, codebooks[m, codes[e, m]]>, where the second term is a sum of lookups in a
+    (num_subspaces, num_codes) table computed once per query. Only the num_probes lists whose centroids have the
+    highest inner products with q are scanned. If embeddings are given at search, the best k * refine_factor
+    candidates are rescored exactly.
+    """
+
+    def __init__(self, centroids: np.ndarray, codebooks: np.ndarray, codes: np.ndarray, ids: np.ndarray,
+                 offsets: np.ndarray, num_probes: int = 8, refine_factor: int = 10):
+        assert len(offsets) == len(centroids) + 1 and len(codes) == len(ids)
+        assert codebooks.shape[0] == codes.shape[1] and codebooks.shape[1] <= 256
+        self.centroids = torch.as_tensor(np.asarray(centroids))
+        self.codebooks = torch.as_tensor(np.asarray(codebooks))
+        # Codes and ids are indexed in NumPy as they may be memory-mapped.
+        self.codes = codes
+        self.ids = ids
+        self.offsets = torch.as_tensor(np.asarray(offsets))
+        self.num_probes = num_probes
+        self.refine_factor = refine_factor
+
+    @classmethod
+    def build(cls, embeddings: torch.FloatTensor, num_lists: int = None, num_subspaces: int = None,
+              num_codes: int = 256, num_iterations: int = 10, num_probes: int = None,
+              seed: int = 0) -> 'IVFPQIndex':
+        """
+        Cluster embeddings into inverted lists and quantize their residuals.
+
+        :param embeddings: (n, d) tensor
+        :param num_lists: number of inverted lists, 4 * sqrt(n) if None
+        :param num_subspaces: number of subspaces of residuals, d / 4 if d is divisible by 4 and d otherwise if None
+        :param num_codes: number of centroids per subspace, at most 256
+        :param num_iterations: number of k-means iterations
+        :param num_probes: number of lists to scan at search, max(8, num_lists / 64) if None
+        :param seed:
+        :return:
+        """
+        embeddings = embeddings.detach().float()
+        n, d = embeddings.shape
+        if num_lists is None:
+            num_lists = int(4 * np.sqrt(n))
+        num_lists = max(1, min(num_lists, n))
+        if num_subspaces is None:
+            num_subspaces = d // 4 if d % 4 == 0 else d
+        if d % num_subspaces != 0:
+            raise ValueError(f'Embedding dimension {d} is not divisible by the number of subspaces {num_subspaces}')
+        num_codes = min(num_codes, n)
+        assert 0 < num_codes <= 256
+        if num_probes is None:
+            num_probes = min(max(8, num_lists // 64), num_lists)
+        generator = torch.Generator().manual_seed(seed)
+        # (1) Coarse quantization.
+        centroids = kmeans(embeddings, num_lists, num_iterations, generator=generator)
+        assignments = assign_to_centroids(embeddings, centroids)
+        # (2) Product quantization of residuals in each subspace.
+        residuals = (embeddings - centroids[assignments]).view(n, num_subspaces, d // num_subspaces)
+        codebooks = torch.stack([kmeans(residuals[:, m], num_codes, num_iterations, generator=generator)
+                                 for m in range(num_subspaces)])
+        codes = torch.stack([assign_to_centroids(residuals[:, m], codebooks[m]) for m in range(num_subspaces)], dim=1)
+        # (3) Inverted lists.
+        ids = torch.from_numpy(np.argsort(assignments.numpy(), kind='stable'))
+        offsets = torch.zeros(num_lists + 1, dtype=torch.long)
+        offsets[1:] = torch.cumsum(torch.bincount(assignments, minlength=num_lists), dim=0)
+        return cls(centroids=centroids.numpy(), codebooks=codebooks.numpy(), codes=codes[ids].to(torch.uint8).numpy(),
+                   ids=ids.numpy(), offsets=offsets.numpy(), num_probes=num_probes)
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, lists: torch.LongTensor) -> torch.LongTensor:
+        """ Positions of entities stored in given inverted lists """
+        starts, lengths = self.offsets[lists], self.offsets[lists + 1] - self.offsets[lists]
+        ends = torch.cumsum(lengths, dim=0)
+        return torch.repeat_interleave(starts - ends + lengths, lengths) + torch.arange(int(ends[-1]))
+
+    def search(self, queries: torch.FloatTensor, k: int, num_probes: int = None,
+               embeddings: torch.FloatTensor = None) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Approximate top k entities having the highest inner products with queries.
+
+        :param queries: (N, d) tensor
+        :param k:
+        :param num_probes: number of inverted lists to scan, self.num_probes if None
+        :param embeddings: (|E|, d) tensor to rescore candidates exactly, approximate scores are returned if None
+        :return: (N, k) scores in descending order and (N, k) entity indexes, padded with -inf and -1 if less than
+        k entities are scanned
+        """
+        queries = queries.detach().float()
+        num_probes = min(num_probes or self.num_probes, self.num_lists)
+        num_subspaces, num_codes, sub_dim = self.codebooks.shape
+        # (1) Inner products with centroids and lookup tables of inner products with codebooks.
+        coarse_scores, probes = torch.topk(torch.mm(queries, self.centroids.transpose(1, 0)), num_probes, dim=1)
+        tables = torch.einsum('nmd,mkd->nmk', queries.view(len(queries), num_subspaces, sub_dim), self.codebooks)
+        top_scores = torch.full((len(queries), k), -float('inf'))
+        top_ids = torch.full((len(queries), k), -1, dtype=torch.long)
+        for i in range(len(queries)):
+            # (2) Approximate scores of entities in probed lists.
+            positions = self._candidates(probes[i])
+            if len(positions) == 0:
+                continue
+            list_scores = torch.repeat_interleave(coarse_scores[i], self.offsets[probes[i] + 1] - self.offsets[probes[i]])
+            codes = torch.from_numpy(self.codes[positions.numpy()].astype(np.int64))
+            scores = list_scores + tables[i].gather(1, codes.transpose(1, 0)).sum(dim=0)
+            candidates = torch.from_numpy(self.ids[positions.numpy()].astype(np.int64))
+            # (3) Exact scores of the best candidates.
+            if embeddings is not None:
+                scores, best = torch.topk(scores, min(k * self.refine_factor, len(scores)))
+                candidates = candidates[best]
+                scores = torch.mv(embeddings[candidates], queries[i].to(embeddings.dtype)).float()
+            scores, best = torch.topk(scores, min(k, len(scores)))
+            top_scores[i, :len(best)], top_ids[i, :len(best)] = scores, candidates[best]
+        return top_scores, top_ids
+
+    def recall_at_k(self, queries: torch.FloatTensor, embeddings: torch.FloatTensor, k: int = 10,
+                    num_probes: int = None) -> float:
+        """
+        Fraction of the exact top k entities retrieved by search with exact rescoring.
+
+        :param queries: (N, d) tensor
+        :param embeddings: (|E|, d) tensor the index is built on
+        :param k:
+        :param num_probes:
+        :return:
+        """
+        k = min(k, len(embeddings))
+        _, exact_ids = torch.topk(torch.mm(queries, embeddings.transpose(1, 0)), k, dim=1)
+        _, approximate_ids = self.search(queries, k, num_probes=num_probes, embeddings=embeddings)
+        hits = sum(len(np.intersect1d(i, j)) for i, j in zip(exact_ids.numpy(), approximate_ids.numpy()))
+        return hits / (k * len(queries))
+
+    def save(self, path: str) -> None:
+        """ Serialize into path_centroids.npy, path_codebooks.npy, path_codes.npy, path_ids.npy, path_offsets.npy
+        and path.json """
+        for name in ['centroids', 'codebooks', 'codes', 'ids', 'offsets']:
+            np.save(path + f'_{name}.npy', np.ascontiguousarray(getattr(self, name)))
+        with open(path + '.json', 'w') as file_descriptor:
+            json.dump({'num_probes': self.num_probes, 'refine_factor': self.refine_factor,
+                       'num_lists': self.num_lists, 'num_entities': len(self)}, file_descriptor)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r') -> 'IVFPQIndex':
+        """ Load an index serialized via save(). Codes and ids are memory-mapped """
+        with open(path + '.json', 'r') as file_descriptor:
+            meta = json.load(file_descriptor)
+        return cls(centroids=np.load(path + '_centroids.npy'), codebooks=np.load(path + '_codebooks.npy'),
+                   codes=np.load(path + '_codes.npy', mmap_mode=mmap_mode),
+                   ids=np.load(path + '_ids.npy', mmap_mode=mmap_mode), offsets=np.load(path + '_offsets.npy'),
+                   num_probes=meta['num_probes'], refine_factor=meta['refine_factor'])
@@ -2,4 +2,5 @@ from .sls import *
 from .sls_acc import *
 from .sls_eg import *
 from .adam_sls import *
-from .adan import Adan
\ No newline at end of file
+from .adan import Adan
+from .lazy_adam import LazyAdam
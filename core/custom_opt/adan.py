@@ -36,6 +36,9 @@ class Adan(Optimizer):
         max_grad_norm (float, optional): value used to clip
             global grad norm (default: 0.0 no clip)
         no_prox (bool): how to perform the decoupled weight decay (default: False)
+
+    Parameters having sparse gradients, e.g. weights of torch.nn.Embedding(..., sparse=True), are updated lazily:
+    only rows referenced by the gradient update their moments, previous gradients and values.
     """
 
     def __init__(self, params, lr=1e-3, betas=(0.98, 0.92, 0.99), eps=1e-8,
@@ -77,12 +80,19 @@ class Adan(Optimizer):
                     state['exp_avg_sq'] = torch.zeros_like(p)
                     # Exponential moving average of gradient difference
                     state['exp_avg_diff'] = torch.zeros_like(p)
+                    if 'seen' in state:
+                        state['seen'].zero_()
 
     @torch.no_grad()
-    def step(self):
+    def step(self, closure=None):
         """
             Performs a single optimization step.
         """
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
         if self.defaults['max_grad_norm'] > 0:
             device = self.param_groups[0]['params'][0].device
             global_grad_norm = torch.zeros(1, device=device)
@@ -92,7 +102,7 @@ class Adan(Optimizer):
 
                 for p in group['params']:
                     if p.grad is not None:
-                        grad = p.grad
+                        grad = p.grad.coalesce()._values() if p.grad.is_sparse else p.grad
                         global_grad_norm.add_(grad.pow(2).sum())
 
             global_grad_norm = torch.sqrt(global_grad_norm)
@@ -126,6 +136,11 @@ class Adan(Optimizer):
                     state['exp_avg_sq'] = torch.zeros_like(p)
                     state['exp_avg_diff'] = torch.zeros_like(p)
 
+                if p.grad.is_sparse:
+                    self.sparse_step(p, group, state, clip_global_grad_norm,
+                                     bias_correction1, bias_correction2, bias_correction3)
+                    continue
+
                 grad = p.grad.mul_(clip_global_grad_norm)
                 if 'pre_grad' not in state or group['step'] == 1:
                     state['pre_grad'] = grad
@@ -150,4 +165,35 @@ class Adan(Optimizer):
                     p.add_(update, alpha=-group['lr'])
                     p.data.div_(1 + group['lr'] * group['weight_decay'])
 
-                state['pre_grad'] = copy_grad
\ No newline at end of file
+                state['pre_grad'] = copy_grad
+
+        return loss
+
+    @staticmethod
+    def sparse_step(p, group, state, clip_global_grad_norm, bias_correction1, bias_correction2, bias_correction3):
+        """ Adan step on rows of p referenced by its sparse gradient """
+        beta1, beta2, beta3 = group['betas']
+        # (1) Rows referenced in the batch and their summed gradients.
+        grad = p.grad.coalesce()
+        rows, grad = grad._indices()[0], grad._values() * clip_global_grad_norm
+        if 'pre_grad' not in state:
+            state['pre_grad'] = torch.zeros_like(p)
+            # Whether a row has been updated before, i.e., its previous gradient is defined.
+            state['seen'] = torch.zeros(len(p), dtype=torch.bool, device=p.device)
+        # (2) The gradient difference of rows updated for the first time is zero as in the first step.
+        diff = (grad - state['pre_grad'][rows]) * state['seen'][rows].unsqueeze(1)
+        update = grad + beta2 * diff
+        exp_avg = state['exp_avg'][rows].mul_(beta1).add_(grad, alpha=1 - beta1)  # m_t
+        exp_avg_diff = state['exp_avg_diff'][rows].mul_(beta2).add_(diff, alpha=1 - beta2)  # diff_t
+        exp_avg_sq = state['exp_avg_sq'][rows].mul_(beta3).addcmul_(update, update, value=1 - beta3)  # n_t
+        state['exp_avg'][rows], state['exp_avg_diff'][rows], state['exp_avg_sq'][rows] = exp_avg, exp_avg_diff, \
+            exp_avg_sq
+        # (3) Update rows of (1).
+        denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction3)).add_(group['eps'])
+        update = (exp_avg / bias_correction1 + beta2 * exp_avg_diff / bias_correction2).div_(denom)
+        if group['no_prox']:
+            p[rows] = p[rows].mul_(1 - group['lr'] * group['weight_decay']).add_(update, alpha=-group['lr'])
+        else:
+            p[rows] = p[rows].add_(update, alpha=-group['lr']).div_(1 + group['lr'] * group['weight_decay'])
+        state['pre_grad'][rows] = grad
+        state['seen'][rows] = True
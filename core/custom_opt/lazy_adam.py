@@ -0,0 +1,82 @@
+import math
+import torch
+from torch.optim.optimizer import Optimizer
+
+
+class LazyAdam(Optimizer):
+    """
+    Implements Adam updating only rows of parameters referenced by sparse gradients, e.g. weights of
+    torch.nn.Embedding(..., sparse=True). Moments of other rows are neither decayed nor applied, as in
+    torch.optim.SparseAdam. Parameters having dense gradients are updated as in torch.optim.Adam.
+
+    Arguments:
+        params (iterable): iterable of parameters to optimize or dicts defining parameter groups.
+        lr (float, optional): learning rate. (default: 1e-3)
+        betas (Tuple[float, float], optional): coefficients used for computing
+            running averages of gradient and its square. (default: (0.9, 0.999))
+        eps (float, optional): term added to the denominator to improve
+            numerical stability. (default: 1e-8)
+        weight_decay (float, optional): L2 penalty added to gradients of updated rows (default: 0)
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.0):
+        if not 0.0 <= lr:
+            raise ValueError("Invalid learning rate: {}".format(lr))
+        if not 0.0 <= eps:
+            raise ValueError("Invalid epsilon value: {}".format(eps))
+        if not 0.0 <= betas[0] < 1.0:
+            raise ValueError("Invalid beta parameter at index 0: {}".format(betas[0]))
+        if not 0.0 <= betas[1] < 1.0:
+            raise ValueError("Invalid beta parameter at index 1: {}".format(betas[1]))
+        if not 0.0 <= weight_decay:
+            raise ValueError("Invalid weight_decay value: {}".format(weight_decay))
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super(LazyAdam, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        """
+            Performs a single optimization step.
+        """
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                    state['exp_avg_sq'] = torch.zeros_like(p, memory_format=torch.preserve_format)
+                state['step'] += 1
+                bias_correction1 = 1.0 - beta1 ** state['step']
+                bias_correction2 = 1.0 - beta2 ** state['step']
+                step_size = group['lr'] / bias_correction1
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+
+                if p.grad.is_sparse:
+                    # (1) Rows referenced in the batch and their summed gradients.
+                    grad = p.grad.coalesce()
+                    rows, grad = grad._indices()[0], grad._values()
+                    if group['weight_decay'] != 0:
+                        grad = grad.add(p[rows], alpha=group['weight_decay'])
+                    # (2) Update moments and parameters of (1).
+                    exp_avg_rows = exp_avg[rows].mul_(beta1).add_(grad, alpha=1 - beta1)
+                    exp_avg_sq_rows = exp_avg_sq[rows].mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    exp_avg[rows], exp_avg_sq[rows] = exp_avg_rows, exp_avg_sq_rows
+                    denom = (exp_avg_sq_rows.sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+                    p.index_add_(0, rows, exp_avg_rows.div_(denom), alpha=-step_size)
+                else:
+                    grad = p.grad
+                    if group['weight_decay'] != 0:
+                        grad = grad.add(p, alpha=group['weight_decay'])
+                    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    denom = (exp_avg_sq.sqrt() / math.sqrt(bias_correction2)).add_(group['eps'])
+                    p.addcdiv_(exp_avg, denom, value=-step_size)
+        return loss
@@ -7,7 +7,100 @@ import torch
 import pytorch_lightning as pl
 from torch.utils.data import DataLoader
 from typing import List
-import random
+import os
+import multiprocessing.util
+from .filter_index import FilterIndex
+from .vocabulary import ParquetVocabulary
+
+
+def shared_tensor(array, dtype=torch.int32) -> torch.Tensor:
+    """ Copy an array into a tensor in shared memory. DataLoader workers attach to shared tensors without copying,
+    i.e., neither pickling nor copy-on-write of Python objects multiplies the memory usage by the number of workers """
+    return torch.as_tensor(np.ascontiguousarray(array)).to(dtype).share_memory_()
+
+
+def memory_usage() -> dict:
+    """ Resident set size (RSS), proportional set size (PSS) and unique set size (USS) of the current process in MB.
+    Pages of shared tensors are counted in RSS but not in USS. Empty if /proc/self/smaps_rollup is not available """
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as reader:
+            fields = {line.split(':')[0]: int(line.split()[1]) for line in reader.readlines()[1:]}
+    except (OSError, ValueError, IndexError):
+        return dict()
+    return {'RSS': fields['Rss'] / 1024, 'PSS': fields['Pss'] / 1024,
+            'USS': (fields['Private_Clean'] + fields['Private_Dirty']) / 1024}
+
+
+def report_memory_usage(worker_id: int) -> None:
+    usage = memory_usage()
+    if usage:
+        print(f'DataLoader worker {worker_id} (pid {os.getpid()}): ' + ' '.join(
+            f'{k}: {v:.1f} MB' for k, v in usage.items()))
+
+
+def worker_init_fn(worker_id: int) -> None:
+    """ Report the memory usage of a DataLoader worker when it exits, see --report_worker_memory """
+    multiprocessing.util.Finalize(None, report_memory_usage, args=(worker_id,), exitpriority=0)
+
+
+class SparseTargets:
+    """ Multi-label targets of a batch in compressed sparse row (CSR) format.
+    Labels of the i-th data point are indices[offsets[i]:offsets[i + 1]], i.e. only positive indices are collated
+    in DataLoader workers and sent to the main process. The dense (batch size, target_dim) matrix never crosses
+    process boundaries; if a loss requires it, to_dense() constructs it in one scatter """
+
+    def __init__(self, offsets: torch.LongTensor, indices: torch.LongTensor, target_dim: int,
+                 label_smoothing_rate: float = None):
+        assert len(offsets) > 0 and offsets[-1] == len(indices)
+        self.offsets = offsets
+        self.indices = indices
+        self.target_dim = target_dim
+        self.label_smoothing_rate = label_smoothing_rate
+
+    @classmethod
+    def from_positives(cls, positives: List[torch.Tensor], target_dim: int,
+                       label_smoothing_rate: float = None) -> 'SparseTargets':
+        """
+        :param positives: a tensor of unique positive indices per data point
+        :param target_dim: number of classes, e.g. |E|
+        :param label_smoothing_rate:
+        :return:
+        """
+        offsets = torch.zeros(len(positives) + 1, dtype=torch.long)
+        torch.cumsum(torch.tensor([len(i) for i in positives], dtype=torch.long), dim=0, out=offsets[1:])
+        return cls(offsets=offsets, indices=torch.cat(positives).long(), target_dim=target_dim,
+                   label_smoothing_rate=label_smoothing_rate)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def shape(self) -> torch.Size:
+        return torch.Size((len(self), self.target_dim))
+
+    @property
+    def device(self) -> torch.device:
+        return self.indices.device
+
+    def to(self, *args, **kwargs) -> 'SparseTargets':
+        return SparseTargets(offsets=self.offsets.to(*args, **kwargs), indices=self.indices.to(*args, **kwargs),
+                             target_dim=self.target_dim, label_smoothing_rate=self.label_smoothing_rate)
+
+    def pin_memory(self) -> 'SparseTargets':
+        return SparseTargets(offsets=self.offsets.pin_memory(), indices=self.indices.pin_memory(),
+                             target_dim=self.target_dim, label_smoothing_rate=self.label_smoothing_rate)
+
+    def row_indices(self) -> torch.LongTensor:
+        """ Row index of each positive index """
+        return torch.repeat_interleave(torch.arange(len(self), device=self.device), self.offsets.diff())
+
+    def to_dense(self, dtype=torch.float32) -> torch.FloatTensor:
+        """ Construct the (batch size, target_dim) target matrix in one scatter """
+        y = torch.zeros(self.shape, dtype=dtype, device=self.device)
+        y[self.row_indices(), self.indices] = 1
+        if self.label_smoothing_rate:
+            y = y * (1 - self.label_smoothing_rate) + (1 / self.target_dim)
+        return y
 
 
 class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
@@ -15,7 +108,7 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
 
     def __init__(self, train_set_idx, entity_to_idx, relation_to_idx, batch_size, form,
                  num_workers=32, valid_set_idx=None, test_set_idx=None, neg_sample_ratio=None,
-                 label_smoothing_rate=None):
+                 label_smoothing_rate=None, report_worker_memory=False):
         super().__init__()
         assert isinstance(train_set_idx, np.ndarray)
 
@@ -26,7 +119,7 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
             if len(test_set_idx) > 0:
                 assert isinstance(test_set_idx, np.ndarray)
 
-        assert isinstance(entity_to_idx, dict)
+        assert isinstance(entity_to_idx, (dict, ParquetVocabulary))
         assert isinstance(relation_to_idx, dict)
 
         self.train_set_idx = train_set_idx
@@ -39,6 +132,7 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
         self.form = form
         self.batch_size = batch_size
         self.num_workers = num_workers
+        self.worker_init_fn = worker_init_fn if report_worker_memory else None
 
         print('Number of workers will be used at batching:', self.num_workers)
         self.neg_sample_ratio = neg_sample_ratio
@@ -88,15 +182,17 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
                                                 num_entities=len(self.entity_to_idx),
                                                 num_relations=len(self.relation_to_idx),
                                                 neg_sample_ratio=self.neg_sample_ratio)
-            return DataLoader(train_set, batch_size=self.batch_size, shuffle=True,
-                              num_workers=self.num_workers, collate_fn=train_set.collate_fn)
+            return train_set.batch_loader(batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers,
+                                          worker_init_fn=self.worker_init_fn)
         elif self.form == 'EntityPrediction' or self.form == 'RelationPrediction':
             train_set = KvsAll(self.train_set_idx, entity_idxs=self.entity_to_idx,
                                relation_idxs=self.relation_to_idx, form=self.form,
                                label_smoothing_rate=self.label_smoothing_rate)
-            return DataLoader(train_set, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers)
+            return DataLoader(train_set, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers,
+                              collate_fn=train_set.collate_fn, worker_init_fn=self.worker_init_fn)
         elif self.form in ['KvsSample', 'PvsAll', 'CCvsAll', '1VsAll', 'BatchRelaxedKvsAll', 'BatchRelaxed1vsAll']:
-            return DataLoader(self.dataset, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers)
+            return DataLoader(self.dataset, batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers,
+                              collate_fn=self.dataset.collate_fn, worker_init_fn=self.worker_init_fn)
         else:
             raise KeyError(f'{self.form} illegal input.')
 
@@ -106,15 +202,14 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
                                                 num_entities=len(self.entity_to_idx),
                                                 num_relations=len(self.relation_to_idx),
                                                 neg_sample_ratio=0)
-            return DataLoader(valid_set, batch_size=self.batch_size,
-                              shuffle=False,
-                              num_workers=self.num_workers,
-                              collate_fn=valid_set.collate_fn)
+            return valid_set.batch_loader(batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers,
+                                          worker_init_fn=self.worker_init_fn)
         elif self.form == 'EntityPrediction' or self.form == 'RelationPrediction':
             valid_set = KvsAll(self.valid_set_idx, entity_idxs=self.entity_to_idx,
                                relation_idxs=self.relation_to_idx, form=self.form,
                                label_smoothing_rate=self.label_smoothing_rate)
-            return DataLoader(valid_set, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers)
+            return DataLoader(valid_set, batch_size=self.batch_size, shuffle=False, num_workers=self.num_workers,
+                              collate_fn=valid_set.collate_fn)
 
         elif self.form == '1VsAll':
             return DataLoader(OneVsAllEntityPredictionDataset(self.valid_set_idx), batch_size=self.batch_size,
@@ -133,7 +228,8 @@ class StandardDataModule(pl.LightningDataModule, metaclass=ABCMeta):
         elif self.form == 'EntityPrediction':
             test_set = KvsAll(self.test_set_idx, entity_idxs=self.entity_to_idx,
                               relation_idxs=self.relation_to_idx, form=self.form)
-            return DataLoader(test_set, batch_size=self.batch_size, num_workers=self.num_workers)
+            return DataLoader(test_set, batch_size=self.batch_size, num_workers=self.num_workers,
+                              collate_fn=test_set.collate_fn)
         else:
             raise KeyError(f'{self.form} illegal input.')
 
@@ -167,10 +263,7 @@ class CVDataModule(pl.LightningDataModule):
                                             num_entities=self.num_entities,
                                             num_relations=self.num_relations,
                                             neg_sample_ratio=self.neg_sample_ratio)
-        return DataLoader(train_set, batch_size=self.batch_size,
-                          shuffle=True,
-                          num_workers=self.num_workers,
-                          collate_fn=train_set.collate_fn)
+        return train_set.batch_loader(batch_size=self.batch_size, shuffle=True, num_workers=self.num_workers)
 
     def setup(self, *args, **kwargs):
         pass
@@ -187,17 +280,20 @@ class OnevsAllDataset(Dataset):
     def __init__(self, train_set_idx, entity_idxs, relation_idxs, form):
         super().__init__()
         assert len(train_set_idx) > 0
-        self.train_data = torch.torch.LongTensor(train_set_idx)
+        self.train_data = shared_tensor(train_set_idx)
         self.target_dim = len(entity_idxs)
 
     def __len__(self):
         return len(self.train_data)
 
     def __getitem__(self, idx):
-        y_vec = torch.zeros(self.target_dim)
-        y_vec[self.train_data[idx, 2]] = 1
+        triple = self.train_data[idx].long()
+        # The index of the tail entity, see collate_fn.
+        return triple[:2], triple[2:]
 
-        return self.train_data[idx, :2], y_vec
+    def collate_fn(self, batch):
+        x, positives = zip(*batch)
+        return torch.stack(x), SparseTargets.from_positives(positives, target_dim=self.target_dim)
 
 
 class KvsAll(Dataset):
@@ -209,57 +305,43 @@ class KvsAll(Dataset):
         super().__init__()
         assert len(triples_idx) > 0
         self.train_data = None
-        self.train_target = None
+        self.target_offsets = None
+        self.target_values = None
         self.label_smoothing_rate = label_smoothing_rate
-        self.collate_fn = None
 
-        # (1) Create a dictionary of training data pints
+        # (1) Create a CSR index of training data points
         # Either from tuple of entities or tuple of an entity and a relation
         if store is None:
-            store = dict()
             if form == 'RelationPrediction':
                 self.target_dim = len(relation_idxs)
-                for s_idx, p_idx, o_idx in triples_idx:
-                    store.setdefault((s_idx, o_idx), list()).append(p_idx)
+                store = FilterIndex.from_triples(triples_idx, key_columns=(0, 2), value_column=1)
             elif form == 'EntityPrediction':
                 self.target_dim = len(entity_idxs)
-                for s_idx, p_idx, o_idx in triples_idx:
-                    store.setdefault((s_idx, p_idx), list()).append(o_idx)
+                store = FilterIndex.from_triples(triples_idx, key_columns=(0, 1), value_column=2)
             else:
                 raise NotImplementedError
         else:
             raise ValueError()
         assert len(store) > 0
         # Keys in store correspond to integer representation (index) of subject and predicate
-        # Values correspond to a list of integer representations of entities.
-        self.train_data = torch.torch.LongTensor(list(store.keys()))
-
-        if sum([len(i) for i in store.values()]) == len(store):
-            # if each s,p pair contains at most 1 entity
-            self.train_target = np.array(list(store.values()), dtype=np.int64)
-            try:
-                assert isinstance(self.train_target[0], np.ndarray)
-            except IndexError or AssertionError:
-                print(self.train_target)
-                exit(1)
-            assert isinstance(self.train_target[0][0], np.int64)
-        else:
-            self.train_target = list(store.values())
-            assert isinstance(self.train_target[0], list)
+        # Values correspond to integer representations of entities.
+        # (2) Keys, offsets and values of (1) are kept in shared memory.
+        self.train_data = shared_tensor(store.keys())
+        self.target_offsets = shared_tensor(store.offsets, dtype=torch.int64)
+        self.target_values = shared_tensor(store.values)
         del store
 
     def __len__(self):
-        assert len(self.train_data) == len(self.train_target)
         return len(self.train_data)
 
     def __getitem__(self, idx):
-        # 1. Initialize a vector of output.
-        y_vec = torch.zeros(self.target_dim)
-        y_vec[self.train_target[idx]] = 1
+        # Indexes of positive labels, see collate_fn.
+        return self.train_data[idx].long(), self.target_values[self.target_offsets[idx]:self.target_offsets[idx + 1]]
 
-        if self.label_smoothing_rate:
-            y_vec = y_vec * (1 - self.label_smoothing_rate) + (1 / y_vec.size(0))
-        return self.train_data[idx], y_vec
+    def collate_fn(self, batch):
+        x, positives = zip(*batch)
+        return torch.stack(x), SparseTargets.from_positives(positives, target_dim=self.target_dim,
+                                                            label_smoothing_rate=self.label_smoothing_rate)
 
 
 class KvsSampleDataset(Dataset):
@@ -271,53 +353,36 @@ class KvsSampleDataset(Dataset):
                  label_smoothing_rate=None):
         super().__init__()
         assert len(triples_idx) > 0
-        self.train_data = None
-        self.train_target = None
         self.label_smoothing_rate = label_smoothing_rate
         self.neg_sample_ratio = neg_sample_ratio
         self.collate_fn = None
         assert self.neg_sample_ratio > 0
-        store = dict()
         self.num_entities = len(entity_idxs)
-        for s_idx, p_idx, o_idx in triples_idx:
-            store.setdefault((s_idx, p_idx), list()).append(o_idx)
-
+        # (1) Create a CSR index from (head entity, relation) pairs to tail entities.
+        store = FilterIndex.from_triples(triples_idx, key_columns=(0, 1), value_column=2)
         assert len(store) > 0
-        # Keys in store correspond to integer representation (index) of subject and predicate
-        # Values correspond to a list of integer representations of entities.
-        self.train_data = torch.torch.LongTensor(list(store.keys()))
-
-        if sum([len(i) for i in store.values()]) == len(store):
-            # if each s,p pair contains at most 1 entity
-            self.train_target = np.array(list(store.values()), dtype=np.int64)
-            try:
-                assert isinstance(self.train_target[0], np.ndarray)
-            except IndexError or AssertionError:
-                print(self.train_target)
-                exit(1)
-            assert isinstance(self.train_target[0][0], np.int64)
-        else:
-            self.train_target = list(store.values())
-            assert isinstance(self.train_target[0], list)
+        # (2) Keys, offsets and values of (1) are kept in shared memory.
+        self.train_data = shared_tensor(store.keys())
+        self.target_offsets = shared_tensor(store.offsets, dtype=torch.int64)
+        self.target_values = shared_tensor(store.values)
         del store
 
     def __len__(self):
-        assert len(self.train_data) == len(self.train_target)
         return len(self.train_data)
 
     def __getitem__(self, idx):
         # (1) Get ith unique (head,relation) pair
-        x = self.train_data[idx]
+        x = self.train_data[idx].long()
         # (2) Get tail entities given (1)
-        positives_idx = self.train_target[idx]
-        num_positives = len(positives_idx)
+        start, end = self.target_offsets[idx], self.target_offsets[idx + 1]
+        num_positives = int(end - start)
         # (3) Subsample positive examples to generate a batch of same sized inputs
         if num_positives < self.neg_sample_ratio:
-            positives_idx = random.choices(positives_idx, k=self.neg_sample_ratio)
+            selected = torch.randint(low=0, high=num_positives, size=(self.neg_sample_ratio,))
         else:
-            positives_idx = random.sample(positives_idx, self.neg_sample_ratio)
+            selected = torch.randperm(num_positives)[:self.neg_sample_ratio]
         # (3) Obtain LongTensor
-        positives_idx = torch.LongTensor(positives_idx)
+        positives_idx = self.target_values[start:end][selected].long()
         # (4) Generate random entities
         # TODO: Sample based on a given relation. Not randomly ?
         negative_idx = torch.randint(low=0, high=self.num_entities, size=(self.neg_sample_ratio,))
@@ -337,50 +402,40 @@ class BatchRelaxedKvsAllDataset(Dataset):
         super().__init__()
         assert len(triples_idx) > 0
         self.train_data = None
-        self.train_target = None
+        self.target_offsets = None
+        self.target_values = None
         self.range_of_relations = dict()
 
-        # (1) Create a dictionary of training data pints
-        # Either from tuple of entitiies or tuple of an entity and a relation
+        # (1) Create a CSR index of training data points from tuple of an entity and a relation
         if store is None:
-            store = dict()
             self.target_dim = len(entity_idxs)
+            store = FilterIndex.from_triples(triples_idx, key_columns=(0, 1), value_column=2)
             for s_idx, p_idx, o_idx in triples_idx:
-                store.setdefault((s_idx, p_idx), list()).append(o_idx)
                 self.range_of_relations.setdefault(p_idx, set()).add(o_idx)
+        else:
+            raise ValueError()
 
         for k, v in self.range_of_relations.items():
             self.range_of_relations[k] = list(v)
 
         # Keys in store correspond to integer representation (index) of subject and predicate
-        # Values correspond to a list of integer representations of entities.
-        self.train_data = torch.torch.LongTensor(list(store.keys()))
-
-        if sum([len(i) for i in store.values()]) == len(store):
-            # if each s,p pair contains at most 1 entity
-            self.train_target = np.array(list(store.values()), dtype=np.int64)
-            try:
-                assert isinstance(self.train_target[0], np.ndarray)
-            except IndexError or AssertionError:
-                print(self.train_target)
-                exit(1)
-            assert isinstance(self.train_target[0][0], np.int64)
-        else:
-            self.train_target = list(store.values())
-            assert isinstance(self.train_target[0], list)
+        # Values correspond to integer representations of entities.
+        self.train_data = shared_tensor(store.keys())
+        self.target_offsets = shared_tensor(store.offsets, dtype=torch.int64)
+        self.target_values = shared_tensor(store.values)
         del store
 
     def __len__(self):
-        assert len(self.train_data) == len(self.train_target)
         return len(self.train_data)
 
     def __getitem__(self, idx):
-        # 1. Initialize a vector of output.
-        y_vec = torch.zeros(self.target_dim)
         # _, rel = self.train_data[idx]
         # y_vec[self.range_of_relations[rel.item()]] = .0001
-        y_vec[self.train_target[idx]] = 1.0
-        return self.train_data[idx], y_vec
+        return self.train_data[idx].long(), self.target_values[self.target_offsets[idx]:self.target_offsets[idx + 1]]
+
+    def collate_fn(self, batch):
+        x, positives = zip(*batch)
+        return torch.stack(x), SparseTargets.from_positives(positives, target_dim=self.target_dim)
 
 
 class BatchRelaxed1vsAllDataset(Dataset):
@@ -402,12 +457,36 @@ class BatchRelaxed1vsAllDataset(Dataset):
         return len(self.train_data)
 
     def __getitem__(self, idx):
-        y_vec = torch.zeros(self.target_dim)
         idx_triple = self.train_data[idx]
-        x, y = idx_triple[:2], idx_triple[2]
+        x, y = idx_triple[:2], idx_triple[2:]
         # y_vec[self.range_of_relations[x[1].item()]] = .0001
-        y_vec[y] = 1
-        return x, y_vec
+        return x, y
+
+    def collate_fn(self, batch):
+        x, positives = zip(*batch)
+        return torch.stack(x), SparseTargets.from_positives(positives, target_dim=self.target_dim)
+
+
+class BatchIndexSampler(torch.utils.data.Sampler):
+    """ Yield a LongTensor of indexes per batch. Used with DataLoader(batch_size=None), a dataset receives
+    indexes of a whole batch and slices it at once instead of being called per data point """
+
+    def __init__(self, num_data_points: int, batch_size: int, shuffle: bool = True, drop_last: bool = False):
+        assert num_data_points > 0 and batch_size > 0
+        self.num_data_points = num_data_points
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        indexes = torch.randperm(self.num_data_points) if self.shuffle else torch.arange(self.num_data_points)
+        for start in range(0, len(self) * self.batch_size, self.batch_size):
+            yield indexes[start:start + self.batch_size]
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_data_points // self.batch_size
+        return (self.num_data_points + self.batch_size - 1) // self.batch_size
 
 
 class TriplePredictionDataset(Dataset):
@@ -432,9 +511,10 @@ class TriplePredictionDataset(Dataset):
         print('Initializing negative sampling dataset batching...', end='\t')
         self.soft_confidence_rate = soft_confidence_rate
         self.neg_sample_ratio = neg_sample_ratio  # 0 Implies that we do not add negative samples. This is needed during testing and validation
-        self.triples_idx = triples_idx
+        # Triples are kept in shared memory.
+        self.triples_idx = shared_tensor(triples_idx)
 
-        assert num_entities >= max(triples_idx[:, 0]) and num_entities >= max(triples_idx[:, 2])
+        assert num_entities >= self.triples_idx[:, 0].max() and num_entities >= self.triples_idx[:, 2].max()
         # assert num_relations > max(self.rel_idx)
         self.length = len(self.triples_idx)
         self.num_entities = num_entities
@@ -445,10 +525,19 @@ class TriplePredictionDataset(Dataset):
         return self.length
 
     def __getitem__(self, idx):
+        # idx can be an integer or a LongTensor of indexes of a batch, see BatchIndexSampler.
         return self.triples_idx[idx]
 
+    def batch_loader(self, batch_size: int, shuffle: bool = True, num_workers: int = 0, **kwargs) -> DataLoader:
+        """ DataLoader slicing a batch of triples at once via self[indexes] and
+        generating negatives of the batch in one vectorized call of collate_fn. kwargs are passed to DataLoader,
+        e.g. worker_init_fn """
+        return DataLoader(self, sampler=BatchIndexSampler(len(self), batch_size, shuffle=shuffle), batch_size=None,
+                          num_workers=num_workers, collate_fn=self.collate_fn, **kwargs)
+
     def collate_fn(self, batch):
-        batch = torch.LongTensor(batch)
+        # (1) A (n,3) tensor if batches are sliced at once, otherwise a list of triples.
+        batch = batch.long() if isinstance(batch, torch.Tensor) else torch.stack(batch).long()
         h, r, t = batch[:, 0], batch[:, 1], batch[:, 2]
         size_of_batch, _ = batch.shape
         assert size_of_batch > 0
@@ -24,6 +24,8 @@ class Evaluator:
         if isinstance(self.executor.args.eval, bool):
             print('Wrong input:RESET')
             self.executor.args.eval = 'train_val_test'
+        # Dropout and normalization of embeddings are folded into embedding tables once.
+        trained_model = trained_model.export_for_inference()
 
         if self.executor.args.scoring_technique == 'NegSample':
             self.eval_rank_of_head_and_tail_entity(trained_model)
@@ -86,70 +88,38 @@ class Evaluator:
         """
         # (1) set model to eval model
         model.eval()
-        hits = []
         ranks = []
         if info:
             print(info + ':', end=' ')
-        for i in range(10):
-            hits.append([])
-
+        use_constraint = isinstance(self.executor.args.eval, str) and 'constraint' in self.executor.args.eval
         # (2) Evaluation mode
-        if form_of_labelling == 'RelationPrediction':
-            # Iterate over integer indexed triples in mini batch fashion
-            for i in range(0, len(triple_idx), self.executor.args.batch_size):
-                data_batch = triple_idx[i:i + self.executor.args.batch_size]
-                e1_idx_e2_idx, r_idx = torch.LongTensor(data_batch[:, [0, 2]]), torch.LongTensor(data_batch[:, 1])
-                # Generate predictions
-                predictions = model.forward_k_vs_all(x=e1_idx_e2_idx)
-                # Filter entities except the target entity
-                for j in range(data_batch.shape[0]):
-                    filt = self.executor.dataset.ee_vocab[(data_batch[j][0], data_batch[j][2])]
-                    target_value = predictions[j, r_idx[j]].item()
-                    predictions[j, filt] = -np.Inf
-                    predictions[j, r_idx[j]] = target_value
-                # Sort predictions.
-                sort_values, sort_idxs = torch.sort(predictions, dim=1, descending=True)
-                # This can be also done in parallel
-                for j in range(data_batch.shape[0]):
-                    rank = torch.where(sort_idxs[j] == r_idx[j])[0].item()
-                    ranks.append(rank + 1)
-
-                    for hits_level in range(10):
-                        if rank <= hits_level:
-                            hits[hits_level].append(1.0)
-
-        else:
-            # TODO: Why do not we use Pytorch Dataset ? for multiprocessing
-            # Iterate over integer indexed triples in mini batch fashion
-            for i in range(0, len(triple_idx), self.executor.args.batch_size):
-                data_batch = triple_idx[i:i + self.executor.args.batch_size]
-                e1_idx_r_idx, e2_idx = torch.LongTensor(data_batch[:, [0, 1]]), torch.tensor(data_batch[:, 2])
-                with torch.no_grad():
-                    predictions = model(e1_idx_r_idx)
-                # Filter entities except the target entity
-                for j in range(data_batch.shape[0]):
-                    filt = self.executor.dataset.er_vocab[(data_batch[j][0], data_batch[j][1])]
-                    target_value = predictions[j, e2_idx[j]].item()
-                    predictions[j, filt] = -np.Inf
-                    # 3.3.1 Filter entities outside of the range
-                    # TODO: Fix it CV resets from str to boolean
-                    if 'constraint' in self.executor.args.eval:
-                        predictions[j, self.executor.dataset.range_constraints_per_rel[data_batch[j, 1]]] = -np.Inf
-                    predictions[j, e2_idx[j]] = target_value
-                # Sort predictions.
-                sort_values, sort_idxs = torch.sort(predictions, dim=1, descending=True)
-                # This can be also done in paralel
-                for j in range(data_batch.shape[0]):
-                    rank = torch.where(sort_idxs[j] == e2_idx[j])[0].item()
-                    ranks.append(rank + 1)
-
-                    for hits_level in range(10):
-                        if rank <= hits_level:
-                            hits[hits_level].append(1.0)
-        hit_1 = sum(hits[0]) / (float(len(triple_idx)))
-        hit_3 = sum(hits[2]) / (float(len(triple_idx)))
-        hit_10 = sum(hits[9]) / (float(len(triple_idx)))
-        mean_reciprocal_rank = np.mean(1. / np.array(ranks))
+        # Iterate over integer indexed triples in mini batch fashion
+        for i in range(0, len(triple_idx), self.executor.args.batch_size):
+            data_batch = triple_idx[i:i + self.executor.args.batch_size]
+            if form_of_labelling == 'RelationPrediction':
+                x, target_idx = torch.LongTensor(data_batch[:, [0, 2]]), torch.LongTensor(data_batch[:, 1])
+                # Relations to be filtered except the target relation
+                rows, cols = self.executor.dataset.ee_vocab.coordinates(data_batch[:, [0, 2]])
+            else:
+                x, target_idx = torch.LongTensor(data_batch[:, [0, 1]]), torch.LongTensor(data_batch[:, 2])
+                # Entities to be filtered except the target entity
+                rows, cols = self.executor.dataset.er_vocab.coordinates(data_batch[:, [0, 1]])
+                # Filter entities outside of the range
+                if use_constraint:
+                    rows, cols = self.merge_coordinates(
+                        (rows, cols), self.executor.dataset.range_constraints_per_rel.coordinates(data_batch[:, 1]))
+            # Generate predictions
+            with torch.no_grad():
+                if form_of_labelling == 'RelationPrediction':
+                    predictions = model.forward_k_vs_all(x=x)
+                else:
+                    predictions = model(x)
+            # Filter in one scatter and count the scores at least as high as the score of the target.
+            ranks.append(self.filtered_ranks(predictions, target_idx, rows, cols))
+        ranks = torch.cat(ranks).double()
+        hit_1, hit_3, hit_10 = [(ranks <= hits_level).sum().item() / (float(len(triple_idx)))
+                                for hits_level in [1, 3, 10]]
+        mean_reciprocal_rank = (1. / ranks).mean().item()
 
         results = {'H@1': hit_1, 'H@3': hit_3, 'H@10': hit_10, 'MRR': mean_reciprocal_rank}
         if info:
@@ -162,7 +132,11 @@ class Evaluator:
 
         for each triple
         the rank is computed by taking the mean of the filtered missing head entity rank and
-        the filtered missing tail entity rank
+        the filtered missing tail entity rank.
+
+        Test triples are processed in mini-batches. Each triple of a mini-batch is scored against all entities,
+        filtered entities are masked in one scatter and
+        the filtered rank of the target is one plus the number of entities having a higher score.
         :param model:
         :param triple_idx:
         :param info:
@@ -171,108 +145,121 @@ class Evaluator:
         model.eval()
         print(info)
         print(f'Num of triples {len(triple_idx)}')
-        print('** sequential computation ')
-        hits = dict()
-        reciprocal_ranks = []
-        # Iterate over test triples
-        all_entities = torch.arange(0, self.executor.dataset.num_entities).long()
-        all_entities = all_entities.reshape(len(all_entities), )
-        # Iterating one by one is not good when you are using batch norm
-        for i in range(0, len(triple_idx)):
-            # 1. Get a triple
-            data_point = triple_idx[i]
-            s, p, o = data_point[0], data_point[1], data_point[2]
-
-            # 2. Predict missing heads and tails
-            x = torch.stack((torch.tensor(s).repeat(self.executor.dataset.num_entities, ),
-                             torch.tensor(p).repeat(self.executor.dataset.num_entities, ),
-                             all_entities
-                             ), dim=1)
-            predictions_tails = model.forward_triples(x)
-            x = torch.stack((all_entities,
-                             torch.tensor(p).repeat(self.executor.dataset.num_entities, ),
-                             torch.tensor(o).repeat(self.executor.dataset.num_entities)
-                             ), dim=1)
-
-            predictions_heads = model.forward_triples(x)
-            del x
+        num_entities = self.executor.dataset.num_entities
+        batch_size, entity_chunk_size = self.eval_batch_and_chunk_sizes(num_entities)
+        print(f'** batched computation: {batch_size} triples per batch, {entity_chunk_size} entities per forward pass')
+        use_constraint = isinstance(self.executor.args.eval, str) and 'constraint' in self.executor.args.eval
+        head_ranks, tail_ranks = [], []
+        triple_idx = torch.LongTensor(np.asarray(triple_idx))
+        with torch.no_grad():
+            for i in range(0, len(triple_idx), batch_size):
+                # 1. Get a batch of triples
+                data_batch = triple_idx[i:i + batch_size]
+                s, p, o = data_batch[:, 0], data_batch[:, 1], data_batch[:, 2]
+                # 2. Predict missing heads and tails
+                predictions_tails = self.score_missing_entities(model, data_batch, 2, num_entities, entity_chunk_size)
+                predictions_heads = self.score_missing_entities(model, data_batch, 0, num_entities, entity_chunk_size)
 
-            # 3. Computed filtered ranks for missing tail entities.
-            # 3.1. Compute filtered tail entity rankings
-            filt_tails = self.executor.dataset.er_vocab[(s, p)]
-            # 3.2 Get the predicted target's score
-            target_value = predictions_tails[o].item()
-            # 3.3 Filter scores of all triples containing filtered tail entities
-            predictions_tails[filt_tails] = -np.Inf
-            # 3.3.1 Filter entities outside of the range
-            if 'constraint' in self.executor.args.eval:
-                predictions_tails[self.executor.dataset.range_constraints_per_rel[p]] = -np.Inf
-            # 3.4 Reset the target's score
-            predictions_tails[o] = target_value
-            # 3.5. Sort the score
-            _, sort_idxs = torch.sort(predictions_tails, descending=True)
-            # sort_idxs = sort_idxs.cpu().numpy()
-            sort_idxs = sort_idxs.detach()  # cpu().numpy()
-            filt_tail_entity_rank = np.where(sort_idxs == o)[0][0]
+                # 3. Computed filtered ranks for missing tail entities.
+                # 3.1. Retrieve tail entities to be filtered
+                rows, cols = self.executor.dataset.er_vocab.coordinates(data_batch[:, [0, 1]])
+                # 3.1.1 Filter entities outside of the range
+                if use_constraint:
+                    rows, cols = self.merge_coordinates(
+                        (rows, cols), self.executor.dataset.range_constraints_per_rel.coordinates(p))
+                tail_ranks.append(self.filtered_ranks(predictions_tails, o, rows, cols))
 
-            # 4. Computed filtered ranks for missing head entities.
-            # 4.1. Retrieve head entities to be filtered
-            filt_heads = self.executor.dataset.re_vocab[(p, o)]
-            # filt_heads = data[(data['relation'] == p) & (data['object'] == o)]['subject'].values
-            # 4.2 Get the predicted target's score
-            target_value = predictions_heads[s].item()
-            # 4.3 Filter scores of all triples containing filtered head entities.
-            predictions_heads[filt_heads] = -np.Inf
-            if isinstance(self.executor.args.eval, bool) is False:
-                if 'constraint' in self.executor.args.eval:
-                    # 4.3.1 Filter entities that are outside the domain
-                    predictions_heads[self.executor.dataset.domain_constraints_per_rel[p]] = -np.Inf
-            predictions_heads[s] = target_value
-            _, sort_idxs = torch.sort(predictions_heads, descending=True)
-            # sort_idxs = sort_idxs.cpu().numpy()
-            sort_idxs = sort_idxs.detach()  # cpu().numpy()
-            filt_head_entity_rank = np.where(sort_idxs == s)[0][0]
-
-            # 4. Add 1 to ranks as numpy array first item has the index of 0.
-            filt_head_entity_rank += 1
-            filt_tail_entity_rank += 1
-
-            rr = 1.0 / filt_head_entity_rank + (1.0 / filt_tail_entity_rank)
-            # 5. Store reciprocal ranks.
-            reciprocal_ranks.append(rr)
-            # print(f'{i}.th triple: mean reciprical rank:{rr}')
-
-            # 4. Compute Hit@N
-            for hits_level in range(1, 11):
-                I = 1 if filt_head_entity_rank <= hits_level else 0
-                I += 1 if filt_tail_entity_rank <= hits_level else 0
-                if I > 0:
-                    hits.setdefault(hits_level, []).append(I)
-
-        mean_reciprocal_rank = sum(reciprocal_ranks) / (float(len(triple_idx) * 2))
-
-        if 1 in hits:
-            hit_1 = sum(hits[1]) / (float(len(triple_idx) * 2))
-        else:
-            hit_1 = 0
-
-        if 3 in hits:
-            hit_3 = sum(hits[3]) / (float(len(triple_idx) * 2))
-        else:
-            hit_3 = 0
-
-        if 10 in hits:
-            hit_10 = sum(hits[10]) / (float(len(triple_idx) * 2))
-        else:
-            hit_10 = 0
+                # 4. Computed filtered ranks for missing head entities.
+                # 4.1. Retrieve head entities to be filtered
+                rows, cols = self.executor.dataset.re_vocab.coordinates(data_batch[:, [1, 2]])
+                # 4.1.1 Filter entities that are outside the domain
+                if use_constraint:
+                    rows, cols = self.merge_coordinates(
+                        (rows, cols), self.executor.dataset.domain_constraints_per_rel.coordinates(p))
+                head_ranks.append(self.filtered_ranks(predictions_heads, s, rows, cols))
+                del predictions_tails, predictions_heads
 
+        head_ranks, tail_ranks = torch.cat(head_ranks).double(), torch.cat(tail_ranks).double()
+        # 5. Compute Hit@N and MRR over the missing head and the missing tail entity ranks.
+        num_ranks = float(len(triple_idx) * 2)
+        mean_reciprocal_rank = ((1. / head_ranks).sum() + (1. / tail_ranks).sum()).item() / num_ranks
+        hit_1, hit_3, hit_10 = [((head_ranks <= hits_level).sum() + (tail_ranks <= hits_level).sum()).item() / num_ranks
+                                for hits_level in [1, 3, 10]]
         results = {'H@1': hit_1, 'H@3': hit_3, 'H@10': hit_10,
                    'MRR': mean_reciprocal_rank}
         print(results)
         return results
 
+    def eval_batch_and_chunk_sizes(self, num_entities: int) -> tuple:
+        """
+        Determine (1) the number of test triples scored together and
+        (2) the number of candidate entities per forward pass such that
+        the (batch x num_entities) score matrices and the (batch x chunk) input rows fit into the memory budget.
+        :param num_entities:
+        :return:
+        """
+        args = self.executor.args
+        batch_size = getattr(args, 'eval_batch_size', None) or args.batch_size
+        budget = getattr(args, 'eval_memory_budget', None)
+        if budget is None or budget <= 0:
+            return batch_size, num_entities
+        budget = budget * 1024 ** 2
+        # (1) Half of the budget is reserved for two float32 score matrices (heads and tails).
+        batch_size = int(max(1, min(batch_size, (budget // 2) // (2 * 4 * num_entities))))
+        # (2) The other half for an input row, the gathered embeddings and the intermediate representations.
+        bytes_per_row = 3 * 8 + 8 * 4 * args.embedding_dim
+        entity_chunk_size = int(max(1, min(num_entities, (budget // 2) // (batch_size * bytes_per_row))))
+        return batch_size, entity_chunk_size
+
+    @staticmethod
+    def score_missing_entities(model, data_batch: torch.LongTensor, position: int, num_entities: int,
+                               entity_chunk_size: int) -> torch.FloatTensor:
+        """
+        Score each triple of data_batch after its entity at the given position (0: head, 2: tail)
+        is replaced with every entity.
+        Candidate entities are scored in chunks via forward_triples so that
+        the normalization of tail entities of NegSample models is applied as in training.
+        :return: (batch x num_entities) scores
+        """
+        n = len(data_batch)
+        predictions = torch.empty(n, num_entities)
+        for start in range(0, num_entities, entity_chunk_size):
+            candidates = torch.arange(start, min(start + entity_chunk_size, num_entities))
+            x = data_batch.repeat_interleave(len(candidates), dim=0)
+            x[:, position] = candidates.repeat(n)
+            predictions[:, start:start + len(candidates)] = model.forward_triples(x).view(n, len(candidates))
+        return predictions
+
+    @staticmethod
+    def merge_coordinates(*coordinates) -> tuple:
+        """ Concatenate row and column indices obtained from several filter indices """
+        return torch.cat([rows for rows, _ in coordinates]), torch.cat([cols for _, cols in coordinates])
+
+    @staticmethod
+    def filtered_ranks(predictions: torch.FloatTensor, targets: torch.LongTensor, rows: torch.LongTensor,
+                       cols: torch.LongTensor) -> torch.LongTensor:
+        """
+        Compute filtered ranks without sorting.
+        (1) Save scores of targets, (2) set scores of filtered entities to -inf in one scatter,
+        (3) reset scores of targets, and (4) count entities scoring at least as high as their targets.
+        Ties are ranked pessimistically, i.e., a target is ranked after all entities having the same score, so that
+        a model assigning the same score to all entities does not obtain rank 1.
+        :param predictions: (n x num_entities) scores. Modified inplace
+        :param targets: (n,) indices of target entities
+        :param rows: row indices of entities to be filtered
+        :param cols: column indices of entities to be filtered
+        :return: (n,) ranks starting from 1
+        """
+        batch_range = torch.arange(len(targets))
+        target_values = predictions[batch_range, targets].clone()
+        predictions[rows, cols] = -np.Inf
+        predictions[batch_range, targets] = target_values
+        # Targets count themselves.
+        return (predictions >= target_values.unsqueeze(1)).sum(dim=1)
+
     def eval_with_data(self, trained_model, triple_idx: np.ndarray, form_of_labelling: str):
         """ Evaluate a trained model on a given a dataset"""
+        trained_model = trained_model.export_for_inference()
         if self.executor.args.scoring_technique == 'NegSample':
             return self.evaluate_lp(trained_model, triple_idx,
                                     info=f'Evaluate {trained_model.name} on a given dataset', )
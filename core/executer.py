@@ -21,6 +21,7 @@ from core.helper_classes import LabelRelaxationLoss, BatchRelaxedvsAllLoss
 from core.knowledge_graph import KG
 from core.models.base_model import BaseKGE
 from core.evaluator import Evaluator
+from core.trainers import AbstractTrainer
 from core.typings import *
 from core.static_funcs import *
 from core.sanity_checkers import *
@@ -95,6 +96,9 @@ class Execute:
         trained_model.to('cpu')
         # (2) Store NumParam and EstimatedSizeMB
         self.report.update(extract_model_summary(trained_model.summarize()))
+        # (2.1) Store embeddings in bfloat16. Parameters have been trained in float32.
+        if getattr(self.args, 'bf16_embeddings', False):
+            trained_model.cast_embeddings(torch.bfloat16)
         # (3) Store/Serialize Model for further use.
         if self.is_continual_training is False:
             store(trained_model, model_name='model', full_storage_path=self.storage_path,
@@ -104,7 +108,12 @@ class Execute:
                   dataset=self.dataset,
                   full_storage_path=self.storage_path, save_as_csv=self.args.save_embeddings_as_csv)
 
-        # (4) Store total runtime.
+        # (4) Build approximate nearest neighbour indexes over entity embeddings.
+        if self.args.build_ann_index:
+            self.report['ANN'] = store_entity_indexes(trained_model, self.storage_path, self.dataset.train_set,
+                                                      num_lists=self.args.ann_num_lists,
+                                                      num_probes=self.args.ann_num_probes)
+        # (5) Store total runtime.
         total_runtime = time.time() - start_time
         if 60 * 60 > total_runtime:
             message = f'{total_runtime / 60:.3f} minutes'
@@ -114,7 +123,7 @@ class Execute:
         self.report['path_experiment_folder'] = self.storage_path
         print(f'Total computation time: {message}')
         print(f'Number of parameters in {trained_model.name}:', self.report["NumParam"])
-        # (4) Store the report of training.
+        # (6) Store the report of training.
         with open(self.args.full_storage_path + '/report.json', 'w') as file_descriptor:
             json.dump(self.report, file_descriptor, indent=4)
 
@@ -173,6 +182,9 @@ class Execute:
         self.trainer = initialize_trainer(self.args, callbacks, plugins=[])
         # (3) Use (2) to train a KGE model
         trained_model, form_of_labelling = self.train()
+        # (4) Store measurements of custom trainers, e.g. throughput of DistributedDataParallelTrainer.
+        if isinstance(self.trainer, AbstractTrainer):
+            self.report.update(self.trainer.report)
         # (5) Return trained model
         return trained_model, form_of_labelling
 
@@ -227,7 +239,8 @@ class Execute:
                                      form='CCvsAll',
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
-                                     num_workers=self.args.num_core)
+                                     num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False))
 
         def on_epoch_start(self, *args, **kwargs):
             """ Update non-conformity scores"""
@@ -302,7 +315,8 @@ class Execute:
                                      form='PvsAll',
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
-                                     num_workers=self.args.num_core)
+                                     num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False))
 
         # Define a new raining set
         def training_step(self, batch, batch_idx):
@@ -360,6 +374,7 @@ class Execute:
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
                                      num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False),
                                      label_smoothing_rate=self.args.label_smoothing_rate)
         # (3) Train model.
         train_dataloaders = dataset.train_dataloader()
@@ -403,7 +418,8 @@ class Execute:
                                      form=form_of_labelling,
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
-                                     num_workers=self.args.num_core)
+                                     num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False))
         if self.args.label_relaxation_rate:
             model.loss = LabelRelaxationLoss(alpha=self.args.label_relaxation_rate)
             # model.loss=LabelSmoothingLossCanonical()
@@ -441,7 +457,8 @@ class Execute:
                                      form=form_of_labelling,
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
-                                     num_workers=self.args.num_core)
+                                     num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False))
         print(f'Done ! {time.time() - start_time:.3f} seconds\n')
         # 3. Train model
         train_dataloaders = dataset.train_dataloader()
@@ -467,6 +484,7 @@ class Execute:
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
                                      num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False),
                                      label_smoothing_rate=self.args.label_smoothing_rate)
         # 3. Train model.
         train_dataloaders = dataset.train_dataloader()
@@ -505,6 +523,7 @@ class Execute:
                                      neg_sample_ratio=self.args.neg_ratio,
                                      batch_size=self.args.batch_size,
                                      num_workers=self.args.num_core,
+                                     report_worker_memory=getattr(self.args, 'report_worker_memory', False),
                                      label_smoothing_rate=self.args.label_smoothing_rate)
         # (3) Train model.
         train_dataloaders = dataset.train_dataloader()
@@ -554,7 +573,8 @@ class Execute:
                                          form=form_of_labelling,
                                          neg_sample_ratio=self.args.neg_ratio,
                                          batch_size=self.args.batch_size,
-                                         num_workers=self.args.num_core)
+                                         num_workers=self.args.num_core,
+                                         report_worker_memory=getattr(self.args, 'report_worker_memory', False))
             # 3. Train model
             train_dataloaders = dataset.train_dataloader()
             del dataset
@@ -578,7 +598,8 @@ class ContinuousExecute(Execute):
 
     def __init__(self, args):
         assert os.path.exists(args.path_experiment_folder)
-        assert os.path.isfile(args.path_experiment_folder + '/idx_train_df.gzip')
+        assert os.path.isfile(args.path_experiment_folder + '/train_triples.npy') or os.path.isfile(
+            args.path_experiment_folder + '/idx_train_df.gzip')
         assert os.path.isfile(args.path_experiment_folder + '/configuration.json')
         # (1) Load Previous input configuration
         previous_args = load_json(args.path_experiment_folder + '/configuration.json')
@@ -0,0 +1,228 @@
+import os
+import json
+import shutil
+import numpy as np
+import torch
+from typing import List, Tuple, Union
+
+
+class FilterIndex:
+    """ Compressed sparse row (CSR) index mapping integer keys to integers co-occurring with them in triples,
+    e.g. (head entity, relation) => tail entities.
+
+    (1) key_codes: Sorted and unique int64 codes of keys. A key (k_1,...,k_m) is encoded as a mixed radix number.
+    (2) offsets: int64 array of size len(key_codes) + 1.
+    (3) values: int32 array. Values of the i-th key are values[offsets[i]:offsets[i + 1]] in ascending order.
+
+    Lookups are binary searches on (1). All arrays can be serialized into .npy files and memory-mapped.
+    """
+
+    def __init__(self, key_codes: np.ndarray, offsets: np.ndarray, values: np.ndarray, key_bases: Tuple[int]):
+        assert len(offsets) == len(key_codes) + 1
+        self.key_codes = key_codes
+        self.offsets = offsets
+        self.values = values
+        self.key_bases = tuple(int(i) for i in key_bases)
+
+    @classmethod
+    def from_pairs(cls, keys: np.ndarray, values: np.ndarray, key_bases: Tuple[int] = None) -> 'FilterIndex':
+        """
+        Construct an index from a key per row and a value per row. Duplicated (key, value) pairs are removed.
+        :param keys: (n, m) integer array
+        :param values: (n,) integer array
+        :param key_bases: sizes of key columns. If None, maximum of each key column + 1
+        :return:
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if keys.ndim == 1:
+            keys = keys.reshape(len(keys), 1)
+        values = np.asarray(values, dtype=np.int64)
+        assert len(keys) == len(values)
+        if key_bases is None:
+            key_bases = tuple(int(keys[:, i].max()) + 1 if len(keys) > 0 else 1 for i in range(keys.shape[1]))
+        codes = cls._encode(keys, key_bases)
+        # (1) Sort by key codes and then values.
+        order = np.lexsort((values, codes))
+        codes, values = codes[order], values[order]
+        # (2) Remove duplicated (key, value) pairs.
+        if len(codes) > 0:
+            unique_mask = np.ones(len(codes), dtype=bool)
+            unique_mask[1:] = (codes[1:] != codes[:-1]) | (values[1:] != values[:-1])
+            codes, values = codes[unique_mask], values[unique_mask]
+        # (3) Offsets of unique keys.
+        key_codes, starts = np.unique(codes, return_index=True)
+        offsets = np.append(starts, len(codes)).astype(np.int64)
+        return cls(key_codes=key_codes, offsets=offsets, values=values.astype(np.int32), key_bases=key_bases)
+
+    @classmethod
+    def from_triples(cls, triples: np.ndarray, key_columns: Tuple[int, int], value_column: int) -> 'FilterIndex':
+        """
+        Construct an index from integer indexed triples, e.g.
+        key_columns=(0, 1), value_column=2 => (h,r) -> t
+        key_columns=(1, 2), value_column=0 => (r,t) -> h
+        key_columns=(0, 2), value_column=1 => (h,t) -> r
+        """
+        triples = np.asarray(triples)
+        assert triples.ndim == 2 and triples.shape[1] == 3
+        return cls.from_pairs(triples[:, list(key_columns)], triples[:, value_column])
+
+    @classmethod
+    def from_triple_splits(cls, splits: List[np.ndarray], key_columns: Tuple[int, ...], value_column: int,
+                           key_bases: Tuple[int, ...], path: str, chunk_size: int) -> 'FilterIndex':
+        """
+        Construct an index from (memory-mapped) splits of triples without loading them into memory and serialize it
+        into path as save() would. Splits are read in chunks of chunk_size rows.
+        (1) Count rows per value of the first key column.
+        (2) Partition values of the first key column into ranges having about chunk_size rows. Key codes are ordered by
+        the first key column, hence indexes of consecutive ranges can be appended to each other.
+        (3) Index each range via from_pairs and append its arrays to raw files.
+        (4) Prepend .npy headers to raw files and memory-map the index.
+        :param splits: (n_i, 3) integer arrays
+        :param key_columns: e.g. (0, 1)
+        :param value_column: e.g. 2
+        :param key_bases: sizes of key columns, e.g. (num_entities, num_relations)
+        :param path:
+        :param chunk_size: number of rows held in memory at once
+        :return:
+        """
+        assert chunk_size > 0 and len(key_bases) == len(key_columns)
+        first_column = key_columns[0]
+
+        def chunks():
+            for split in splits:
+                for start in range(0, len(split), chunk_size):
+                    yield np.asarray(split[start:start + chunk_size], dtype=np.int64)
+
+        # (1) Number of rows per value of the first key column.
+        counts = np.zeros(key_bases[0], dtype=np.int64)
+        for chunk in chunks():
+            counts += np.bincount(chunk[:, first_column], minlength=key_bases[0])
+        # (2) Ranges [bounds[i], bounds[i+1]) of the first key column.
+        cumulative_counts = np.cumsum(counts)
+        bounds = np.unique(np.concatenate(
+            ([0], np.searchsorted(cumulative_counts, np.arange(chunk_size, cumulative_counts[-1], chunk_size)) + 1,
+             [key_bases[0]])))
+        del counts, cumulative_counts
+        # (3) Index ranges.
+        num_keys, num_values = 0, 0
+        with open(path + '_key_codes.bin', 'wb') as key_file, open(path + '_offsets.bin', 'wb') as offset_file, \
+                open(path + '_values.bin', 'wb') as value_file:
+            for low, high in zip(bounds[:-1], bounds[1:]):
+                rows = [chunk[(chunk[:, first_column] >= low) & (chunk[:, first_column] < high)] for chunk in chunks()]
+                rows = np.concatenate(rows) if rows else np.zeros((0, 3), dtype=np.int64)
+                index = cls.from_pairs(rows[:, list(key_columns)], rows[:, value_column], key_bases=key_bases)
+                index.key_codes.tofile(key_file)
+                (index.offsets[:-1] + num_values).tofile(offset_file)
+                index.values.tofile(value_file)
+                num_keys, num_values = num_keys + len(index.key_codes), num_values + len(index.values)
+            np.array([num_values], dtype=np.int64).tofile(offset_file)
+        # (4) Serialize as save().
+        for name, dtype, size in [('key_codes', np.int64, num_keys), ('offsets', np.int64, num_keys + 1),
+                                  ('values', np.int32, num_values)]:
+            with open(path + f'_{name}.npy', 'wb') as file_descriptor, open(path + f'_{name}.bin', 'rb') as raw_file:
+                np.lib.format.write_array_header_1_0(file_descriptor, {'descr': np.lib.format.dtype_to_descr(
+                    np.dtype(dtype)), 'fortran_order': False, 'shape': (size,)})
+                shutil.copyfileobj(raw_file, file_descriptor)
+            os.remove(path + f'_{name}.bin')
+        with open(path + '.json', 'w') as file_descriptor:
+            json.dump({'key_bases': tuple(int(i) for i in key_bases), 'num_keys': num_keys,
+                       'num_values': num_values}, file_descriptor)
+        return cls.load(path, mmap_mode='r')
+
+    @staticmethod
+    def _encode(keys: np.ndarray, key_bases: Tuple[int]) -> np.ndarray:
+        codes = np.zeros(len(keys), dtype=np.int64)
+        for i, base in enumerate(key_bases):
+            codes = codes * base + keys[:, i]
+        return codes
+
+    def _spans(self, keys: Union[np.ndarray, torch.Tensor]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Return start positions in values and numbers of values of keys. Unseen keys have zero values """
+        if isinstance(keys, torch.Tensor):
+            keys = keys.numpy()
+        keys = np.asarray(keys, dtype=np.int64)
+        if keys.ndim < 2:
+            keys = keys.reshape(-1, len(self.key_bases))
+        assert keys.shape[1] == len(self.key_bases)
+        if len(self.key_codes) == 0:
+            return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=np.int64)
+        # Keys out of the bases can not exist.
+        found = np.all((keys >= 0) & (keys < np.asarray(self.key_bases)), axis=1)
+        codes = self._encode(np.where(found[:, None], keys, 0), self.key_bases)
+        positions = np.minimum(np.searchsorted(self.key_codes, codes), len(self.key_codes) - 1)
+        found &= (self.key_codes[positions] == codes)
+        starts = self.offsets[positions]
+        return starts, np.where(found, self.offsets[positions + 1] - starts, 0)
+
+    def __len__(self):
+        return len(self.key_codes)
+
+    def __contains__(self, key) -> bool:
+        return bool(self._spans(key)[1][0] > 0)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """ Values of a single key, e.g. index[(h, r)] or index[r]. An empty array is returned for an unseen key """
+        starts, lengths = self._spans(key)
+        return self.values[starts[0]:starts[0] + lengths[0]]
+
+    def lengths(self, keys) -> np.ndarray:
+        """ Number of values per key """
+        return self._spans(keys)[1]
+
+    def coordinates(self, keys) -> Tuple[torch.LongTensor, torch.LongTensor]:
+        """
+        Batched lookup returning flattened coordinates, i.e., values of the i-th key are stored in
+        cols[rows == i]. Coordinates can be used to fill a (len(keys) x num_values) tensor in one scatter.
+        :param keys: (n, m) integer array or tensor
+        :return: rows and cols
+        """
+        starts, lengths = self._spans(keys)
+        total = int(lengths.sum())
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        # Position of each value in self.values.
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        cols = self.values[np.arange(total) + shifts]
+        return torch.from_numpy(rows), torch.from_numpy(cols.astype(np.int64))
+
+    def padded(self, keys, padding_value: int = -1) -> torch.LongTensor:
+        """
+        Batched lookup returning a (n x max number of values) tensor padded with padding_value
+        :param keys: (n, m) integer array or tensor
+        :param padding_value:
+        :return:
+        """
+        rows, cols = self.coordinates(keys)
+        lengths = torch.from_numpy(self.lengths(keys))
+        out = torch.full((len(lengths), int(lengths.max()) if len(rows) > 0 else 0), padding_value, dtype=torch.long)
+        # Position of each value within its row.
+        position_in_row = torch.arange(len(rows)) - (torch.cumsum(lengths, 0) - lengths).repeat_interleave(lengths)
+        out[rows, position_in_row] = cols
+        return out
+
+    def keys(self) -> np.ndarray:
+        """ Decode key codes into a (len(self) x m) array """
+        keys = np.empty((len(self.key_codes), len(self.key_bases)), dtype=np.int64)
+        codes = np.asarray(self.key_codes)
+        for i in reversed(range(len(self.key_bases))):
+            keys[:, i] = codes % self.key_bases[i]
+            codes = codes // self.key_bases[i]
+        return keys
+
+    def save(self, path: str) -> None:
+        """ Serialize into path_key_codes.npy, path_offsets.npy, path_values.npy and path.json """
+        np.save(path + '_key_codes.npy', np.ascontiguousarray(self.key_codes))
+        np.save(path + '_offsets.npy', np.ascontiguousarray(self.offsets))
+        np.save(path + '_values.npy', np.ascontiguousarray(self.values))
+        with open(path + '.json', 'w') as file_descriptor:
+            json.dump({'key_bases': self.key_bases, 'num_keys': len(self.key_codes),
+                       'num_values': len(self.values)}, file_descriptor)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r') -> 'FilterIndex':
+        """ Deserialize an index saved via save(). Arrays are memory-mapped unless mmap_mode is None """
+        with open(path + '.json', 'r') as file_descriptor:
+            meta = json.load(file_descriptor)
+        return cls(key_codes=np.load(path + '_key_codes.npy', mmap_mode=mmap_mode),
+                   offsets=np.load(path + '_offsets.npy', mmap_mode=mmap_mode),
+                   values=np.load(path + '_values.npy', mmap_mode=mmap_mode),
+                   key_bases=tuple(meta['key_bases']))
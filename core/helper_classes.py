@@ -25,6 +25,147 @@ class CustomArg:
             yield k, v
 
 
+def mixed_precision(precision, device_type: str = 'cpu') -> torch.autocast:
+    """
+    Autocast forward passes into bfloat16 if precision is 'bf16', e.g. matrix multiplications of k vs all scores.
+    Parameters keep their dtype, i.e., optimizers update float32 master weights.
+    :param precision: precision argument, e.g. 32 or 'bf16'
+    :param device_type: 'cpu' or 'cuda'
+    :return: a context manager
+    """
+    return torch.autocast(device_type, dtype=torch.bfloat16, enabled=precision == 'bf16')
+
+
+class LowPrecisionEmbedding(nn.Embedding):
+    """ Embeddings stored in a low precision dtype, e.g. bfloat16, whose looked up rows are float32.
+    Scores are computed from looked up rows in float32, since scores computed in bfloat16 are frequently tied.
+    Scorers reading the weight, e.g. k vs all scores, upcast it via weight.float(). """
+
+    def forward(self, x: torch.LongTensor) -> torch.FloatTensor:
+        return super().forward(x).float()
+
+
+class FusedBCEWithLogits(torch.autograd.Function):
+    """
+    Mean binary cross entropy with logits on label smoothed targets given by positive indices, i.e.
+    y = onehot * (1 - rate) + 1 / target_dim. Since BCE(x,y) = softplus(x) - x * y,
+    the sum over all (n, target_dim) entries is computed without materializing y:
+
+    sum(softplus(x)) - (1 - rate) * sum(x at positive indices) - sum(x) / target_dim
+
+    The gradient sigmoid(x) - y is written into a single (n, target_dim) tensor in backward.
+    Only logits and positive indices are saved for backward. The loss is computed in float32 under autocast, i.e.,
+    bfloat16 logits are upcast and the gradient is cast back to bfloat16 by autograd.
+    """
+
+    @staticmethod
+    def forward(ctx, logits, rows, cols, label_smoothing_rate=None):
+        rate = float(label_smoothing_rate or 0.)
+        logits = logits.float()
+        n, target_dim = logits.shape
+        ctx.save_for_backward(logits, rows, cols)
+        ctx.label_smoothing_rate = rate
+        with torch.autocast('cpu', enabled=False):
+            loss = F.softplus(logits).sum() - (1. - rate) * logits[rows, cols].sum()
+            if rate:
+                loss = loss - logits.sum() / target_dim
+        return loss / logits.numel()
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        logits, rows, cols = ctx.saved_tensors
+        rate = ctx.label_smoothing_rate
+        n, target_dim = logits.shape
+        # (1) d softplus(x) / dx
+        grad = torch.sigmoid(logits)
+        # (2) Smoothed targets: 1/target_dim everywhere, (1 - rate) more at positives.
+        if rate:
+            grad.sub_(1. / target_dim)
+        grad.index_put_((rows, cols), torch.tensor(rate - 1., dtype=grad.dtype, device=grad.device),
+                        accumulate=True)
+        grad.mul_(grad_output / logits.numel())
+        return grad, None, None, None
+
+
+def binary_cross_entropy_with_sparse_targets(logits: torch.FloatTensor, targets) -> torch.FloatTensor:
+    """
+    Mean binary cross entropy with logits given only positive indices of (label smoothed) binary targets.
+    Equivalent to BCEWithLogitsLoss()(logits, targets.to_dense()), see FusedBCEWithLogits.
+
+    :param logits: (n, target_dim) tensor, e.g. outputs of forward_k_vs_all
+    :param targets: SparseTargets having unique positive indices per row
+    :return:
+    """
+    assert logits.shape == targets.shape
+    return FusedBCEWithLogits.apply(logits, targets.row_indices(), targets.indices, targets.label_smoothing_rate)
+
+
+class BlockwiseBCEWithLogits(torch.autograd.Function):
+    """
+    FusedBCEWithLogits of logits = query @ entities^T reduced over blocks of entities.
+    Neither forward nor backward materializes (n, |E|) logits: logits of a block are computed in forward and
+    recomputed in backward, hence peak memory is O(n * block_size).
+    Under autocast, logits of blocks are computed in bfloat16 in forward and backward and reduced in float32.
+    Since backward runs outside of autocast, the dtype of logits in forward is kept and operands are cast explicitly.
+    """
+
+    @staticmethod
+    def forward(ctx, query, entities, rows, cols, label_smoothing_rate=None, block_size=None):
+        rate = float(label_smoothing_rate or 0.)
+        num_entities = len(entities)
+        block_size = block_size or num_entities
+        ctx.save_for_backward(query, entities, rows, cols)
+        ctx.label_smoothing_rate, ctx.block_size = rate, block_size
+        loss = torch.zeros((), dtype=torch.promote_types(query.dtype, entities.dtype), device=query.device)
+        for start in range(0, num_entities, block_size):
+            logits = torch.mm(query, entities[start:start + block_size].transpose(1, 0))
+            loss += F.softplus(logits).sum(dtype=loss.dtype)
+            if rate:
+                loss -= logits.sum(dtype=loss.dtype) / num_entities
+        ctx.logits_dtype = logits.dtype
+        # Logits at positive indices.
+        loss -= (1. - rate) * (query[rows] * entities[cols]).sum()
+        return loss / (len(query) * num_entities)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        query, entities, rows, cols = ctx.saved_tensors
+        rate, block_size = ctx.label_smoothing_rate, ctx.block_size
+        num_entities = len(entities)
+        scale = grad_output / (len(query) * num_entities)
+        grad_query, grad_entities = torch.zeros_like(query), torch.zeros_like(entities)
+        low_precision_query = query.to(ctx.logits_dtype)
+        for start in range(0, num_entities, block_size):
+            block = entities[start:start + block_size].to(ctx.logits_dtype)
+            # (1) d loss / d logits of the block without positive indices.
+            grad_logits = torch.sigmoid(torch.mm(low_precision_query, block.transpose(1, 0)))
+            if rate:
+                grad_logits.sub_(1. / num_entities)
+            # (2) Chain rule through logits = query @ block^T
+            grad_query += torch.mm(grad_logits, block)
+            grad_entities[start:start + block_size] = torch.mm(grad_logits.transpose(1, 0), low_precision_query)
+        # (3) Positive indices.
+        grad_query.index_add_(0, rows, entities[cols].to(grad_query.dtype), alpha=rate - 1.)
+        grad_entities.index_add_(0, cols, query[rows].to(grad_entities.dtype), alpha=rate - 1.)
+        return grad_query * scale, grad_entities * scale, None, None, None, None
+
+
+def blockwise_binary_cross_entropy_with_sparse_targets(query: torch.FloatTensor, entities: torch.FloatTensor,
+                                                       targets, block_size: int) -> torch.FloatTensor:
+    """
+    binary_cross_entropy_with_sparse_targets(query @ entities^T, targets) computed over blocks of entities.
+
+    :param query: (n, d) tensor
+    :param entities: (|E|, d) tensor
+    :param targets: SparseTargets having unique positive indices per row
+    :param block_size: number of entities per block
+    :return:
+    """
+    assert targets.shape == (len(query), len(entities))
+    return BlockwiseBCEWithLogits.apply(query, entities, targets.row_indices(), targets.indices,
+                                        targets.label_smoothing_rate, block_size)
+
+
 class LabelSmoothingLossCanonical(nn.Module):
     def __init__(self, smoothing=0.0, dim=-1):
         super(LabelSmoothingLossCanonical, self).__init__()
@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from typing import Callable, Tuple
+import torch
+from .models.base_model import BaseKGE
+from .ann_index import IVFPQIndex
+from .quantization import QuantizedEmbedding
+
+
+class KvsAllInferenceEngine:
+    """ Top-k tail entity prediction through the k vs all path of a KGE model
+
+    (1) A query vector q of a (head entity, relation) pair is computed once via model.k_vs_all_query and
+    kept in a size bounded LRU cache.
+    (2) Entity embeddings are normalized as tail entities in eval mode once and kept in a contiguous matrix E.
+    (3) Scores of all tail entities are obtained via a single matrix-vector product E q followed by topk.
+    If an approximate nearest neighbour index over E is given, (3) is replaced by a search in the index.
+    If entity embeddings are quantized (see QuantizedEmbedding), E is not dequantized and (3) is computed over blocks
+    of E.
+
+    Head entities are predicted in the same way if the model implements head_entity_query.
+    """
+
+    def __init__(self, model: BaseKGE, cache_size: int = 1024, tail_entity_index: IVFPQIndex = None,
+                 head_entity_index: IVFPQIndex = None):
+        assert self.is_applicable(model), f'{model.name} does not compute k vs all scores via a query vector'
+        assert cache_size >= 0
+        self.model = model
+        self.cache_size = cache_size
+        self.tail_entity_index = tail_entity_index
+        self.head_entity_index = head_entity_index if self.predicts_head_entities(model) else None
+        self._queries = OrderedDict()
+        self._entity_matrix = None
+        self._head_entity_matrix = None
+        self.hits = 0
+        self.misses = 0
+        self.max_scores_per_chunk = 2 ** 24
+
+    @staticmethod
+    def is_applicable(model: BaseKGE) -> bool:
+        """ Whether model overrides BaseKGE.k_vs_all_query, i.e., its scores are linear in tail embeddings """
+        return isinstance(model, BaseKGE) and type(model).k_vs_all_query is not BaseKGE.k_vs_all_query
+
+    @staticmethod
+    def predicts_head_entities(model: BaseKGE) -> bool:
+        """ Whether model overrides BaseKGE.head_entity_query, i.e., its scores are linear in head embeddings """
+        return isinstance(model, BaseKGE) and type(model).head_entity_query is not BaseKGE.head_entity_query
+
+    def _in_eval_mode(self, fn: Callable[[], torch.FloatTensor]) -> torch.FloatTensor:
+        training = self.model.training
+        self.model.eval()
+        try:
+            with torch.no_grad():
+                return fn()
+        finally:
+            self.model.train(training)
+
+    @property
+    def entity_matrix(self) -> torch.FloatTensor:
+        """ (|E|, d) contiguous matrix of tail entity embeddings with the tail normalization folded in """
+        if self._entity_matrix is None and isinstance(self.model.tail_entity_embeddings, QuantizedEmbedding):
+            self._entity_matrix = self.model.tail_entity_embeddings
+        elif self._entity_matrix is None:
+            self._entity_matrix = self._in_eval_mode(
+                lambda: self.model.get_tail_entity_representation().detach().contiguous())
+        return self._entity_matrix
+
+    @property
+    def head_entity_matrix(self) -> torch.FloatTensor:
+        """ (|E|, d) contiguous matrix of head entity embeddings with the head normalization folded in """
+        if self._head_entity_matrix is None and isinstance(self.model.head_entity_embeddings, QuantizedEmbedding):
+            self._head_entity_matrix = self.model.head_entity_embeddings
+        elif self._head_entity_matrix is None:
+            self._head_entity_matrix = self._in_eval_mode(
+                lambda: self.model.get_head_entity_representation().detach().contiguous())
+        return self._head_entity_matrix
+
+    def query(self, idx_head_entity: int, idx_relation: int) -> torch.FloatTensor:
+        """
+        Query vector of (head entity, relation)
+
+        :param idx_head_entity:
+        :param idx_relation:
+        :return: (d,) tensor
+        """
+        key = (idx_head_entity, idx_relation)
+        q = self._queries.get(key)
+        if q is not None:
+            self.hits += 1
+            self._queries.move_to_end(key)
+            return q
+        self.misses += 1
+        q = self._in_eval_mode(
+            lambda: self.model.k_vs_all_query(torch.LongTensor([[idx_head_entity, idx_relation]]))[0].contiguous())
+        if self.cache_size > 0:
+            self._queries[key] = q
+            if len(self._queries) > self.cache_size:
+                self._queries.popitem(last=False)
+        return q
+
+    def queries(self, x: torch.LongTensor) -> torch.FloatTensor:
+        """
+        Query vectors of a batch of (head entity, relation) pairs. Queries missing in the cache are computed in a
+        single call of model.k_vs_all_query.
+
+        :param x: (N, 2) tensor
+        :return: (N, d) tensor
+        """
+        keys = [tuple(pair) for pair in x.tolist()]
+        queries = [self._queries.get(key) for key in keys]
+        missing = [i for i, q in enumerate(queries) if q is None]
+        self.hits += len(keys) - len(missing)
+        self.misses += len(missing)
+        for key, q in zip(keys, queries):
+            if q is not None:
+                self._queries.move_to_end(key)
+        if missing:
+            computed = self._in_eval_mode(lambda: self.model.k_vs_all_query(x[missing]))
+            for i, q in zip(missing, computed):
+                queries[i] = q
+                if self.cache_size > 0:
+                    # Cloned to not keep the whole batch of queries alive.
+                    self._queries[keys[i]] = q.clone()
+            while len(self._queries) > self.cache_size:
+                self._queries.popitem(last=False)
+        return torch.stack(queries)
+
+    @staticmethod
+    def _topk(query: torch.FloatTensor, matrix: torch.FloatTensor, k: int,
+              index: IVFPQIndex = None) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        if index is None and isinstance(matrix, QuantizedEmbedding):
+            scores, idx = matrix.topk(query.unsqueeze(0), k)
+            return scores[0], idx[0]
+        if index is None:
+            return torch.topk(torch.mv(matrix, query), min(k, len(matrix)))
+        scores, idx = index.search(query.unsqueeze(0), k, embeddings=matrix)
+        found = idx[0] >= 0
+        return scores[0, found], idx[0, found]
+
+    def _batch_topk(self, queries: torch.FloatTensor, matrix: torch.FloatTensor, k: int,
+                    index: IVFPQIndex = None) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        if index is not None:
+            return index.search(queries, k, embeddings=matrix)
+        if isinstance(matrix, QuantizedEmbedding):
+            return matrix.topk(queries, k, block_size=max(1, self.max_scores_per_chunk // len(queries)))
+        # Scores of at most max_scores_per_chunk (query, entity) pairs are kept in memory.
+        chunk_size = max(1, self.max_scores_per_chunk // len(matrix))
+        top_scores, top_idx = zip(*[torch.topk(torch.mm(queries[i:i + chunk_size], matrix.transpose(1, 0)),
+                                               min(k, len(matrix)), dim=1)
+                                    for i in range(0, len(queries), chunk_size)])
+        return torch.cat(top_scores), torch.cat(top_idx)
+
+    def predict_tail_topk_batch(self, x: torch.LongTensor, k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k tail entities of a batch of (head entity, relation, ?)
+
+        :param x: (N, 2) tensor of head entity and relation indexes
+        :param k:
+        :return: (N, k) scores in descending order and (N, k) entity indexes, see IVFPQIndex.search for padding
+        """
+        assert k >= 0
+        return self._batch_topk(self.queries(x), self.entity_matrix, k, self.tail_entity_index)
+
+    def predict_head_topk_batch(self, x: torch.LongTensor, k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k head entities of a batch of (?, relation, tail entity)
+
+        :param x: (N, 2) tensor of relation and tail entity indexes
+        :param k:
+        :return: (N, k) scores in descending order and (N, k) entity indexes, see IVFPQIndex.search for padding
+        """
+        assert k >= 0
+        assert self.predicts_head_entities(self.model), f'{self.model.name} does not implement head_entity_query'
+        queries = self._in_eval_mode(lambda: self.model.head_entity_query(x))
+        return self._batch_topk(queries, self.head_entity_matrix, k, self.head_entity_index)
+
+    def predict_tail_topk(self, idx_head_entity: int, idx_relation: int,
+                          k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k tail entities of (head entity, relation, ?)
+
+        :param idx_head_entity:
+        :param idx_relation:
+        :param k:
+        :return: k scores in descending order and k entity indexes
+        """
+        assert k >= 0
+        return self._topk(self.query(idx_head_entity, idx_relation), self.entity_matrix, k, self.tail_entity_index)
+
+    def predict_head_topk(self, idx_relation: int, idx_tail_entity: int,
+                          k: int) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k head entities of (?, relation, tail entity)
+
+        :param idx_relation:
+        :param idx_tail_entity:
+        :param k:
+        :return: k scores in descending order and k entity indexes
+        """
+        assert k >= 0
+        assert self.predicts_head_entities(self.model), f'{self.model.name} does not implement head_entity_query'
+        q = self._in_eval_mode(
+            lambda: self.model.head_entity_query(torch.LongTensor([[idx_relation, idx_tail_entity]]))[0])
+        return self._topk(q, self.head_entity_matrix, k, self.head_entity_index)
+
+    def clear(self) -> None:
+        """ Drop cached queries and entity matrices, e.g., after parameters of the model are updated """
+        self._queries.clear()
+        self._entity_matrix = None
+        self._head_entity_matrix = None
@@ -0,0 +1,537 @@
+""" Streaming ingestion of knowledge graphs via pyarrow
+
+Input files are read in record batches. String columns are kept in pyarrow arrays and
+dictionary-encoded into vocabularies growing batch by batch so that
+triples are mapped into int32 arrays without constructing Python string objects per triple.
+Knowledge graphs larger than memory are indexed out-of-core via OutOfCoreIndexer.
+"""
+import io
+import os
+import re
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from typing import Generator, List
+
+COLUMN_NAMES = ['subject', 'relation', 'object']
+
+
+def detect_delimiter(data_path: str) -> str:
+    """ Tab if the first line contains a tab, otherwise a single space """
+    with open(data_path, 'r') as reader:
+        first_line = reader.readline()
+    return '\t' if '\t' in first_line else ' '
+
+
+# Spaces and tabs at the beginning and at the end of lines, and runs of spaces and tabs within lines.
+EDGE_WHITESPACE = re.compile(rb'^[ \t]+|[ \t]+(?=\r?$)', re.MULTILINE)
+WHITESPACE_RUNS = re.compile(rb'[ \t]+')
+
+
+class WhitespaceNormalizedFile(io.RawIOBase):
+    """ Read-only binary file whose lines are stripped and whose runs of spaces and tabs are replaced with a single
+    delimiter, i.e., a view of a file having fields as pandas.read_csv(delim_whitespace=True) splits them.
+    The file is read in blocks ending at line boundaries. Blocks already separated by single delimiters are passed
+    through, others are normalized via regular expressions.
+    """
+
+    def __init__(self, data_path: str, delimiter: str, block_size: int = 1 << 24):
+        super().__init__()
+        assert delimiter in ['\t', ' ']
+        self.file = open(data_path, 'rb')
+        self.delimiter = delimiter.encode()
+        self.block_size = block_size
+        # Normalized block and the position of the next byte to be read.
+        self.buffer, self.position = b'', 0
+
+    def readable(self) -> bool:
+        return True
+
+    def is_normalized(self, block: bytes) -> bool:
+        """ Whether fields of lines in block are separated by single delimiters """
+        if (b' ' if self.delimiter == b'\t' else b'\t') in block:
+            return False
+        characters = np.frombuffer(block, dtype=np.uint8)
+        positions = np.flatnonzero(characters == ord(self.delimiter))
+        if len(positions) == 0:
+            return True
+        if positions[0] == 0 or positions[-1] == len(characters) - 1 or np.any(np.diff(positions) == 1):
+            return False
+        # Delimiters next to line breaks.
+        previous, following = characters[positions - 1], characters[positions + 1]
+        return not np.any((previous == ord('\n')) | (following == ord('\n')) | (following == ord('\r')))
+
+    def read_block(self) -> bytes:
+        block = self.file.read(self.block_size)
+        if block:
+            # Complete the last line.
+            block += self.file.readline()
+            if not self.is_normalized(block):
+                block = WHITESPACE_RUNS.sub(self.delimiter, EDGE_WHITESPACE.sub(b'', block))
+        return block
+
+    def readinto(self, out) -> int:
+        out = memoryview(out).cast('B')
+        num_bytes = 0
+        while num_bytes < len(out):
+            if self.position == len(self.buffer):
+                self.buffer, self.position = self.read_block(), 0
+                if not self.buffer:
+                    break
+            size = min(len(out) - num_bytes, len(self.buffer) - self.position)
+            out[num_bytes:num_bytes + size] = memoryview(self.buffer)[self.position:self.position + size]
+            num_bytes += size
+            self.position += size
+        return num_bytes
+
+    def close(self) -> None:
+        self.file.close()
+        super().close()
+
+
+def read_batches_with_pyarrow(data_path: str, read_only_few: int = None, sample_triples_ratio: float = None,
+                              block_size: int = 1 << 26) -> Generator[pa.Table, None, None]:
+    """
+    Read first three columns of a whitespace separated file in record batches. Fields may be separated by runs of
+    spaces and tabs, see WhitespaceNormalizedFile.
+    (1) Read only few triples
+    (2) Sample few triples
+    (3) Remove triples with literals and **<>** if exists. Whether triples are in N-Triples format is
+    decided on the first batch as in preprocess_dataframe_of_kg().
+    :param data_path:
+    :param read_only_few:
+    :param sample_triples_ratio:
+    :param block_size: Number of bytes processed at once
+    :return: Tables having subject, relation and object string columns
+    """
+    delimiter = detect_delimiter(data_path)
+    reader = pa_csv.open_csv(WhitespaceNormalizedFile(data_path, delimiter, block_size=block_size),
+                             read_options=pa_csv.ReadOptions(autogenerate_column_names=True, block_size=block_size),
+                             parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+                             convert_options=pa_csv.ConvertOptions(include_columns=['f0', 'f1', 'f2'],
+                                                                   column_types={i: pa.string() for i in
+                                                                                 ['f0', 'f1', 'f2']}))
+    num_read = 0
+    is_ntriples = None
+    for batch in reader:
+        table = pa.Table.from_batches([batch]).rename_columns(COLUMN_NAMES)
+        # (1) Read only few if it is asked.
+        if isinstance(read_only_few, int) and read_only_few > 0:
+            if num_read >= read_only_few:
+                break
+            table = table.slice(0, read_only_few - num_read)
+        num_read += table.num_rows
+        # (2) Read only sample
+        if sample_triples_ratio:
+            table = table.filter(pa.array(np.random.rand(table.num_rows) < sample_triples_ratio))
+        # (3) Drop triples with literals and remove brackets
+        if is_ntriples is None:
+            head = table.slice(0, 5)
+            is_ntriples = pc.sum(pc.starts_with(head['subject'], '<')).as_py() or 0
+            is_ntriples += pc.sum(pc.starts_with(head['relation'], '<')).as_py() or 0
+            is_ntriples = is_ntriples > 2
+        if is_ntriples:
+            table = table.filter(pc.fill_null(pc.starts_with(table['object'], '<'), False))
+            table = pa.table({name: pc.replace_substring_regex(table[name], pattern='^<|>$', replacement='')
+                              for name in COLUMN_NAMES})
+        yield table
+
+
+def vocabulary_schema(column: str) -> pa.Schema:
+    """ Schema of pandas.DataFrame(data=indexes, columns=[column], index=terms) serialized into parquet """
+    metadata = pa.Schema.from_pandas(pd.DataFrame({column: np.arange(1)}, index=['x'])).metadata
+    return pa.schema([(column, pa.int64()), ('__index_level_0__', pa.string())], metadata=metadata)
+
+
+class IncrementalVocabulary:
+    """ A bijection mapping from strings to integer indexes growing with every encoded batch.
+
+    Terms are stored in a pyarrow string array ordered by their integer indexes, i.e., by first occurrence.
+    """
+
+    def __init__(self):
+        self.terms = pa.array([], type=pa.string())
+
+    def __len__(self):
+        return len(self.terms)
+
+    def encode(self, values: List[pa.ChunkedArray]) -> List[np.ndarray]:
+        """
+        Map strings into int32 indexes. Unseen strings are appended to the vocabulary.
+        (1) Dictionary-encode values of a batch,
+        (2) look up the batch dictionary in the vocabulary,
+        (3) append unseen terms and
+        (4) map local dictionary indexes to global indexes.
+        :param values: string columns sharing the vocabulary, e.g. subject and object columns
+        :return: int32 indexes per column
+        """
+        sizes = [len(i) for i in values]
+        encoded = pc.dictionary_encode(pa.chunked_array([c for v in values for c in v.chunks],
+                                                        type=pa.string())).combine_chunks()
+        dictionary, indices = encoded.dictionary, encoded.indices.to_numpy(zero_copy_only=False)
+        global_indexes = pc.index_in(dictionary, value_set=self.terms)
+        unseen = pc.is_null(global_indexes)
+        global_indexes = global_indexes.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int32)
+        unseen_mask = unseen.to_numpy(zero_copy_only=False)
+        global_indexes[unseen_mask] = np.arange(len(self.terms), len(self.terms) + unseen_mask.sum(), dtype=np.int32)
+        self.terms = pa.concat_arrays([self.terms, dictionary.filter(unseen)])
+        global_indexes = global_indexes[indices]
+        return np.split(global_indexes, np.cumsum(sizes)[:-1])
+
+    def extend(self, terms: pa.Array) -> np.ndarray:
+        """ Add terms into the vocabulary and return their int32 indexes """
+        return self.encode([pa.chunked_array([terms], type=pa.string())])[0]
+
+    def select(self, mask: np.ndarray) -> np.ndarray:
+        """ Keep terms whose mask is True and return a mapping from old indexes to new indexes (-1 if removed) """
+        assert len(mask) == len(self.terms)
+        self.terms = self.terms.filter(pa.array(mask))
+        return np.where(mask, np.cumsum(mask) - 1, -1).astype(np.int32)
+
+    def to_parquet(self, path: str, column: str) -> None:
+        """ Serialize the vocabulary as pandas.DataFrame(data=indexes, columns=[column], index=terms) would be """
+        pq.write_table(pa.table({column: np.arange(len(self.terms)), '__index_level_0__': self.terms},
+                                schema=vocabulary_schema(column)), path, compression='gzip')
+
+    def to_dict(self) -> dict:
+        """ A dictionary from strings to integer indexes """
+        return dict(zip(self.terms.to_pylist(), range(len(self.terms))))
+
+
+def encode_triples(tables: Generator[pa.Table, None, None], entity_vocab: IncrementalVocabulary,
+                   relation_vocab: IncrementalVocabulary, writer_path: str = None) -> np.ndarray:
+    """
+    Map batches of string triples into a (n,3) int32 array.
+    :param tables: batches of string triples
+    :param entity_vocab:
+    :param relation_vocab:
+    :param writer_path: If given, string triples are also written into a parquet file
+    :return:
+    """
+    writer = None
+    triples = []
+    for table in tables:
+        if writer_path is not None:
+            if writer is None:
+                writer = pq.ParquetWriter(writer_path, table.schema, compression='gzip')
+            writer.write_table(table)
+        subjects, objects = entity_vocab.encode([table['subject'], table['object']])
+        relations, = relation_vocab.encode([table['relation']])
+        triples.append(np.stack((subjects, relations, objects), axis=1))
+    if writer is not None:
+        writer.close()
+    if len(triples) == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    return np.concatenate(triples)
+
+
+def read_and_encode_split(data_path: str, entity_vocab: IncrementalVocabulary,
+                          relation_vocab: IncrementalVocabulary, read_only_few: int = None,
+                          sample_triples_ratio: float = None, writer_path: str = None):
+    """ Stream a split via pyarrow into int32 triples. None if data_path does not exist """
+    if not os.path.isfile(data_path):
+        print(f'{data_path} could not found!')
+        return None
+    return encode_triples(read_batches_with_pyarrow(data_path, read_only_few, sample_triples_ratio),
+                          entity_vocab, relation_vocab, writer_path=writer_path)
+
+
+# Random odd multipliers of bytes at each position within a term, see hash_strings().
+HASH_MULTIPLIERS = np.random.default_rng(1).integers(1, 2 ** 63, size=256, dtype=np.uint64) | np.uint64(1)
+
+
+def hash_strings(terms: pa.Array) -> np.ndarray:
+    """
+    Vectorized 64 bit hashes of a pyarrow string array computed on its UTF-8 bytes, i.e., the sum of bytes multiplied
+    with position dependent random multipliers (mod 2^64). No Python string object is constructed.
+    :param terms:
+    :return: uint64 array
+    """
+    if isinstance(terms, pa.ChunkedArray):
+        terms = terms.combine_chunks()
+    if len(terms) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    _, offset_buffer, data_buffer = terms.buffers()
+    offset_type = np.int64 if pa.types.is_large_string(terms.type) else np.int32
+    offsets = np.frombuffer(offset_buffer, dtype=offset_type)[terms.offset:terms.offset + len(terms) + 1]
+    offsets = offsets.astype(np.int64)
+    data = np.zeros(0, dtype=np.uint8) if data_buffer is None else np.frombuffer(data_buffer, dtype=np.uint8)
+    lengths = np.diff(offsets)
+    positions = np.arange(offsets[0], offsets[-1])
+    contributions = data[positions].astype(np.uint64) * HASH_MULTIPLIERS[
+        (positions - np.repeat(offsets[:-1], lengths)) % len(HASH_MULTIPLIERS)]
+    cumulative = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(contributions, dtype=np.uint64)])
+    hashes = cumulative[offsets[1:] - offsets[0]] - cumulative[offsets[:-1] - offsets[0]] + lengths.astype(np.uint64)
+    # Mix high bits into low bits used for partitioning.
+    return hashes ^ (hashes >> np.uint64(29))
+
+
+class OutOfCoreIndexer:
+    """ Chunked preprocessing of knowledge graphs not fitting into memory.
+
+    (1) spill(): Splits are streamed in chunks whose size is bounded by the memory budget.
+        Entities of a chunk are dictionary-encoded locally. Local int32 triples are written into .npy files and
+        local dictionaries are hash partitioned into files on disk together with training frequencies.
+    (2) merge(): Each partition is aggregated on its own. This assigns global indexes to entities,
+        sums their frequencies and writes a mapping from local indexes to global indexes per chunk.
+    (3) write(): Chunks are mapped into global indexes in two passes. The first pass drops training triples having
+        infrequent entities or relations and finds terms occurring in the remaining triples. The second pass writes
+        compacted indexes into flat .npy files and parquet files incrementally.
+
+    Relations are assumed to fit into memory and are encoded via IncrementalVocabulary.
+    """
+
+    def __init__(self, storage_path: str, memory_budget: int, data_paths: List[str], block_size: int = None,
+                 num_partitions: int = None):
+        """
+        :param storage_path: A folder where indexed splits and vocabularies are written
+        :param memory_budget: Memory budget in MB
+        :param data_paths: Paths of input files used to determine the number of partitions
+        :param block_size: Number of bytes read at once. If None, 1/16 of the budget
+        :param num_partitions: Number of hash partitions. If None, a partition is expected to take half of the budget
+        """
+        memory_budget = memory_budget * 2 ** 20
+        assert memory_budget > 0
+        self.storage_path = storage_path
+        self.spill_path = tempfile.mkdtemp(prefix='out_of_core_', dir=storage_path)
+        self.block_size = block_size if block_size else max(1 << 20, memory_budget // 16)
+        input_size = sum(os.path.getsize(i) for i in data_paths if os.path.isfile(i))
+        self.num_partitions = num_partitions if num_partitions else max(1, int(np.ceil(2 * input_size / memory_budget)))
+        self.partition_schema = pa.schema([('term', pa.string()), ('frequency', pa.int64()),
+                                           ('chunk', pa.int32()), ('local', pa.int32())])
+        self.partition_writers = [pa.ipc.new_file(self.partition_file(i), self.partition_schema)
+                                  for i in range(self.num_partitions)]
+        self.relation_vocab = IncrementalVocabulary()
+        self.relation_frequency = np.zeros(0, dtype=np.int64)
+        # (split name, number of triples) per chunk
+        self.chunks = []
+        self.num_entities = None
+
+    def partition_file(self, i: int) -> str:
+        return self.spill_path + f'/partition_{i}.arrow'
+
+    def chunk_file(self, i: int, kind: str) -> str:
+        return self.spill_path + f'/chunk_{i}_{kind}.npy'
+
+    def spill(self, name: str, data_path: str, read_only_few: int = None, sample_triples_ratio: float = None,
+              writer_path: str = None) -> bool:
+        """
+        Stream a split, write locally indexed chunks and hash partition local dictionaries.
+        :param name: train, valid or test. Frequencies are counted only on train
+        :param data_path:
+        :param read_only_few:
+        :param sample_triples_ratio:
+        :param writer_path: If given, string triples are also written into a parquet file
+        :return: False if data_path does not exist
+        """
+        if not os.path.isfile(data_path):
+            print(f'{data_path} could not found!')
+            return False
+        writer = None
+        for table in read_batches_with_pyarrow(data_path, read_only_few, sample_triples_ratio,
+                                               block_size=self.block_size):
+            if table.num_rows == 0:
+                continue
+            if writer_path is not None:
+                if writer is None:
+                    writer = pq.ParquetWriter(writer_path, table.schema, compression='gzip')
+                writer.write_table(table)
+            chunk, num_triples = len(self.chunks), table.num_rows
+            # (1) Local dictionary encoding of entities.
+            encoded = pc.dictionary_encode(pa.chunked_array(table['subject'].chunks + table['object'].chunks,
+                                                            type=pa.string())).combine_chunks()
+            dictionary, local = encoded.dictionary, encoded.indices.to_numpy(zero_copy_only=False).astype(np.int32)
+            relations, = self.relation_vocab.encode([table['relation']])
+            del table, encoded
+            np.save(self.chunk_file(chunk, 'triples'),
+                    np.stack((local[:num_triples], relations, local[num_triples:]), axis=1))
+            np.save(self.chunk_file(chunk, 'mapping'), np.full(len(dictionary), -1, dtype=np.int32))
+            # (2) Frequencies on training data.
+            self.relation_frequency = np.append(
+                self.relation_frequency, np.zeros(len(self.relation_vocab) - len(self.relation_frequency), np.int64))
+            if name == 'train':
+                frequency = np.bincount(local, minlength=len(dictionary))
+                self.relation_frequency += np.bincount(relations, minlength=len(self.relation_vocab))
+            else:
+                frequency = np.zeros(len(dictionary), dtype=np.int64)
+            # (3) Hash partition the local dictionary.
+            partitions = (hash_strings(dictionary) % np.uint64(self.num_partitions)).astype(np.int64)
+            order = np.argsort(partitions, kind='stable')
+            bounds = np.searchsorted(partitions[order], np.arange(self.num_partitions + 1))
+            partitioned = pa.table({'term': dictionary.take(pa.array(order)), 'frequency': frequency[order],
+                                    'chunk': np.full(len(order), chunk, dtype=np.int32),
+                                    'local': order.astype(np.int32)}, schema=self.partition_schema)
+            for i in range(self.num_partitions):
+                if bounds[i + 1] > bounds[i]:
+                    self.partition_writers[i].write_table(partitioned.slice(bounds[i], bounds[i + 1] - bounds[i]))
+            self.chunks.append((name, num_triples))
+        if writer is not None:
+            writer.close()
+        return True
+
+    def merge(self) -> None:
+        """ Aggregate partitions one by one: assign global indexes, sum frequencies and fill chunk mappings """
+        for writer in self.partition_writers:
+            writer.close()
+        self.num_entities = 0
+        vocab_writer = pa.ipc.new_file(self.spill_path + '/entities.arrow', pa.schema([('term', pa.string())]))
+        with open(self.spill_path + '/entity_frequency.bin', 'wb') as frequency_writer:
+            for i in range(self.num_partitions):
+                table = pa.ipc.open_file(self.partition_file(i)).read_all()
+                if table.num_rows > 0:
+                    grouped = table.group_by('term').aggregate([('frequency', 'sum')])
+                    indexes = pa.table({'term': grouped['term'],
+                                        'index': np.arange(self.num_entities, self.num_entities + grouped.num_rows,
+                                                           dtype=np.int32)})
+                    joined = table.select(['term', 'chunk', 'local']).join(indexes, keys='term')
+                    chunks, local, global_indexes = [joined[c].to_numpy() for c in ['chunk', 'local', 'index']]
+                    order = np.argsort(chunks, kind='stable')
+                    chunks, local, global_indexes = chunks[order], local[order], global_indexes[order]
+                    unique_chunks, starts = np.unique(chunks, return_index=True)
+                    for chunk, start, end in zip(unique_chunks, starts, np.append(starts[1:], len(chunks))):
+                        mapping = np.load(self.chunk_file(chunk, 'mapping'), mmap_mode='r+')
+                        mapping[local[start:end]] = global_indexes[start:end]
+                        mapping.flush()
+                        del mapping
+                    vocab_writer.write_table(grouped.select(['term']))
+                    grouped['frequency_sum'].to_numpy().astype(np.int64).tofile(frequency_writer)
+                    self.num_entities += grouped.num_rows
+                    del table, grouped, indexes, joined
+                os.remove(self.partition_file(i))
+        vocab_writer.close()
+
+    def global_triples(self, chunk: int) -> np.ndarray:
+        """ Triples of a chunk indexed with global entity indexes """
+        triples = np.load(self.chunk_file(chunk, 'triples'))
+        mapping = np.load(self.chunk_file(chunk, 'mapping'))
+        triples[:, 0], triples[:, 2] = mapping[triples[:, 0]], mapping[triples[:, 2]]
+        return triples
+
+    def write(self, min_freq_for_vocab: int = None, add_reciprical: bool = False,
+              add_noise_rate: float = None, serialize_parquet: bool = True) -> dict:
+        """
+        (1) Add reciprocal relations and count frequencies including reciprocal triples
+        (2) First pass: Drop training triples with infrequent entities or relations and find used terms
+        (3) Second pass: Write compacted indexes into {split}_triples.npy and idx_{split}_df.gzip
+        (4) Add noisy triples sampled from training entities and relations
+        (5) Write vocabularies into entity_to_idx.gzip and relation_to_idx.gzip
+        :return: A dictionary from split names to memory-mapped (n,3) int32 arrays
+        """
+        if self.num_entities is None:
+            self.merge()
+        # (1) Frequencies of entities and relations in training data.
+        entity_frequency = np.memmap(self.spill_path + '/entity_frequency.bin', dtype=np.int64, mode='r') \
+            if self.num_entities > 0 else np.zeros(0, dtype=np.int64)
+        relation_frequency = self.relation_frequency
+        inverse_relations = None
+        if add_reciprical:
+            inverse_relations = self.relation_vocab.extend(
+                pc.binary_join_element_wise(self.relation_vocab.terms, pa.scalar('_inverse'), ''))
+            relation_frequency = np.append(relation_frequency,
+                                           np.zeros(len(self.relation_vocab) - len(relation_frequency), np.int64))
+            relation_frequency[inverse_relations] += relation_frequency[:len(inverse_relations)].copy()
+        if min_freq_for_vocab is not None:
+            assert isinstance(min_freq_for_vocab, int)
+            assert min_freq_for_vocab > 0
+            frequent_entities = entity_frequency * (2 if add_reciprical else 1) > min_freq_for_vocab
+            frequent_relations = relation_frequency > min_freq_for_vocab
+
+        def chunks_of_split(name: str):
+            for chunk, (split, _) in enumerate(self.chunks):
+                if split == name:
+                    triples = self.global_triples(chunk)
+                    if name == 'train' and min_freq_for_vocab is not None:
+                        triples = triples[frequent_entities[triples[:, 0]] & frequent_entities[triples[:, 2]] &
+                                          frequent_relations[triples[:, 1]]]
+                    yield triples
+
+        # (2) First pass.
+        used_entities = np.zeros(self.num_entities, dtype=bool)
+        used_relations = np.zeros(len(self.relation_vocab), dtype=bool)
+        num_triples = dict()
+        for name in ['train', 'valid', 'test']:
+            if not any(split == name for split, _ in self.chunks):
+                continue
+            num_triples[name] = 0
+            for triples in chunks_of_split(name):
+                used_entities[triples[:, 0]] = True
+                used_entities[triples[:, 2]] = True
+                used_relations[triples[:, 1]] = True
+                num_triples[name] += len(triples)
+        if add_reciprical:
+            used_relations[inverse_relations[used_relations[:len(inverse_relations)]]] = True
+        entity_mapping = np.where(used_entities, np.cumsum(used_entities) - 1, -1).astype(np.int32)
+        relation_mapping = self.relation_vocab.select(used_relations)
+        # Entities and relations of training triples are sampled for noisy triples.
+        train_entities = np.zeros(self.num_entities, dtype=bool)
+        train_relations = np.zeros(len(relation_mapping), dtype=bool)
+        # (3) Second pass.
+        splits = dict()
+        for name, num in num_triples.items():
+            num_rows = num * (2 if add_reciprical else 1)
+            num_noisy_triples = int(num_rows * add_noise_rate) if name == 'train' and add_noise_rate else 0
+            out = np.lib.format.open_memmap(self.storage_path + f'/{name}_triples.npy', mode='w+', dtype=np.int32,
+                                            shape=(num_rows + num_noisy_triples, 3))
+            position = 0
+            for triples in chunks_of_split(name):
+                if name == 'train':
+                    train_entities[triples[:, 0]] = True
+                    train_entities[triples[:, 2]] = True
+                    train_relations[triples[:, 1]] = True
+                    if add_reciprical:
+                        train_relations[inverse_relations[triples[:, 1]]] = True
+                end = position + len(triples)
+                out[position:end] = np.stack((entity_mapping[triples[:, 0]], relation_mapping[triples[:, 1]],
+                                              entity_mapping[triples[:, 2]]), axis=1)
+                if add_reciprical:
+                    out[num + position:num + end] = np.stack((entity_mapping[triples[:, 2]],
+                                                              relation_mapping[inverse_relations[triples[:, 1]]],
+                                                              entity_mapping[triples[:, 0]]), axis=1)
+                position = end
+            # (4) Noisy triples.
+            if num_noisy_triples > 0:
+                entities = entity_mapping[train_entities]
+                relations = relation_mapping[train_relations]
+                out[num_rows:] = np.stack((np.random.choice(entities, num_noisy_triples),
+                                           np.random.choice(relations, num_noisy_triples),
+                                           np.random.choice(entities, num_noisy_triples)), axis=1)
+            out.flush()
+            if serialize_parquet:
+                self.npy_to_parquet(out, self.storage_path + f'/idx_{name}_df.gzip')
+            splits[name] = out
+        # (5) Vocabularies.
+        self.write_entity_vocabulary(used_entities, self.storage_path + '/entity_to_idx.gzip')
+        self.relation_vocab.to_parquet(self.storage_path + '/relation_to_idx.gzip', column='relation')
+        self.num_entities = int(used_entities.sum())
+        return splits
+
+    def npy_to_parquet(self, triples: np.ndarray, path: str) -> None:
+        """ Write (n,3) indexed triples into a parquet file in row groups """
+        num_rows = max(1, self.block_size // 12)
+        with pq.ParquetWriter(path, pa.schema([(c, pa.int32()) for c in COLUMN_NAMES]),
+                              compression='gzip') as writer:
+            for start in range(0, max(len(triples), 1), num_rows):
+                block = np.asarray(triples[start:start + num_rows])
+                writer.write_table(pa.table({c: block[:, i] for i, c in enumerate(COLUMN_NAMES)}))
+
+    def write_entity_vocabulary(self, used_entities: np.ndarray, path: str) -> None:
+        """ Stream merged entities in the order of global indexes into a parquet file and drop unused ones """
+        reader = pa.ipc.open_file(self.spill_path + '/entities.arrow')
+        start, num_written = 0, 0
+        with pq.ParquetWriter(path, vocabulary_schema('entity'), compression='gzip') as writer:
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                terms = batch['term'].filter(pa.array(used_entities[start:start + batch.num_rows]))
+                writer.write_table(pa.table({'entity': np.arange(num_written, num_written + len(terms)),
+                                             '__index_level_0__': terms}, schema=vocabulary_schema('entity')))
+                start += batch.num_rows
+                num_written += len(terms)
+
+    def close(self) -> None:
+        """ Remove spilled files """
+        shutil.rmtree(self.spill_path, ignore_errors=True)
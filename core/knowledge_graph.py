@@ -5,18 +5,28 @@ import numpy as np
 import pickle
 import json
 import os
+import shutil
+import tempfile
 import pandas as pd
 from .static_funcs import performance_debugger, get_er_vocab, get_ee_vocab, get_re_vocab, \
     create_recipriocal_triples, add_noisy_triples, index_triples, load_data_parallel, create_constraints, \
-    numpy_data_type_changer, vocab_to_parquet, preprocess_dataframe_of_kg, dask_remove_triples_with_condition
+    constraints_from_ranges, numpy_data_type_changer, vocab_to_parquet, preprocess_dataframe_of_kg, save_indexed_triples, load_indexed_triples
 from .sanity_checkers import dataset_sanity_checking
+from .filter_index import FilterIndex
 import glob
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
+from .vocabulary import ParquetVocabulary
+from .ingestion import IncrementalVocabulary, OutOfCoreIndexer, read_and_encode_split
+
+# Indices used to compute filtered ranks. Each one is serialized next to idx_train_df.gzip
+FILTER_INDICES = ['er_vocab', 're_vocab', 'ee_vocab', 'domain_constraints_per_rel', 'range_constraints_per_rel']
 
 
 class KG:
     """ Knowledge Graph Class
-        1- Reading : Large input data is read via DASK
+        1- Reading : Input data is read via pandas or pyarrow. Input data larger than memory is indexed out-of-core
         2- Cleaning & Preprocessing :
                                     Remove triples with literals if exists
                                     Apply reciprocal data augmentation triples into train, valid and test datasets
@@ -30,7 +40,8 @@ class KG:
                  read_only_few: int = None, sample_triples_ratio: float = None,
                  path_for_serialization: str = None, add_noise_rate: float = None,
                  min_freq_for_vocab: int = None,
-                 entity_to_idx=None, relation_to_idx=None, dnf_predicates=None, backend=None):
+                 entity_to_idx=None, relation_to_idx=None, dnf_predicates=None, backend=None,
+                 memory_budget: int = None):
         """
 
         :param data_dir: A path of a folder containing the input knowledge graph
@@ -39,6 +50,7 @@ class KG:
         :param add_reciprical: A flag for applying reciprocal data augmentation technique
         :param eval_model: A flag indicating whether evaluation will be applied. If no eval, then entity relation mappings will be deleted to free memory.
         :param add_noise_rate: Add say 10% noise in the input data
+        :param memory_budget: If given, input data is indexed out-of-core in chunks bounded by memory_budget MB
         sample_triples_ratio
         """
         self.num_entities = None
@@ -61,9 +73,30 @@ class KG:
         self.backend = 'pandas' if backend is None else backend
         self.input_is_parquet = None
         self.dnf_predicates = dnf_predicates
+        self.memory_budget = memory_budget
+        # Integer indexed splits obtained while constructing vocabularies.
+        self.indexed_splits = dict()
 
         # (1) Load + Preprocess input data.
-        if deserialize_flag is None:
+        if deserialize_flag is None and (self.backend == 'pyarrow' or memory_budget is not None) \
+                and entity_to_idx is None and relation_to_idx is None and self.data_dir[-8:] != '.parquet':
+            # (1.1) Stream, preprocess and index input data without constructing string dataframes.
+            if memory_budget is not None:
+                self.out_of_core_read_index_serialize()
+            else:
+                self.pyarrow_read_index_serialize()
+            if eval_model and memory_budget is not None and path_for_serialization is not None:
+                print('Final: Creating and serializing Vocab from memory-mapped splits...')
+                self.construct_filter_indices_out_of_core(path_for_serialization)
+                print('Done !\n')
+            elif eval_model:
+                print('Final: Creating Vocab...')
+                self.construct_filter_indices()
+                if path_for_serialization is not None:
+                    print('Final: Serializing Vocab...')
+                    self.serialize_filter_indices(path_for_serialization)
+                    print('Done !\n')
+        elif deserialize_flag is None:
             # (1.1) Load and Preprocess the data.
             self.train_set, self.valid_set, self.test_set = self.load_read_process()
             # (1.2) Update (1.1).
@@ -86,10 +119,7 @@ class KG:
                 print('[10 / 14] Mapping training data into integers for training...')
                 start_time = time.time()
                 # 9. Use bijection mappings obtained in (4) and (5) to create training data for models.
-                self.train_set = index_triples(self.train_set,
-                                               self.entity_to_idx,
-                                               self.relation_to_idx,
-                                               num_core=os.cpu_count())
+                self.train_set = self.index_split('train', self.train_set)
                 print(f'Done ! {time.time() - start_time:.3f} seconds\n')
                 if path_for_serialization is not None:
                     # 10. Serialize (9).
@@ -113,7 +143,7 @@ class KG:
                 print('Done !\n')
                 print('[10 / 14] Mapping training data into integers for training...')
                 # 9. Use bijection mappings obtained in (4) and (5) to create training data for models.
-                self.train_set = index_triples(self.train_set, self.entity_to_idx, self.relation_to_idx)
+                self.train_set = self.index_split('train', self.train_set)
                 print('Done !\n')
                 self.train_set = self.train_set
                 assert isinstance(self.train_set, pd.core.frame.DataFrame)
@@ -134,7 +164,7 @@ class KG:
                         path_for_serialization + '/valid_df.gzip', compression='gzip', engine='pyarrow')
                     print('Done !\n')
                 print('[14 / 14 ] Indexing validation dataset...')
-                self.valid_set = index_triples(self.valid_set, self.entity_to_idx, self.relation_to_idx)
+                self.valid_set = self.index_split('valid', self.valid_set)
                 print('Done !\n')
                 if path_for_serialization is not None:
                     print('[15 / 14 ] Serializing indexed validation dataset...')
@@ -152,7 +182,7 @@ class KG:
                         path_for_serialization + '/test_df.gzip', compression='gzip', engine='pyarrow')
                     print('Done !\n')
                 print('[17 / 14 ] Indexing test dataset...')
-                self.test_set = index_triples(self.test_set, self.entity_to_idx, self.relation_to_idx)
+                self.test_set = self.index_split('test', self.test_set)
                 print('Done !\n')
                 if path_for_serialization is not None:
                     print('[18 / 14 ] Serializing indexed test dataset...')
@@ -164,37 +194,33 @@ class KG:
                 self.test_set = numpy_data_type_changer(self.test_set, num=max(self.num_entities, self.num_relations))
                 print('Done !\n')
             if eval_model:  # and len(self.valid_set) > 0 and len(self.test_set) > 0:
-                if self.valid_set is not None and self.test_set is not None:
-                    assert isinstance(self.valid_set, np.ndarray) and isinstance(self.test_set, np.ndarray)
-                    # 16. Create a bijection mapping from subject-relation pairs to tail entities.
-                    data = np.concatenate([self.train_set, self.valid_set, self.test_set])
-                else:
-                    data = self.train_set
                 # TODO do it via dask: No need to wait here.
                 print('Final: Creating Vocab...')
-                self.er_vocab = get_er_vocab(data)
-                self.re_vocab = get_re_vocab(data)
-                # 17. Create a bijection mapping from subject-object pairs to relations.
-                self.ee_vocab = get_ee_vocab(data)
-                self.domain_constraints_per_rel, self.range_constraints_per_rel = create_constraints(self.train_set)
+                self.construct_filter_indices()
+                if path_for_serialization is not None:
+                    print('Final: Serializing Vocab...')
+                    self.serialize_filter_indices(path_for_serialization)
+                    print('Done !\n')
         else:
             self.deserialize(deserialize_flag)
 
             if self.eval_model:
-                if self.valid_set is not None and self.test_set is not None:
-                    # 16. Create a bijection mapping from subject-relation pairs to tail entities.
-                    data = np.concatenate([self.train_set, self.valid_set, self.test_set])
-                else:
-                    data = self.train_set
-                print('[7 / 4] Creating er,re, and ee type vocabulary for evaluation...')
                 start_time = time.time()
-                self.er_vocab = get_er_vocab(data)
-                self.re_vocab = get_re_vocab(data)
-                # 17. Create a bijection mapping from subject-object pairs to relations.
-                self.ee_vocab = get_ee_vocab(data)
-                self.domain_constraints_per_rel, self.range_constraints_per_rel = create_constraints(self.train_set)
+                if self.deserialize_filter_indices(deserialize_flag):
+                    print('[7 / 4] Memory-mapping er,re, and ee type vocabulary for evaluation...')
+                else:
+                    print('[7 / 4] Creating er,re, and ee type vocabulary for evaluation...')
+                    self.construct_filter_indices()
+                    if path_for_serialization is not None:
+                        self.serialize_filter_indices(path_for_serialization)
                 print(f'Done !\t{time.time() - start_time:.3f} seconds\n')
 
+        if deserialize_flag is None and path_for_serialization is not None:
+            # (2) Serialize indexed splits in a memory-mappable format.
+            print('Final: Serializing indexed splits as .npy files...')
+            self.serialize_indexed_splits(path_for_serialization)
+            print('Done !\n')
+
         # 4. Display info
         self.description_of_input = f'\n------------------- Description of Dataset {data_dir} -------------------'
         self.description_of_input += f'\nNumber of entities: {self.num_entities}' \
@@ -234,26 +260,189 @@ class KG:
         print('Done !\n')
 
         print('[5 / 14] Creating a mapping from entities to integer indexes...')
-        # (5) Create a bijection mapping from entities of (2) to integer indexes.
-        # ravel('K') => Return a contiguous flattened array.
-        # ‘K’ means to read the elements in the order they occur in memory, except for reversing the data when strides are negative.
-        ordered_list = pd.unique(df_str_kg[['subject', 'object']].values.ravel('K'))
+        # (5) Create a bijection mapping from entities of (2) to integer indexes and
+        # map entities into integer indexes in the same vectorized pass.
+        # Entities are read in the order they occur in memory, i.e., ravel('K').
+        entities = df_str_kg[['subject', 'object']].values
+        order = 'F' if entities.flags.f_contiguous else 'C'
+        entity_codes, ordered_list = pd.factorize(entities.ravel(order))
+        entity_codes = entity_codes.reshape(entities.shape, order=order)
+        del entities
         self.entity_to_idx = pd.DataFrame(data=np.arange(len(ordered_list)), columns=['entity'], index=ordered_list)
         print('Done !\n')
         vocab_to_parquet(self.entity_to_idx, 'entity_to_idx.gzip', self.path_for_serialization,
                          print_into='[6 / 14] Serializing compressed entity integer mapping...')
         # 5. Create a bijection mapping  from relations to integer indexes.
         print('[7 / 14] Creating a mapping from relations to integer indexes...')
-        ordered_list = pd.unique(df_str_kg['relation'].values.ravel('K'))
+        relation_codes, ordered_list = pd.factorize(df_str_kg['relation'].values)
         self.relation_to_idx = pd.DataFrame(data=np.arange(len(ordered_list)),
                                             columns=['relation'],
                                             index=ordered_list)
         print('Done !\n')
+        # (6) Split integer indexed triples into train, valid and test.
+        indexed_kg = pd.DataFrame({'subject': entity_codes[:, 0],
+                                   'relation': relation_codes,
+                                   'object': entity_codes[:, 1]})
+        start = 0
+        for name, split in [('train', self.train_set), ('valid', self.valid_set), ('test', self.test_set)]:
+            if split is not None:
+                self.indexed_splits[name] = indexed_kg.iloc[start:start + len(split)].reset_index(drop=True)
+                start += len(split)
+        del indexed_kg, entity_codes, relation_codes
 
         vocab_to_parquet(self.relation_to_idx, 'relation_to_idx.gzip', self.path_for_serialization,
                          '[8 / 14] Serializing compressed relation integer mapping...')
         del ordered_list
 
+    def index_split(self, name: str, split: pd.DataFrame) -> pd.DataFrame:
+        """ Return integer indexed triples of a split if they are obtained while constructing vocabularies,
+        otherwise index the split """
+        if name in self.indexed_splits:
+            return self.indexed_splits.pop(name)
+        return index_triples(split, self.entity_to_idx, self.relation_to_idx, num_core=self.num_core)
+
+    def pyarrow_read_index_serialize(self) -> None:
+        """
+        (1) Stream train, valid and test splits via pyarrow and dictionary-encode them into int32 triples
+        (2) Add reciprocal and noisy triples on integer indexes
+        (3) Remove triples with infrequent entities or relations
+        (4) Serialize vocabularies and indexed splits
+        """
+        entity_vocab, relation_vocab = IncrementalVocabulary(), IncrementalVocabulary()
+        print(f'[1 / 6] Streaming and dictionary-encoding training data via pyarrow: '
+              f'read_only_few: {self.read_only_few} , sample_triples_ratio: {self.sample_triples_ratio}...')
+        start_time = time.time()
+        self.train_set = read_and_encode_split(self.data_dir + '/train.txt', entity_vocab, relation_vocab,
+                                               read_only_few=self.read_only_few,
+                                               sample_triples_ratio=self.sample_triples_ratio)
+        print(f'Done ! {time.time() - start_time:.3f} seconds\n')
+        print('[2 / 6] Streaming and dictionary-encoding valid and test data via pyarrow...')
+        self.valid_set = read_and_encode_split(self.data_dir + '/valid.txt', entity_vocab, relation_vocab,
+                                               writer_path=self.path_for_serialization + '/valid_df.gzip'
+                                               if self.path_for_serialization else None)
+        self.test_set = read_and_encode_split(self.data_dir + '/test.txt', entity_vocab, relation_vocab,
+                                              writer_path=self.path_for_serialization + '/test_df.gzip'
+                                              if self.path_for_serialization else None)
+        print('Done !\n')
+        self.input_is_parquet = False
+        # (2) Add reciprocal triples, e.g. KG:= {(s,p,o)} union {(o,p_inverse,s)}
+        if self.add_reciprical and self.eval_model:
+            print('[3 / 6] Add reciprocal triples to train, validation, and test sets...')
+            inverse_relations = relation_vocab.extend(
+                pc.binary_join_element_wise(relation_vocab.terms, pa.scalar('_inverse'), ''))
+            self.train_set, self.valid_set, self.test_set = [
+                None if i is None else np.concatenate([i, np.stack((i[:, 2], inverse_relations[i[:, 1]], i[:, 0]),
+                                                                   axis=1)])
+                for i in [self.train_set, self.valid_set, self.test_set]]
+            print('Done !\n')
+        # (3) Extend KG with triples where entities and relations are randomly sampled.
+        if self.add_noise_rate is not None:
+            num_noisy_triples = int(len(self.train_set) * self.add_noise_rate)
+            print(f'[4 / 6] Generating {num_noisy_triples} noisy triples for training data...')
+            entities, relations = np.unique(self.train_set[:, [0, 2]]), np.unique(self.train_set[:, 1])
+            self.train_set = np.concatenate([self.train_set,
+                                             np.stack((np.random.choice(entities, num_noisy_triples),
+                                                       np.random.choice(relations, num_noisy_triples),
+                                                       np.random.choice(entities, num_noisy_triples)),
+                                                      axis=1).astype(np.int32)])
+            print('Done !\n')
+        # (4) Remove triples with infrequent entities or relations from train and
+        # remove terms not occurring in any split from vocabularies.
+        if self.min_freq_for_vocab is not None:
+            assert isinstance(self.min_freq_for_vocab, int)
+            assert self.min_freq_for_vocab > 0
+            print(f'[5 / 6] Dropping triples having infrequent entities or relations (>{self.min_freq_for_vocab})...',
+                  end=' ')
+            print('Total num triples:', self.train_set.size, end=' ')
+            entity_frequency = np.bincount(self.train_set[:, [0, 2]].ravel(), minlength=len(entity_vocab))
+            relation_frequency = np.bincount(self.train_set[:, 1], minlength=len(relation_vocab))
+            self.train_set = self.train_set[(entity_frequency[self.train_set[:, 0]] > self.min_freq_for_vocab) &
+                                            (entity_frequency[self.train_set[:, 2]] > self.min_freq_for_vocab) &
+                                            (relation_frequency[self.train_set[:, 1]] > self.min_freq_for_vocab)]
+            print('\t after dropping:', self.train_set.size)
+            splits = [i for i in [self.train_set, self.valid_set, self.test_set] if i is not None]
+            used_entities, used_relations = np.zeros(len(entity_vocab), bool), np.zeros(len(relation_vocab), bool)
+            for i in splits:
+                used_entities[i[:, [0, 2]].ravel()] = True
+                used_relations[i[:, 1]] = True
+            entity_mapping, relation_mapping = entity_vocab.select(used_entities), relation_vocab.select(
+                used_relations)
+            for i in splits:
+                i[:, 0], i[:, 1], i[:, 2] = entity_mapping[i[:, 0]], relation_mapping[i[:, 1]], entity_mapping[i[:, 2]]
+            print('Done !\n')
+        # (5) Serialize vocabularies and indexed data
+        self.num_entities, self.num_relations = len(entity_vocab), len(relation_vocab)
+        if self.path_for_serialization is not None:
+            print('[6 / 6] Serializing compressed entity and relation integer mappings and indexed data...')
+            entity_vocab.to_parquet(self.path_for_serialization + '/entity_to_idx.gzip', column='entity')
+            relation_vocab.to_parquet(self.path_for_serialization + '/relation_to_idx.gzip', column='relation')
+            for name, split in [('train', self.train_set), ('valid', self.valid_set), ('test', self.test_set)]:
+                if split is not None:
+                    pq.write_table(pa.table({'subject': split[:, 0], 'relation': split[:, 1], 'object': split[:, 2]}),
+                                   self.path_for_serialization + f'/idx_{name}_df.gzip', compression='gzip')
+            print('Done !\n')
+        self.entity_to_idx, self.relation_to_idx = entity_vocab.to_dict(), relation_vocab.to_dict()
+        for name in ['train_set', 'valid_set', 'test_set']:
+            split = getattr(self, name)
+            if split is not None:
+                dataset_sanity_checking(split, self.num_entities, self.num_relations)
+                setattr(self, name, numpy_data_type_changer(split, num=max(self.num_entities, self.num_relations)))
+
+    def out_of_core_read_index_serialize(self) -> None:
+        """
+        Index input data in chunks bounded by the memory budget, see OutOfCoreIndexer.
+        (1) Stream splits, dictionary-encode chunks locally and spill them into disk
+        (2) Merge hash partitioned vocabularies
+        (3) Drop training triples with infrequent entities or relations in two passes and write indexed splits into
+        {split}_triples.npy files. Indexed splits are memory-mapped.
+        """
+        storage_path = self.path_for_serialization if self.path_for_serialization is not None else tempfile.mkdtemp()
+        indexer = OutOfCoreIndexer(storage_path, self.memory_budget,
+                                   [self.data_dir + f'/{name}.txt' for name in ['train', 'valid', 'test']])
+        try:
+            print(f'[1 / 4] Streaming and spilling training data in chunks of {indexer.block_size} bytes: '
+                  f'read_only_few: {self.read_only_few} , sample_triples_ratio: {self.sample_triples_ratio}...')
+            start_time = time.time()
+            indexer.spill('train', self.data_dir + '/train.txt', read_only_few=self.read_only_few,
+                          sample_triples_ratio=self.sample_triples_ratio)
+            print(f'Done ! {time.time() - start_time:.3f} seconds\n')
+            print('[2 / 4] Streaming and spilling valid and test data in chunks...')
+            for name in ['valid', 'test']:
+                indexer.spill(name, self.data_dir + f'/{name}.txt',
+                              writer_path=self.path_for_serialization + f'/{name}_df.gzip'
+                              if self.path_for_serialization else None)
+            print('Done !\n')
+            print(f'[3 / 4] Merging {indexer.num_partitions} hash partitions of entities...')
+            start_time = time.time()
+            indexer.merge()
+            print(f'Done ! {time.time() - start_time:.3f} seconds\n')
+            print(f'[4 / 4] Writing indexed triples (min_freq_for_vocab: {self.min_freq_for_vocab})...')
+            start_time = time.time()
+            splits = indexer.write(min_freq_for_vocab=self.min_freq_for_vocab,
+                                   add_reciprical=bool(self.add_reciprical and self.eval_model),
+                                   add_noise_rate=self.add_noise_rate,
+                                   serialize_parquet=self.path_for_serialization is not None)
+            self.relation_to_idx = indexer.relation_vocab.to_dict()
+            if self.path_for_serialization is None:
+                self.entity_to_idx = pd.read_parquet(storage_path + '/entity_to_idx.gzip').to_dict()['entity']
+            else:
+                # Entities are kept on disk.
+                self.entity_to_idx = ParquetVocabulary(storage_path + '/entity_to_idx.gzip', name='entity')
+            print(f'Done ! {time.time() - start_time:.3f} seconds\n')
+        finally:
+            indexer.close()
+        self.input_is_parquet = False
+        self.num_entities, self.num_relations = indexer.num_entities, len(self.relation_to_idx)
+        self.train_set, self.valid_set, self.test_set = [splits.get(name) for name in ['train', 'valid', 'test']]
+        if self.path_for_serialization is None:
+            # Indexed splits can not be memory-mapped from a temporary folder.
+            self.train_set, self.valid_set, self.test_set = [None if i is None else np.array(i) for i in
+                                                             [self.train_set, self.valid_set, self.test_set]]
+            shutil.rmtree(storage_path, ignore_errors=True)
+        for split in [self.train_set, self.valid_set, self.test_set]:
+            if split is not None:
+                dataset_sanity_checking(split, self.num_entities, self.num_relations)
+
     def remove_triples_from_train_with_condition(self):
         # @TODO: Move to static_funcs.py
         if self.min_freq_for_vocab is not None:
@@ -376,25 +565,102 @@ class KG:
         self.relation_to_idx = self.relation_to_idx.to_dict()['relation']
         print(f'Done !\t{time.time() - start_time:.3f} seconds\n')
         # 10. Serialize (9).
-        print('[4 / 4] Deserializing integer mapped data and mapping it to numpy ndarray...')
+        print('[4 / 4] Memory-mapping integer mapped training data...')
         start_time = time.time()
-        self.train_set = ddf.read_parquet(storage_path + '/idx_train_df.gzip').values.compute()
+        self.train_set = self.deserialize_indexed_split(storage_path, 'train')
         print(f'Done !\t{time.time() - start_time:.3f} seconds\n')
-        try:
-            print('[5 / 4] Deserializing integer mapped data and mapping it to numpy ndarray...')
-            self.valid_set = ddf.read_parquet(storage_path + '/idx_valid_df.gzip').values.compute()
-            print('Done!\n')
-        except FileNotFoundError:
-            print('No valid data found!\n')
-            self.valid_set = None  # pd.DataFrame()
+        print('[5 / 4] Memory-mapping integer mapped validation data...')
+        self.valid_set = self.deserialize_indexed_split(storage_path, 'valid')
+        print('Done!\n' if self.valid_set is not None else 'No valid data found!\n')
+        print('[6 / 4] Memory-mapping integer mapped test data...')
+        self.test_set = self.deserialize_indexed_split(storage_path, 'test')
+        print('Done!\n' if self.test_set is not None else 'No test data found\n')
 
+    def serialize_indexed_splits(self, storage_path: str) -> None:
+        """ Serialize indexed train, valid and test splits into int32 {split}_triples.npy files """
+        for name in ['train', 'valid', 'test']:
+            split = getattr(self, name + '_set')
+            if split is not None:
+                save_indexed_triples(split, storage_path, name, self.num_entities, self.num_relations)
+
+    def deserialize_indexed_split(self, storage_path: str, name: str) -> Union[np.ndarray, None]:
+        """ Memory-map {name}_triples.npy. Experiments serialized only in parquet are read into memory """
+        split = load_indexed_triples(storage_path, name, mmap_mode='r')
+        if split is not None:
+            return split
+        if os.path.isfile(storage_path + f'/idx_{name}_df.gzip'):
+            return pd.read_parquet(storage_path + f'/idx_{name}_df.gzip').values
+        return None
+
+    def construct_filter_indices(self) -> None:
+        """ Construct er,re, and ee type vocabularies over all splits and domain/range constraints over train """
+        if self.valid_set is not None and self.test_set is not None:
+            assert isinstance(self.valid_set, np.ndarray) and isinstance(self.test_set, np.ndarray)
+            # 16. Create a bijection mapping from subject-relation pairs to tail entities.
+            data = np.concatenate([self.train_set, self.valid_set, self.test_set])
+        else:
+            data = self.train_set
+        self.er_vocab = get_er_vocab(data)
+        self.re_vocab = get_re_vocab(data)
+        # 17. Create a bijection mapping from subject-object pairs to relations.
+        self.ee_vocab = get_ee_vocab(data)
+        self.domain_constraints_per_rel, self.range_constraints_per_rel = create_constraints(self.train_set)
+
+    def construct_filter_indices_out_of_core(self, storage_path: str) -> None:
+        """
+        Construct and serialize indices of construct_filter_indices() from memory-mapped splits read in chunks bounded
+        by the memory budget, see FilterIndex.from_triple_splits.
+        (1) er, re, and ee type vocabularies over all splits are written into storage_path
+        (2) Domains and ranges of relations over train are written into a temporary folder
+        (3) Domain/range constraints are computed from (2) and written into storage_path
+        """
+        # About 64 bytes per row are allocated while sorting a chunk.
+        chunk_size = max(1, self.memory_budget * 2 ** 20 // 64)
+        if self.valid_set is not None and self.test_set is not None:
+            splits = [self.train_set, self.valid_set, self.test_set]
+        else:
+            splits = [self.train_set]
+        num_entities, num_relations = self.num_entities, self.num_relations
+        # (1) er, re, and ee type vocabularies.
+        for name, key_columns, value_column, key_bases in [('er_vocab', (0, 1), 2, (num_entities, num_relations)),
+                                                           ('re_vocab', (1, 2), 0, (num_relations, num_entities)),
+                                                           ('ee_vocab', (0, 2), 1, (num_entities, num_entities))]:
+            setattr(self, name, FilterIndex.from_triple_splits(splits, key_columns, value_column, key_bases,
+                                                               path=storage_path + '/' + name, chunk_size=chunk_size))
+        # (2) Domains and ranges of relations.
+        working_path = tempfile.mkdtemp()
         try:
-            print('[6 / 4] Deserializing integer mapped data and mapping it to numpy ndarray...')
-            self.test_set = ddf.read_parquet(storage_path + '/idx_test_df.gzip').values.compute()
-            print('Done!\n')
-        except FileNotFoundError:
-            print('No test data found\n')
-            self.test_set = None
+            range_per_rel = FilterIndex.from_triple_splits([self.train_set], (1,), 2, (num_relations,),
+                                                           path=working_path + '/range_per_rel', chunk_size=chunk_size)
+            domain_per_rel = FilterIndex.from_triple_splits([self.train_set], (1,), 0, (num_relations,),
+                                                            path=working_path + '/domain_per_rel',
+                                                            chunk_size=chunk_size)
+            entities = np.zeros(num_entities, dtype=bool)
+            for start in range(0, len(self.train_set), chunk_size):
+                chunk = np.asarray(self.train_set[start:start + chunk_size])
+                entities[chunk[:, 0]] = True
+                entities[chunk[:, 2]] = True
+            # (3) Domain/range constraints.
+            self.domain_constraints_per_rel, self.range_constraints_per_rel = constraints_from_ranges(
+                range_per_rel, domain_per_rel, np.flatnonzero(entities))
+            del range_per_rel, domain_per_rel
+        finally:
+            shutil.rmtree(working_path, ignore_errors=True)
+        for name in ['domain_constraints_per_rel', 'range_constraints_per_rel']:
+            getattr(self, name).save(storage_path + '/' + name)
+
+    def serialize_filter_indices(self, storage_path: str) -> None:
+        """ Serialize er,re, and ee type vocabularies and domain/range constraints as flat .npy files """
+        for name in FILTER_INDICES:
+            getattr(self, name).save(storage_path + '/' + name)
+
+    def deserialize_filter_indices(self, storage_path: str) -> bool:
+        """ Memory-map er,re, and ee type vocabularies and domain/range constraints if they have been serialized """
+        if not all(os.path.isfile(storage_path + f'/{name}.json') for name in FILTER_INDICES):
+            return False
+        for name in FILTER_INDICES:
+            setattr(self, name, FilterIndex.load(storage_path + '/' + name, mmap_mode='r'))
+        return True
 
     @property
     def entities_str(self) -> List:
@@ -4,7 +4,6 @@ from typing import List, Tuple
 import pandas as pd
 import torch
 from torch import optim
-from torch.utils.data import DataLoader
 from .abstracts import BaseInteractiveKGE
 from .dataset_classes import TriplePredictionDataset
 
@@ -13,9 +12,11 @@ class KGE(BaseInteractiveKGE):
     """ Knowledge Graph Embedding Class for interactive usage of pre-trained models"""
     # @TODO: we can download the model if it is not present locally
     def __init__(self, path_of_pretrained_model_dir, construct_ensemble=False, model_name=None,
-                 apply_semantic_constraint=False):
+                 apply_semantic_constraint=False, query_cache_size=1024, use_ann_index=True, ann_num_probes=None,
+                 quantize=False):
         super().__init__(path_of_pretrained_model_dir, construct_ensemble=construct_ensemble, model_name=model_name,
-                         apply_semantic_constraint=apply_semantic_constraint)
+                         apply_semantic_constraint=apply_semantic_constraint, query_cache_size=query_cache_size,
+                         use_ann_index=use_ann_index, ann_num_probes=ann_num_probes, quantize=quantize)
 
     def construct_input_and_output(self, head_entity: List[str], relation: List[str], tail_entity: List[str], labels):
         """
@@ -47,7 +48,7 @@ class KGE(BaseInteractiveKGE):
         assert len(head_entity) == 1
         # (1) Get integer index of head entity.
         try:
-            idx_head_entity = self.entity_to_idx.loc[head_entity]['entity'].values[0]
+            idx_head_entity = self.entity_vocabulary.encode(head_entity)[0]
         except KeyError as e:
             print(f'Exception:\t {str(e)}')
             return
@@ -66,10 +67,7 @@ class KGE(BaseInteractiveKGE):
                                             num_entities=self.num_entities,
                                             num_relations=self.num_relations, neg_sample_ratio=neg_sample_ratio)
         del triples
-        data_loader = DataLoader(train_set,
-                                 batch_size=batch_size,
-                                 num_workers=num_workers,
-                                 collate_fn=train_set.collate_fn)
+        data_loader = train_set.batch_loader(batch_size=batch_size, shuffle=False, num_workers=num_workers)
 
         # (4) Train
         self.set_model_train_mode()
@@ -180,10 +178,9 @@ class KGE(BaseInteractiveKGE):
                                             neg_sample_ratio=neg_sample_ratio)
         num_data_point = len(train_set)
         print('Number of data points: ', num_data_point)
-        train_dataloader = DataLoader(train_set, batch_size=batch_size,
-                                      #  shuffle => to have the data reshuffled at every epoc
-                                      shuffle=True, num_workers=num_workers,
-                                      collate_fn=train_set.collate_fn, pin_memory=True)
+        #  shuffle => to have the data reshuffled at every epoc
+        train_dataloader = train_set.batch_loader(batch_size=batch_size, shuffle=True, num_workers=num_workers,
+                                                  pin_memory=True)
 
         # (2) Go through valid triples + corrupted triples and compute scores.
         # Average loss per triple is stored. This will be used  to indicate whether we learned something.
@@ -1,13 +1,17 @@
+import copy
 import pytorch_lightning as pl
 import torch
 from pytorch_lightning.utilities.types import TRAIN_DATALOADERS, EVAL_DATALOADERS
 from torch import nn
 from torch.nn import functional as F
 from torchmetrics import Accuracy as accuracy
-from typing import List, Any, Tuple, Union
+from typing import List, Any, Tuple, Union, Generator
 from torch.nn.init import xavier_normal_
 import numpy as np
-from core.custom_opt import Sls, AdamSLS, Adan
+from core.custom_opt import Sls, AdamSLS, Adan, LazyAdam
+from core.dataset_classes import SparseTargets
+from core.helper_classes import binary_cross_entropy_with_sparse_targets, \
+    blockwise_binary_cross_entropy_with_sparse_targets, LowPrecisionEmbedding
 
 
 class BaseKGE(pl.LightningModule):
@@ -27,16 +31,24 @@ class BaseKGE(pl.LightningModule):
         self.kernel_size = None
         self.num_of_output_channels = None
         self.weight_decay = None
+        self.k_vs_all_block_size = None
+        self.sparse_gradients = None
         self.loss = torch.nn.BCEWithLogitsLoss()
         self.selected_optimizer = None
         self.normalizer_class = None
-        self.normalize_head_entity_embeddings = lambda x: x
-        self.normalize_relation_embeddings = lambda x: x
-        self.normalize_tail_entity_embeddings = lambda x: x
+        self.normalize_head_entity_embeddings = nn.Identity()
+        self.normalize_relation_embeddings = nn.Identity()
+        self.normalize_tail_entity_embeddings = nn.Identity()
+        # Normalized embeddings of head and tail entities in a model exported for inference (see export_for_inference).
+        self.head_entity_embeddings = None
+        self.tail_entity_embeddings = None
         self.init_params_with_sanity_checking()
 
-        self.entity_embeddings = nn.Embedding(self.num_entities, self.embedding_dim)
-        self.relation_embeddings = nn.Embedding(self.num_relations, self.embedding_dim)
+        # Entity embeddings of PartitionedTrainer are stored in memory-mapped partitions and are not allocated here.
+        device = 'meta' if self.args.get('torch_trainer') == 'PartitionedTrainer' else None
+        self.entity_embeddings = nn.Embedding(self.num_entities, self.embedding_dim, sparse=self.sparse_gradients,
+                                              device=device)
+        self.relation_embeddings = nn.Embedding(self.num_relations, self.embedding_dim, sparse=self.sparse_gradients)
         xavier_normal_(self.entity_embeddings.weight.data), xavier_normal_(self.relation_embeddings.weight.data)
 
         # Dropouts
@@ -80,6 +92,17 @@ class BaseKGE(pl.LightningModule):
         else:
             self.hidden_dropout_rate = 0.0
 
+        if self.args.get("k_vs_all_block_size"):
+            self.k_vs_all_block_size = self.args['k_vs_all_block_size']
+        else:
+            self.k_vs_all_block_size = None
+
+        # Gradients of embeddings are sparse only for triples, as k vs all scores involve all entity embeddings.
+        self.sparse_gradients = bool(self.args.get("sparse_gradients"))
+        if self.sparse_gradients and self.args['scoring_technique'] != 'NegSample':
+            raise ValueError(f'sparse_gradients is only supported with NegSample scoring technique. '
+                             f'Currently:{self.args["scoring_technique"]}')
+
         if self.args['model'] in ['QMult', 'OMult', 'ConvQ', 'ConvO']:
             # @TODO: We should remove this unit norm part
             if self.args.get("apply_unit_norm"):
@@ -117,7 +140,7 @@ class BaseKGE(pl.LightningModule):
                 self.normalize_tail_entity_embeddings = self.normalizer_class(self.embedding_dim, affine=False)
         else:
             raise NotImplementedError()
-        if self.args.get("optim") in ['Adan', 'NAdam', 'Adam', 'SGD', 'ASGD', 'Sls', 'AdamSLS']:
+        if self.args.get("optim") in ['Adan', 'NAdam', 'Adam', 'Adagrad', 'SGD', 'ASGD', 'Sls', 'AdamSLS']:
             self.optimizer_name = self.args['optim']
         else:
             print(self.args)
@@ -126,10 +149,69 @@ class BaseKGE(pl.LightningModule):
     def get_embeddings(self) -> Tuple[np.ndarray, np.ndarray]:
         return self.entity_embeddings.weight.data.data.detach(), self.relation_embeddings.weight.data.detach()
 
+    def cast_embeddings(self, dtype: torch.dtype) -> 'BaseKGE':
+        """ Store weights of embeddings in dtype, e.g. torch.bfloat16 halves their memory.
+        Embeddings are replaced with LowPrecisionEmbedding returning float32 rows. """
+        replaced = dict()
+        for name, module in list(self.named_modules(remove_duplicate=False)):
+            if isinstance(module, nn.Embedding):
+                if id(module) not in replaced:
+                    replaced[id(module)] = LowPrecisionEmbedding.from_pretrained(
+                        module.weight.detach().to(dtype), freeze=not module.weight.requires_grad, sparse=module.sparse)
+                parent_name, _, attribute = name.rpartition('.')
+                setattr(self.get_submodule(parent_name), attribute, replaced[id(module)])
+        return self
+
+    def load_state_dict(self, state_dict, strict: bool = True):
+        """ Entity embeddings on the meta device, i.e., of a model configured for PartitionedTrainer, are allocated
+        before weights are loaded, since weights are not copied into tensors on the meta device. """
+        if self.entity_embeddings.weight.is_meta:
+            self.entity_embeddings = nn.Embedding(self.num_entities, self.embedding_dim, sparse=self.sparse_gradients)
+        return super().load_state_dict(state_dict, strict=strict)
+
+    def sparse_parameters(self) -> List[nn.Parameter]:
+        """ Weights of embeddings having sparse gradients """
+        return [m.weight for m in self.modules() if isinstance(m, nn.Embedding) and m.sparse]
+
+    def configure_sparse_optimizers(self, parameters) -> torch.optim.Optimizer:
+        """
+        Optimizers updating only rows of embeddings referenced in a batch.
+        (1) Adam: LazyAdam
+        (2) Adan: Adan updates rows of sparse gradients lazily
+        (3) Adagrad and SGD: torch.optim.Adagrad and torch.optim.SGD support sparse gradients but not weight decay on
+        them. Weight decay is applied only to parameters having dense gradients.
+        """
+        if self.optimizer_name == 'Adam':
+            self.selected_optimizer = LazyAdam(parameters, lr=self.learning_rate, weight_decay=self.weight_decay)
+        elif self.optimizer_name == 'Adan':
+            self.selected_optimizer = Adan(parameters, lr=self.learning_rate, weight_decay=self.weight_decay,
+                                           betas=(0.98, 0.92, 0.99),
+                                           eps=1e-08,
+                                           max_grad_norm=0.0,
+                                           no_prox=False)
+        elif self.optimizer_name in ['Adagrad', 'SGD']:
+            parameters = list(parameters)
+            sparse_parameters = {id(p) for p in self.sparse_parameters()}
+            groups = [{'params': [p for p in parameters if id(p) in sparse_parameters], 'weight_decay': 0.0},
+                      {'params': [p for p in parameters if id(p) not in sparse_parameters]}]
+            if self.optimizer_name == 'Adagrad':
+                self.selected_optimizer = torch.optim.Adagrad(groups, lr=self.learning_rate, eps=1e-10,
+                                                              weight_decay=self.weight_decay)
+            else:
+                self.selected_optimizer = torch.optim.SGD(groups, lr=self.learning_rate,
+                                                          weight_decay=self.weight_decay)
+        else:
+            raise KeyError(f'--optim (***{self.optimizer_name}***) does not support sparse gradients. '
+                           f'Use Adam, Adan, Adagrad or SGD.')
+        return self.selected_optimizer
+
     def configure_optimizers(self, parameters=None):
         if parameters is None:
             parameters = self.parameters()
 
+        if self.sparse_gradients:
+            return self.configure_sparse_optimizers(parameters)
+
         # default params in pytorch.
         if self.optimizer_name == 'SGD':
             self.selected_optimizer = torch.optim.SGD(params=parameters, lr=self.learning_rate,
@@ -189,9 +271,36 @@ class BaseKGE(pl.LightningModule):
             raise KeyError()
         return self.selected_optimizer
 
+    def has_default_loss(self) -> bool:
+        return type(self.loss) is torch.nn.BCEWithLogitsLoss and self.loss.reduction == 'mean' \
+            and self.loss.weight is None and self.loss.pos_weight is None
+
     def loss_function(self, yhat_batch, y_batch):
+        if isinstance(y_batch, SparseTargets):
+            # (1) Default loss on (label smoothed) targets is computed from positive indices.
+            if self.has_default_loss():
+                return binary_cross_entropy_with_sparse_targets(yhat_batch, y_batch)
+            # (2) Other losses receive dense targets constructed in one scatter.
+            y_batch = y_batch.to_dense(dtype=yhat_batch.dtype)
         return self.loss(input=yhat_batch, target=y_batch)
 
+    def batch_loss(self, x_batch, y_batch) -> torch.FloatTensor:
+        """
+        Loss of predictions on a batch.
+        If k_vs_all_block_size is given and k vs all scores are linear in entity embeddings (see k_vs_all_query),
+        the default loss is reduced over blocks of entities without computing (batch size, |E|) scores.
+
+        :param x_batch:
+        :param y_batch:
+        :return:
+        """
+        if self.k_vs_all_block_size and isinstance(y_batch, SparseTargets) and self.has_default_loss():
+            query = self.k_vs_all_query(x_batch)
+            if query is not None:
+                return blockwise_binary_cross_entropy_with_sparse_targets(query, self.entity_embeddings.weight,
+                                                                          y_batch, self.k_vs_all_block_size)
+        return self.loss_function(yhat_batch=self.forward(x_batch), y_batch=y_batch)
+
     def forward_triples(self, *args, **kwargs):
         raise ValueError(f'MODEL:{self.name} does not have forward_triples function')
 
@@ -201,6 +310,70 @@ class BaseKGE(pl.LightningModule):
     def forward_k_vs_sample(self, *args, **kwargs):
         raise ValueError(f'MODEL:{self.name} does not have forward_k_vs_sample function')
 
+    def k_vs_all_query(self, x: torch.LongTensor) -> Union[torch.FloatTensor, None]:
+        """
+        A query vector q per (head entity, relation) pair such that forward_k_vs_all(x) = q @ E^T,
+        where E denotes self.entity_embeddings.weight.
+
+        :param x: (n, 2) tensor
+        :return: (n, d) tensor or None if k vs all scores are not linear in entity embeddings
+        """
+        return None
+
+    def head_entity_query(self, x: torch.LongTensor) -> Union[torch.FloatTensor, None]:
+        """
+        A query vector q per (relation, tail entity) pair such that scores of triples with all head entities are
+        q @ H^T, where H denotes get_head_entity_representation().
+
+        :param x: (n, 2) tensor of relation and tail entity indexes
+        :return: (n, d) tensor or None if scores are not linear in head entity embeddings
+        """
+        return None
+
+    def k_vs_all_score_blocks(self, x: torch.LongTensor,
+                              block_size: int = None) -> Generator[Tuple[int, torch.FloatTensor], None, None]:
+        """
+        Stream k vs all scores over blocks of entities.
+
+        :param x: (n, 2) tensor
+        :param block_size: number of entities per block, all entities if None
+        :return: (start, scores) where scores is a (n, block_size) tensor of entities start, start + 1, ...
+        """
+        query = self.k_vs_all_query(x)
+        if query is None:
+            # Scores are computed at once and sliced.
+            scores = self.forward_k_vs_all(x)
+            block_size = block_size or scores.shape[1]
+            for start in range(0, scores.shape[1], block_size):
+                yield start, scores[:, start:start + block_size]
+        else:
+            entities = self.entity_embeddings.weight.float()
+            block_size = block_size or len(entities)
+            for start in range(0, len(entities), block_size):
+                yield start, torch.mm(query, entities[start:start + block_size].transpose(1, 0))
+
+    def forward_k_vs_all_topk(self, x: torch.LongTensor, k: int,
+                              block_size: int = None) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k k vs all scores and their entity indexes. Top k of each block is merged with the running top k,
+        hence peak memory is O(n * (block_size + k)) rather than O(n * |E|).
+
+        :param x: (n, 2) tensor
+        :param k:
+        :param block_size: number of entities per block, k_vs_all_block_size if None
+        :return: (n, k) scores in descending order and (n, k) entity indexes
+        """
+        top_scores, top_idx = None, None
+        for start, scores in self.k_vs_all_score_blocks(x, block_size or self.k_vs_all_block_size):
+            scores, idx = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+            idx += start
+            if top_scores is not None:
+                scores, idx = torch.cat((top_scores, scores), dim=1), torch.cat((top_idx, idx), dim=1)
+                scores, position = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+                idx = torch.gather(idx, 1, position)
+            top_scores, top_idx = scores, idx
+        return top_scores, top_idx
+
     def forward(self, x: Union[torch.LongTensor, Tuple[torch.LongTensor, torch.LongTensor]],
                 y_idx: torch.LongTensor = None):
         """
@@ -227,7 +400,7 @@ class BaseKGE(pl.LightningModule):
         # @TODO: why do we have this ?!
         if len(batch) == 2:
             x_batch, y_batch = batch
-            yhat_batch = self.forward(x_batch)
+            return self.batch_loss(x_batch, y_batch)
         elif len(batch) == 3:
             x_batch, y_idx_batch, y_batch, = batch
             yhat_batch = self.forward(x_batch, y_idx_batch)
@@ -281,20 +454,96 @@ class BaseKGE(pl.LightningModule):
     def train_dataloader(self) -> TRAIN_DATALOADERS:
         pass
 
+    def export_for_inference(self) -> 'BaseKGE':
+        """
+        A copy of the model for inference, where dropout and normalization of looked up embeddings are folded
+        into frozen embedding tables.
+        (1) Normalizers are applied in eval mode on all rows at once, i.e., LayerNorm normalizes each row and
+        BatchNorm1d applies its running statistics (and affine parameters if any).
+        (2) Normalized head entity, relation and tail entity embeddings are stored in head_entity_embeddings,
+        relation_embeddings and tail_entity_embeddings, respectively. entity_embeddings shares its storage with
+        self, since k vs all scores are computed with unnormalized entity embeddings.
+        (3) Input dropouts and normalizers are replaced with identity mappings.
+
+        :return: a model in eval mode whose parameters do not require gradients
+        """
+        assert self.head_entity_embeddings is None, f'{self.name} is already exported for inference'
+        for normalizer in [self.normalize_head_entity_embeddings, self.normalize_relation_embeddings,
+                           self.normalize_tail_entity_embeddings]:
+            if isinstance(normalizer, nn.modules.batchnorm._BatchNorm):
+                assert normalizer.track_running_stats, 'BatchNorm without running statistics cannot be folded'
+        # (1) Normalize all embeddings in eval mode. Normalized embeddings keep the dtype of embeddings, e.g. bfloat16.
+        training = self.training
+        self.eval()
+        entity_weight = self.entity_embeddings.weight.detach()
+        dtype = entity_weight.dtype
+        with torch.no_grad(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=dtype == torch.bfloat16):
+            head_entity_weight = self.normalize_head_entity_embeddings(entity_weight).to(dtype)
+            relation_weight = self.normalize_relation_embeddings(self.relation_embeddings.weight.detach()).to(dtype)
+            tail_entity_weight = self.normalize_tail_entity_embeddings(entity_weight).to(dtype)
+        self.train(training)
+        # (2) Copy the model except its embedding tables and its trainer.
+        memo = {id(self.entity_embeddings): None, id(self.relation_embeddings): None}
+        if self.trainer is not None:
+            memo[id(self.trainer)] = None
+        model = copy.deepcopy(self, memo=memo)
+        # Storage of entity embeddings is shared with self.
+        # Embeddings keep their class, e.g. LowPrecisionEmbedding.
+        embedding_class, relation_embedding_class = type(self.entity_embeddings), type(self.relation_embeddings)
+        model.entity_embeddings = embedding_class.from_pretrained(entity_weight, freeze=True)
+        model.relation_embeddings = relation_embedding_class.from_pretrained(relation_weight, freeze=True)
+        model.head_entity_embeddings = embedding_class.from_pretrained(head_entity_weight, freeze=True)
+        if tail_entity_weight.data_ptr() == entity_weight.data_ptr():
+            # Tail entities are not normalized.
+            model.tail_entity_embeddings = model.entity_embeddings
+        else:
+            model.tail_entity_embeddings = embedding_class.from_pretrained(tail_entity_weight, freeze=True)
+        # (3) Remove per call dropout and normalization.
+        model.input_dp_ent_real, model.input_dp_rel_real = nn.Identity(), nn.Identity()
+        model.normalize_head_entity_embeddings = nn.Identity()
+        model.normalize_relation_embeddings = nn.Identity()
+        model.normalize_tail_entity_embeddings = nn.Identity()
+        for parameter in model.parameters():
+            parameter.requires_grad = False
+        return model.eval()
+
+    def get_head_entity_representation(self) -> torch.FloatTensor:
+        """ Normalized embeddings of all entities as head entities in triples, i.e., (|E|, d) tensor """
+        if self.head_entity_embeddings is not None:
+            return self.head_entity_embeddings.weight.float()
+        return self.normalize_head_entity_embeddings(self.entity_embeddings.weight.float())
+
+    def get_tail_entity_representation(self) -> torch.FloatTensor:
+        """ Normalized embeddings of all entities as tail entities in triples, i.e., (|E|, d) tensor """
+        if self.tail_entity_embeddings is not None:
+            return self.tail_entity_embeddings.weight.float()
+        return self.normalize_tail_entity_embeddings(self.entity_embeddings.weight.float())
+
     def get_triple_representation(self, indexed_triple):
-        # (1) Split input into indexes.
-        idx_head_entity, idx_relation, idx_tail_entity = indexed_triple[:, 0], indexed_triple[:, 1], indexed_triple[:,
-                                                                                                     2]
-        # (2) Retrieve embeddings & Apply Dropout & Normalization
-        head_ent_emb = self.normalize_head_entity_embeddings(
-            self.input_dp_ent_real(self.entity_embeddings(idx_head_entity)))
-        rel_ent_emb = self.normalize_relation_embeddings(self.input_dp_rel_real(self.relation_embeddings(idx_relation)))
+        # (1) Retrieve embeddings of head entities and relations & Apply Dropout & Normalization.
+        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(indexed_triple)
+        # (2) Retrieve embeddings of tail entities & Apply Normalization.
+        idx_tail_entity = indexed_triple[:, 2]
+        if self.tail_entity_embeddings is not None:
+            return head_ent_emb, rel_ent_emb, self.tail_entity_embeddings(idx_tail_entity)
         tail_ent_emb = self.normalize_tail_entity_embeddings(self.entity_embeddings(idx_tail_entity))
         return head_ent_emb, rel_ent_emb, tail_ent_emb
 
+    def get_relation_tail_representation(self, x):
+        """ Normalized embeddings of relations and tail entities of (relation, tail entity) pairs """
+        idx_relation, idx_tail_entity = x[:, 0], x[:, 1]
+        if self.tail_entity_embeddings is not None:
+            return self.relation_embeddings(idx_relation), self.tail_entity_embeddings(idx_tail_entity)
+        rel_ent_emb = self.normalize_relation_embeddings(self.input_dp_rel_real(self.relation_embeddings(idx_relation)))
+        tail_ent_emb = self.normalize_tail_entity_embeddings(self.entity_embeddings(idx_tail_entity))
+        return rel_ent_emb, tail_ent_emb
+
     def get_head_relation_representation(self, indexed_triple):
         # (1) Split input into indexes.
         idx_head_entity, idx_relation = indexed_triple[:, 0], indexed_triple[:, 1]
+        if self.head_entity_embeddings is not None:
+            # Embeddings of an exported model are already normalized.
+            return self.head_entity_embeddings(idx_head_entity), self.relation_embeddings(idx_relation)
         # (2) Retrieve embeddings & Apply Dropout & Normalization
         head_ent_emb = self.normalize_head_entity_embeddings(
             self.input_dp_ent_real(self.entity_embeddings(idx_head_entity)))
@@ -55,7 +55,7 @@ class SumConEx(BaseKGE):
         C_3 = self.residual_convolution(C_1=(emb_head_real, emb_head_imag),
                                         C_2=(emb_rel_real, emb_rel_imag))
         a, b, c, d = C_3
-        emb_tail_real, emb_tail_imag = torch.hsplit(self.entity_embeddings.weight, 2)
+        emb_tail_real, emb_tail_imag = torch.hsplit(self.entity_embeddings.weight.float(), 2)
         emb_tail_real, emb_tail_imag = emb_tail_real.transpose(1, 0), emb_tail_imag.transpose(1, 0)
         # (4)
         real_real_real = torch.mm(a + emb_head_real * emb_rel_real, emb_tail_real)
@@ -124,7 +124,7 @@ class ConEx(BaseKGE):
         x = F.relu(self.norm_fc1(self.fc1(x)))
         return torch.chunk(x, 2, dim=1)
 
-    def forward_k_vs_all(self, x: torch.Tensor) -> torch.Tensor:
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
         # (2) Split (1) into real and imaginary parts.
@@ -135,14 +135,12 @@ class ConEx(BaseKGE):
         C_3 = self.residual_convolution(C_1=(emb_head_real, emb_head_imag),
                                         C_2=(emb_rel_real, emb_rel_imag))
         a, b = C_3
-        emb_tail_real, emb_tail_imag = torch.hsplit(self.entity_embeddings.weight, 2)
-        emb_tail_real, emb_tail_imag = emb_tail_real.transpose(1, 0), emb_tail_imag.transpose(1, 0)
-        # (4)
-        real_real_real = torch.mm(a + emb_head_real * emb_rel_real, emb_tail_real)
-        real_imag_imag = torch.mm(a + emb_head_real * emb_rel_imag, emb_tail_imag)
-        imag_real_imag = torch.mm(b + emb_head_imag * emb_rel_real, emb_tail_imag)
-        imag_imag_real = torch.mm(b + emb_head_imag * emb_rel_imag, emb_tail_real)
-        return real_real_real + real_imag_imag + imag_real_imag - imag_imag_real
+        # (3) Coefficients of real and imaginary parts of tail entities in the hermitian product.
+        return torch.cat(((a + emb_head_real * emb_rel_real) - (b + emb_head_imag * emb_rel_imag),
+                          (a + emb_head_real * emb_rel_imag) + (b + emb_head_imag * emb_rel_real)), dim=1)
+
+    def forward_k_vs_all(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
 
     def forward_triples(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
@@ -187,21 +185,29 @@ class ComplEx(BaseKGE):
         imag_imag_real = (emb_head_imag * emb_rel_imag * emb_tail_real).sum(dim=1)
         return real_real_real + real_imag_imag + imag_real_imag - imag_imag_real
 
-    def forward_k_vs_all(self, x: torch.Tensor):
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
         # (2) Split (1) into real and imaginary parts.
         emb_head_real, emb_head_imag = torch.hsplit(head_ent_emb, 2)
         emb_rel_real, emb_rel_imag = torch.hsplit(rel_ent_emb, 2)
-        # (3) Transpose Entity embedding matrix to perform matrix multiplications in Hermitian Product.
-        emb_tail_real, emb_tail_imag = torch.hsplit(self.entity_embeddings.weight, 2)
-        emb_tail_real, emb_tail_imag = emb_tail_real.transpose(1, 0), emb_tail_imag.transpose(1, 0)
-        # (4) Compute hermitian inner product on embedding vectors.
-        real_real_real = torch.mm(emb_head_real * emb_rel_real, emb_tail_real)
-        real_imag_imag = torch.mm(emb_head_real * emb_rel_imag, emb_tail_imag)
-        imag_real_imag = torch.mm(emb_head_imag * emb_rel_real, emb_tail_imag)
-        imag_imag_real = torch.mm(emb_head_imag * emb_rel_imag, emb_tail_real)
-        return real_real_real + real_imag_imag + imag_real_imag - imag_imag_real
+        # (3) Coefficients of real and imaginary parts of tail entities in the hermitian product.
+        return torch.cat((emb_head_real * emb_rel_real - emb_head_imag * emb_rel_imag,
+                          emb_head_real * emb_rel_imag + emb_head_imag * emb_rel_real), dim=1)
+
+    def forward_k_vs_all(self, x: torch.Tensor):
+        # Compute hermitian inner product with all entities in a single matrix multiplication.
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
+
+    def head_entity_query(self, x: torch.Tensor) -> torch.Tensor:
+        # (1) Retrieve embeddings & Apply Dropout & Normalization.
+        rel_ent_emb, tail_ent_emb = self.get_relation_tail_representation(x)
+        # (2) Split (1) into real and imaginary parts.
+        emb_rel_real, emb_rel_imag = torch.hsplit(rel_ent_emb, 2)
+        emb_tail_real, emb_tail_imag = torch.hsplit(tail_ent_emb, 2)
+        # (3) Coefficients of real and imaginary parts of head entities in the hermitian product.
+        return torch.cat((emb_rel_real * emb_tail_real + emb_rel_imag * emb_tail_imag,
+                          emb_rel_real * emb_tail_imag - emb_rel_imag * emb_tail_real), dim=1)
 
 
 class KDComplEx(BaseKGE):
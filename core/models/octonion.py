@@ -1,20 +1,7 @@
 import torch
 from .base_model import *
-
-
-def octonion_mul(*, O_1, O_2):
-    x0, x1, x2, x3, x4, x5, x6, x7 = O_1
-    y0, y1, y2, y3, y4, y5, y6, y7 = O_2
-    x = x0 * y0 - x1 * y1 - x2 * y2 - x3 * y3 - x4 * y4 - x5 * y5 - x6 * y6 - x7 * y7
-    e1 = x0 * y1 + x1 * y0 + x2 * y3 - x3 * y2 + x4 * y5 - x5 * y4 - x6 * y7 + x7 * y6
-    e2 = x0 * y2 - x1 * y3 + x2 * y0 + x3 * y1 + x4 * y6 + x5 * y7 - x6 * y4 - x7 * y5
-    e3 = x0 * y3 + x1 * y2 - x2 * y1 + x3 * y0 + x4 * y7 - x5 * y6 + x6 * y5 - x7 * y4
-    e4 = x0 * y4 - x1 * y5 - x2 * y6 - x3 * y7 + x4 * y0 + x5 * y1 + x6 * y2 + x7 * y3
-    e5 = x0 * y5 + x1 * y4 - x2 * y7 + x3 * y6 - x4 * y1 + x5 * y0 - x6 * y3 + x7 * y2
-    e6 = x0 * y6 + x1 * y7 + x2 * y4 - x3 * y5 - x4 * y2 + x5 * y3 + x6 * y0 - x7 * y1
-    e7 = x0 * y7 - x1 * y6 + x2 * y5 + x3 * y4 - x4 * y3 - x5 * y2 + x6 * y1 + x7 * y0
-
-    return x, e1, e2, e3, e4, e5, e6, e7
+from .static_funcs import octonion_mul, hypercomplex_mul, hypercomplex_mul_left_coefficients, \
+    OCTONION_STRUCTURE_CONSTANTS
 
 
 def octonion_mul_norm(*, O_1, O_2):
@@ -52,32 +39,15 @@ class OMult(BaseKGE):
     def forward_triples(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb, tail_ent_emb = self.get_triple_representation(x)
-        # (2) Split (1) into real and imaginary parts.
-        emb_head_e0, emb_head_e1, emb_head_e2, emb_head_e3, emb_head_e4, emb_head_e5, emb_head_e6, emb_head_e7 = torch.hsplit(
-            head_ent_emb, 8)
-        emb_rel_e0, emb_rel_e1, emb_rel_e2, emb_rel_e3, emb_rel_e4, emb_rel_e5, emb_rel_e6, emb_rel_e7 = torch.hsplit(
-            rel_ent_emb,
-            8)
-        emb_tail_e0, emb_tail_e1, emb_tail_e2, emb_tail_e3, emb_tail_e4, emb_tail_e5, emb_tail_e6, emb_tail_e7 = torch.hsplit(
-            tail_ent_emb, 8)
-        e0, e1, e2, e3, e4, e5, e6, e7 = octonion_mul(
-            O_1=(
-                emb_head_e0, emb_head_e1, emb_head_e2, emb_head_e3, emb_head_e4, emb_head_e5, emb_head_e6, emb_head_e7),
-            O_2=(emb_rel_e0, emb_rel_e1, emb_rel_e2, emb_rel_e3, emb_rel_e4, emb_rel_e5, emb_rel_e6, emb_rel_e7))
-        # (3)
-        # (3.1) Dropout on (2)-result of octonion multiplication.
-        # (3.2) Apply BN + DP on ALL entities.
-        # (3.3) Inner product
-        e0_score = (e0 * emb_tail_e0).sum(dim=1)
-        e1_score = (e1 * emb_tail_e1).sum(dim=1)
-        e2_score = (e2 * emb_tail_e2).sum(dim=1)
-        e3_score = (e3 * emb_tail_e3).sum(dim=1)
-        e4_score = (e4 * emb_tail_e4).sum(dim=1)
-        e5_score = (e5 * emb_tail_e5).sum(dim=1)
-        e6_score = (e6 * emb_tail_e6).sum(dim=1)
-        e7_score = (e7 * emb_tail_e7).sum(dim=1)
+        # (2) Apply octonion multiplication on (1.1) and (1.2).
+        # (3) Inner product of (2) with (1.3).
+        return (hypercomplex_mul(head_ent_emb, rel_ent_emb, OCTONION_STRUCTURE_CONSTANTS) * tail_ent_emb).sum(dim=1)
 
-        return e0_score + e1_score + e2_score + e3_score + e4_score + e5_score + e6_score + e7_score
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
+        # (1) Retrieve embeddings & Apply Dropout & Normalization.
+        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
+        # (2) Octonion multiplication of (1) with structure constants, i.e. e0,...,e7 parts are concatenated.
+        return hypercomplex_mul(head_ent_emb, rel_ent_emb, OCTONION_STRUCTURE_CONSTANTS)
 
     def forward_k_vs_all(self, x: torch.Tensor):
         """
@@ -85,47 +55,14 @@ class OMult(BaseKGE):
         [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
         Given a batch of head entities and relations => shape (size of batch,| Entities|)
         """
+        # Inner product of octonion multiplication of (h,r) with all entities in a single matrix multiplication.
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
 
+    def head_entity_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
-        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
-        # (2) Split (1) into real and imaginary parts.
-        # (2) Split (1) into real and imaginary parts.
-        emb_head_e0, emb_head_e1, emb_head_e2, emb_head_e3, emb_head_e4, emb_head_e5, emb_head_e6, emb_head_e7 = torch.hsplit(
-            head_ent_emb, 8)
-        emb_rel_e0, emb_rel_e1, emb_rel_e2, emb_rel_e3, emb_rel_e4, emb_rel_e5, emb_rel_e6, emb_rel_e7 = torch.hsplit(
-            rel_ent_emb,
-            8)
-
-        # (3)
-        # (3.1) Apply BN + Dropout on (1.2)-relations.
-        # (3.2) Apply quaternion multiplication on (1.1) and (3.1).
-        e0, e1, e2, e3, e4, e5, e6, e7 = octonion_mul(
-            O_1=(emb_head_e0, emb_head_e1, emb_head_e2, emb_head_e3, emb_head_e4,
-                 emb_head_e5, emb_head_e6, emb_head_e7),
-            O_2=(emb_rel_e0, emb_rel_e1, emb_rel_e2, emb_rel_e3, emb_rel_e4,
-                 emb_rel_e5, emb_rel_e6, emb_rel_e7))
-
-        emb_tail_e0, emb_tail_e1, emb_tail_e2, emb_tail_e3, emb_tail_e4, emb_tail_e5, emb_tail_e6, emb_tail_e7 = torch.hsplit(
-            self.entity_embeddings.weight, 8)
-        emb_tail_e0, emb_tail_e1, emb_tail_e2, emb_tail_e3, emb_tail_e4, emb_tail_e5, emb_tail_e6, emb_tail_e7 = emb_tail_e0.transpose(
-            1, 0), emb_tail_e1.transpose(1, 0), emb_tail_e2.transpose(1, 0), emb_tail_e3.transpose(1,
-                                                                                                   0), emb_tail_e4.transpose(
-            1, 0), emb_tail_e5.transpose(1, 0), emb_tail_e6.transpose(1, 0), emb_tail_e7.transpose(1, 0)
-
-        # (4)
-        # (4.1) Hadamard product of (2) with (3).
-        # (4.2) Dropout on (4.1).
-        # (4.3) Apply BN + DP on ALL entities.
-        # (4.4) Inner product
-        e0_score = torch.mm(e0, emb_tail_e0)
-        e1_score = torch.mm(e1, emb_tail_e1)
-        e2_score = torch.mm(e2, emb_tail_e2)
-        e3_score = torch.mm(e3, emb_tail_e3)
-        e4_score = torch.mm(e4, emb_tail_e4)
-        e5_score = torch.mm(e5, emb_tail_e5)
-        e6_score = torch.mm(e6, emb_tail_e6)
-        e7_score = torch.mm(e7, emb_tail_e7)
-        return e0_score + e1_score + e2_score + e3_score + e4_score + e5_score + e6_score + e7_score
+        rel_ent_emb, tail_ent_emb = self.get_relation_tail_representation(x)
+        # (2) <h * r, t> = <h, q> where q is linear in r and t.
+        return hypercomplex_mul_left_coefficients(rel_ent_emb, tail_ent_emb, OCTONION_STRUCTURE_CONSTANTS)
 
 
 class ConvO(BaseKGE):
@@ -211,13 +148,7 @@ class ConvO(BaseKGE):
         e7_score = (conv_e7 * e7 * emb_tail_e7).sum(dim=1)
         return e0_score + e1_score + e2_score + e3_score + e4_score + e5_score + e6_score + e7_score
 
-    def forward_k_vs_all(self, x: torch.Tensor):
-        """
-        Given a head entity and a relation (h,r), we compute scores for all entities.
-        [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
-        Given a batch of head entities and relations => shape (size of batch,| Entities|)
-        """
-
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
         # (2) Split (1) into real and imaginary parts.
@@ -243,28 +174,17 @@ class ConvO(BaseKGE):
                  emb_head_e5, emb_head_e6, emb_head_e7),
             O_2=(emb_rel_e0, emb_rel_e1, emb_rel_e2, emb_rel_e3, emb_rel_e4,
                  emb_rel_e5, emb_rel_e6, emb_rel_e7))
+        # (4) Hadamard product of (2) with (3).
+        return torch.cat((conv_e0 * e0, conv_e1 * e1, conv_e2 * e2, conv_e3 * e3,
+                          conv_e4 * e4, conv_e5 * e5, conv_e6 * e6, conv_e7 * e7), dim=1)
 
-        emb_tail_e0, emb_tail_e1, emb_tail_e2, emb_tail_e3, emb_tail_e4, emb_tail_e5, emb_tail_e6, emb_tail_e7 = torch.hsplit(
-            self.entity_embeddings.weight, 8)
-        emb_tail_e0, emb_tail_e1, emb_tail_e2, emb_tail_e3, emb_tail_e4, emb_tail_e5, emb_tail_e6, emb_tail_e7 = emb_tail_e0.transpose(
-            1, 0), emb_tail_e1.transpose(1, 0), emb_tail_e2.transpose(1, 0), emb_tail_e3.transpose(1,
-                                                                                                   0), emb_tail_e4.transpose(
-            1, 0), emb_tail_e5.transpose(1, 0), emb_tail_e6.transpose(1, 0), emb_tail_e7.transpose(1, 0)
-
-        # (4)
-        # (4.1) Hadamard product of (2) with (3).
-        # (4.2) Dropout on (4.1).
-        # (4.3) Apply BN + DP on ALL entities.
-        # (4.4) Inner product
-        e0_score = torch.mm(conv_e0 * e0, emb_tail_e0)
-        e1_score = torch.mm(conv_e1 * e1, emb_tail_e1)
-        e2_score = torch.mm(conv_e2 * e2, emb_tail_e2)
-        e3_score = torch.mm(conv_e3 * e3, emb_tail_e3)
-        e4_score = torch.mm(conv_e4 * e4, emb_tail_e4)
-        e5_score = torch.mm(conv_e5 * e5, emb_tail_e5)
-        e6_score = torch.mm(conv_e6 * e6, emb_tail_e6)
-        e7_score = torch.mm(conv_e7 * e7, emb_tail_e7)
-        return e0_score + e1_score + e2_score + e3_score + e4_score + e5_score + e6_score + e7_score
+    def forward_k_vs_all(self, x: torch.Tensor):
+        """
+        Given a head entity and a relation (h,r), we compute scores for all entities.
+        [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
+        Given a batch of head entities and relations => shape (size of batch,| Entities|)
+        """
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
 
     def old_forward_k_vs_all(self, x: torch.Tensor):
         raise NotImplementedError()
@@ -1,5 +1,6 @@
 from .base_model import *
-from .static_funcs import quaternion_mul
+from .static_funcs import quaternion_mul, hypercomplex_mul, hypercomplex_mul_left_coefficients, \
+    QUATERNION_STRUCTURE_CONSTANTS
 
 
 def quaternion_mul_with_unit_norm(*, Q_1, Q_2):
@@ -28,25 +29,15 @@ class QMult(BaseKGE):
     def forward_triples(self, indexed_triple: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb, tail_ent_emb = self.get_triple_representation(indexed_triple)
-        # (2) Split (1) into real and imaginary parts.
-        emb_head_real, emb_head_i, emb_head_j, emb_head_k = torch.hsplit(head_ent_emb, 4)
-        emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k = torch.hsplit(rel_ent_emb, 4)
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = torch.hsplit(tail_ent_emb, 4)
+        # (2) Apply quaternion multiplication on (1.1) and (1.2).
+        # (3) Inner product of (2) with (1.3).
+        return (hypercomplex_mul(head_ent_emb, rel_ent_emb, QUATERNION_STRUCTURE_CONSTANTS) * tail_ent_emb).sum(dim=1)
 
-        # (2)
-        # (2.1) Apply BN + Dropout on (1.2)-relations.
-        # (2.2) Apply quaternion multiplication on (1.1) and (2.1).
-        r_val, i_val, j_val, k_val = quaternion_mul(Q_1=(emb_head_real, emb_head_i, emb_head_j, emb_head_k),
-                                                    Q_2=(emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k))
-
-        # (3)
-        # (3.1) Dropout on (2)-result of quaternion multiplication.
-        # (3.2) Inner product
-        real_score = torch.sum(r_val * emb_tail_real, dim=1)
-        i_score = torch.sum(i_val * emb_tail_i, dim=1)
-        j_score = torch.sum(j_val * emb_tail_j, dim=1)
-        k_score = torch.sum(k_val * emb_tail_k, dim=1)
-        return real_score + i_score + j_score + k_score
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
+        # (1) Retrieve embeddings & Apply Dropout & Normalization.
+        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
+        # (2) Quaternion multiplication of (1) with structure constants, i.e. real, i, j and k parts are concatenated.
+        return hypercomplex_mul(head_ent_emb, rel_ent_emb, QUATERNION_STRUCTURE_CONSTANTS)
 
     def forward_k_vs_all(self, x):
         """
@@ -55,29 +46,14 @@ class QMult(BaseKGE):
         [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
         Given a batch of head entities and relations => shape (size of batch,| Entities|)
         """
+        # Inner product of quaternion multiplication of (h,r) with all entities in a single matrix multiplication.
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
 
+    def head_entity_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
-        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
-        # (2) Split (1) into real and imaginary parts.
-        emb_head_real, emb_head_i, emb_head_j, emb_head_k = torch.hsplit(head_ent_emb, 4)
-        emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k = torch.hsplit(rel_ent_emb, 4)
-        r_val, i_val, j_val, k_val = quaternion_mul(Q_1=(emb_head_real, emb_head_i, emb_head_j, emb_head_k),
-                                                    Q_2=(emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k))
-
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = torch.hsplit(self.entity_embeddings.weight, 4)
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = emb_tail_real.transpose(1, 0), emb_tail_i.transpose(1,
-                                                                                                                0), emb_tail_j.transpose(
-            1, 0), emb_tail_k.transpose(1, 0)
-
-        # (3)
-        # (3.1) Dropout on (2)-result of quaternion multiplication.
-        # (3.2) Inner product
-        real_score = torch.mm(r_val, emb_tail_real)
-        i_score = torch.mm(i_val, emb_tail_i)
-        j_score = torch.mm(j_val, emb_tail_j)
-        k_score = torch.mm(k_val, emb_tail_k)
-
-        return real_score + i_score + j_score + k_score
+        rel_ent_emb, tail_ent_emb = self.get_relation_tail_representation(x)
+        # (2) <h * r, t> = <h, q> where q is linear in r and t.
+        return hypercomplex_mul_left_coefficients(rel_ent_emb, tail_ent_emb, QUATERNION_STRUCTURE_CONSTANTS)
 
     def forward_k_vs_sample(self, x, target_entity_idx):
         """
@@ -86,38 +62,13 @@ class QMult(BaseKGE):
         [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
         Given a batch of head entities and relations => shape (size of batch,| Entities|)
         """
-
-        # (1) Retrieve embeddings & Apply Dropout & Normalization.
-        head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
-        # (2) Split (1) into real and imaginary parts.
-        emb_head_real, emb_head_i, emb_head_j, emb_head_k = torch.hsplit(head_ent_emb, 4)
-        emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k = torch.hsplit(rel_ent_emb, 4)
-        r_val, i_val, j_val, k_val = quaternion_mul(Q_1=(emb_head_real, emb_head_i, emb_head_j, emb_head_k),
-                                                    Q_2=(emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k))
-
-        # (batch size, num. selected entity, dimension)
+        # (1) Quaternion multiplication of (h,r): (batch size, 1, dimension)
+        query = self.k_vs_all_query(x).unsqueeze(1)
+        # (2) (batch size, num. selected entity, dimension)
         # tail_entity_emb = self.normalize_tail_entity_embeddings(self.entity_embeddings(target_entity_idx))
         tail_entity_emb = self.entity_embeddings(target_entity_idx)
-        # quaternion vectors
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = torch.tensor_split(tail_entity_emb, 4, dim=2)
-
-        emb_tail_real = emb_tail_real.transpose(1, 2)
-        emb_tail_i = emb_tail_i.transpose(1, 2)
-        emb_tail_j = emb_tail_j.transpose(1, 2)
-        emb_tail_k = emb_tail_k.transpose(1, 2)
-
-        # (batch size, 1, dimension)
-        r_val = r_val.unsqueeze(1)
-        i_val = i_val.unsqueeze(1)
-        j_val = j_val.unsqueeze(1)
-        k_val = k_val.unsqueeze(1)
-
-        real_score = torch.bmm(r_val, emb_tail_real)
-        i_score = torch.bmm(i_val, emb_tail_i)
-        j_score = torch.bmm(j_val, emb_tail_j)
-        k_score = torch.bmm(k_val, emb_tail_k)
-
-        return (real_score + i_score + j_score + k_score).squeeze(1)
+        # (3) Inner products of (1) and (2)
+        return torch.bmm(query, tail_entity_emb.transpose(1, 2)).squeeze(1)
 
 
 class oldQMult(BaseKGE):
@@ -426,13 +377,7 @@ class ConvQ(BaseKGE):
         k_score = torch.sum(conv_imag_k * k_val * emb_tail_k, dim=1)
         return real_score + i_score + j_score + k_score
 
-    def forward_k_vs_all(self, x: torch.Tensor):
-        """
-        Given a head entity and a relation (h,r), we compute scores for all entities.
-        [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
-        Given a batch of head entities and relations => shape (size of batch,| Entities|)
-        """
-
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
         head_ent_emb, rel_ent_emb = self.get_head_relation_representation(x)
         # (2) Split (1) into real and imaginary parts.
@@ -446,21 +391,16 @@ class ConvQ(BaseKGE):
 
         r_val, i_val, j_val, k_val = quaternion_mul(Q_1=(emb_head_real, emb_head_i, emb_head_j, emb_head_k),
                                                     Q_2=(emb_rel_real, emb_rel_i, emb_rel_j, emb_rel_k))
+        # (3) Hadamard product of (2) and quaternion multiplication.
+        return torch.cat((conv_real * r_val, conv_imag_i * i_val, conv_imag_j * j_val, conv_imag_k * k_val), dim=1)
 
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = torch.hsplit(self.entity_embeddings.weight, 4)
-        emb_tail_real, emb_tail_i, emb_tail_j, emb_tail_k = emb_tail_real.transpose(1, 0), emb_tail_i.transpose(1,
-                                                                                                                0), emb_tail_j.transpose(
-            1, 0), emb_tail_k.transpose(1, 0)
-
-        # (3)
-        # (3.1) Dropout on (2)-result of quaternion multiplication.
-        # (3.2) Inner product
-        real_score = torch.mm(conv_real * r_val, emb_tail_real)
-        i_score = torch.mm(conv_imag_i * i_val, emb_tail_i)
-        j_score = torch.mm(conv_imag_j * j_val, emb_tail_j)
-        k_score = torch.mm(conv_imag_k * k_val, emb_tail_k)
-
-        return real_score + i_score + j_score + k_score
+    def forward_k_vs_all(self, x: torch.Tensor):
+        """
+        Given a head entity and a relation (h,r), we compute scores for all entities.
+        [score(h,r,x)|x \in Entities] => [0.0,0.1,...,0.8], shape=> (1, |Entities|)
+        Given a batch of head entities and relations => shape (size of batch,| Entities|)
+        """
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
 
 
 # TODO: Remove these classes
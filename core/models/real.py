@@ -14,7 +14,7 @@ class DistMult(BaseKGE):
         super().__init__(args)
         self.name = 'DistMult'
         # Adding this reduces performance in training and generalization
-        self.hidden_normalizer = lambda x: x
+        self.hidden_normalizer = nn.Identity()
 
     def forward_triples(self, x: torch.Tensor) -> torch.Tensor:
         # (1) Retrieve embeddings & Apply Dropout & Normalization.
@@ -22,10 +22,16 @@ class DistMult(BaseKGE):
         # (2) Compute the score
         return (self.hidden_dropout(self.hidden_normalizer(head_ent_emb * rel_ent_emb)) * tail_ent_emb).sum(dim=1)
 
-    def forward_k_vs_all(self, x: torch.Tensor):
+    def k_vs_all_query(self, x: torch.Tensor) -> torch.Tensor:
         emb_head_real, emb_rel_real = self.get_head_relation_representation(x)
-        return torch.mm(self.hidden_dropout(self.hidden_normalizer(emb_head_real * emb_rel_real)),
-                        self.entity_embeddings.weight.transpose(1, 0))
+        return self.hidden_dropout(self.hidden_normalizer(emb_head_real * emb_rel_real))
+
+    def forward_k_vs_all(self, x: torch.Tensor):
+        return torch.mm(self.k_vs_all_query(x), self.entity_embeddings.weight.float().transpose(1, 0))
+
+    def head_entity_query(self, x: torch.Tensor) -> torch.Tensor:
+        rel_ent_emb, tail_ent_emb = self.get_relation_tail_representation(x)
+        return rel_ent_emb * tail_ent_emb
 
 
 class TransE(BaseKGE):
@@ -38,7 +44,7 @@ class TransE(BaseKGE):
         super().__init__(args)
         self.name = 'TransE'
         # Adding this reduces performance in training and generalization
-        self.hidden_normalizer = lambda x: x
+        self.hidden_normalizer = nn.Identity()
         self.loss = torch.nn.BCELoss()
         self._norm = 2
         self.margin = 5
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Tuple, Callable
 import torch
 
 def quaternion_mul(*, Q_1, Q_2) -> Tuple[torch.Tensor,torch.Tensor,torch.Tensor,torch.Tensor]:
@@ -16,3 +16,98 @@ def quaternion_mul(*, Q_1, Q_2) -> Tuple[torch.Tensor,torch.Tensor,torch.Tensor,
     j_val = a_h * c_r - b_h * d_r + c_h * a_r + d_h * b_r
     k_val = a_h * d_r + b_h * c_r - c_h * b_r + d_h * a_r
     return r_val, i_val, j_val, k_val
+
+
+def octonion_mul(*, O_1, O_2):
+    x0, x1, x2, x3, x4, x5, x6, x7 = O_1
+    y0, y1, y2, y3, y4, y5, y6, y7 = O_2
+    x = x0 * y0 - x1 * y1 - x2 * y2 - x3 * y3 - x4 * y4 - x5 * y5 - x6 * y6 - x7 * y7
+    e1 = x0 * y1 + x1 * y0 + x2 * y3 - x3 * y2 + x4 * y5 - x5 * y4 - x6 * y7 + x7 * y6
+    e2 = x0 * y2 - x1 * y3 + x2 * y0 + x3 * y1 + x4 * y6 + x5 * y7 - x6 * y4 - x7 * y5
+    e3 = x0 * y3 + x1 * y2 - x2 * y1 + x3 * y0 + x4 * y7 - x5 * y6 + x6 * y5 - x7 * y4
+    e4 = x0 * y4 - x1 * y5 - x2 * y6 - x3 * y7 + x4 * y0 + x5 * y1 + x6 * y2 + x7 * y3
+    e5 = x0 * y5 + x1 * y4 - x2 * y7 + x3 * y6 - x4 * y1 + x5 * y0 - x6 * y3 + x7 * y2
+    e6 = x0 * y6 + x1 * y7 + x2 * y4 - x3 * y5 - x4 * y2 + x5 * y3 + x6 * y0 - x7 * y1
+    e7 = x0 * y7 - x1 * y6 + x2 * y5 + x3 * y4 - x4 * y3 - x5 * y2 + x6 * y1 + x7 * y0
+
+    return x, e1, e2, e3, e4, e5, e6, e7
+
+
+def structure_constants(mul: Callable, dim: int) -> torch.Tensor:
+    """
+    Structure constants C of a bilinear multiplication of hypercomplex numbers, i.e.,
+    (x * y)_k = \\sum_i \\sum_j C[i, j, k] x_i y_j. Derived by multiplying basis elements with each other.
+
+    :param mul: a function of two tuples of dim components, e.g. quaternion_mul
+    :param dim: 4 for quaternions, 8 for octonions
+    :return: (dim, dim, dim) tensor
+    """
+    basis = torch.eye(dim)
+    constants = torch.zeros(dim, dim, dim)
+    for i in range(dim):
+        for j in range(dim):
+            constants[i, j] = torch.cat(mul(tuple(basis[i].view(dim, 1)), tuple(basis[j].view(dim, 1))))
+    return constants
+
+
+QUATERNION_STRUCTURE_CONSTANTS = structure_constants(lambda x, y: quaternion_mul(Q_1=x, Q_2=y), 4)
+OCTONION_STRUCTURE_CONSTANTS = structure_constants(lambda x, y: octonion_mul(O_1=x, O_2=y), 8)
+
+
+def _bilinear_mix(u: torch.Tensor, v: torch.Tensor, constants: torch.Tensor) -> torch.Tensor:
+    """ (n, p, m) and (n, q, m) => (n, r, m) via a (r, p*q) matrix times outer products of components """
+    n, p, m = u.shape
+    return torch.matmul(constants, (u.unsqueeze(2) * v.unsqueeze(1)).view(n, p * v.shape[1], m))
+
+
+class HypercomplexMul(torch.autograd.Function):
+    """ Multiplication of hypercomplex numbers as one outer product of components and one matrix multiplication
+    with structure constants instead of dim^2 elementwise multiplications. Gradients are computed in the same way,
+    e.g., d(x * y)_k / dx_i = \\sum_j C[i, j, k] y_j """
+
+    @staticmethod
+    def forward(ctx, x, y, constants):
+        dim = len(constants)
+        x, y = x.view(len(x), dim, -1), y.view(len(y), dim, -1)
+        ctx.save_for_backward(x, y, constants)
+        return _bilinear_mix(x, y, constants.reshape(dim * dim, dim).transpose(1, 0)).flatten(1)
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        x, y, constants = ctx.saved_tensors
+        dim = len(constants)
+        grad_output = grad_output.reshape(len(grad_output), dim, -1)
+        grad_x = _bilinear_mix(y, grad_output, constants.reshape(dim, dim * dim)).flatten(1)
+        grad_y = _bilinear_mix(x, grad_output, constants.transpose(0, 1).reshape(dim, dim * dim)).flatten(1)
+        return grad_x, grad_y, None
+
+
+def hypercomplex_mul(x: torch.Tensor, y: torch.Tensor, constants: torch.Tensor) -> torch.Tensor:
+    """
+    Multiply batches of hypercomplex numbers.
+
+    :param x: (n, dim * m) tensor, the i-th component is the i-th block of torch.hsplit(x, dim)
+    :param y: (n, dim * m) tensor
+    :param constants: (dim, dim, dim) structure constants, e.g. QUATERNION_STRUCTURE_CONSTANTS
+    :return: (n, dim * m) tensor having the same layout
+    """
+    assert x.shape == y.shape
+    if constants.dtype != x.dtype or constants.device != x.device:
+        constants = constants.to(x)
+    return HypercomplexMul.apply(x.contiguous(), y.contiguous(), constants)
+
+
+def hypercomplex_mul_left_coefficients(y: torch.Tensor, z: torch.Tensor, constants: torch.Tensor) -> torch.Tensor:
+    """
+    Coefficients q such that <x * y, z> = <x, q> for all x, i.e., q_i = \\sum_j \\sum_k C[i, j, k] y_j z_k.
+
+    :param y: (n, dim * m) tensor
+    :param z: (n, dim * m) tensor
+    :param constants: (dim, dim, dim) structure constants, e.g. QUATERNION_STRUCTURE_CONSTANTS
+    :return: (n, dim * m) tensor
+    """
+    assert y.shape == z.shape
+    dim = len(constants)
+    constants = constants.to(y)
+    return _bilinear_mix(y.reshape(len(y), dim, -1), z.reshape(len(z), dim, -1),
+                         constants.reshape(dim, dim * dim)).flatten(1)
@@ -0,0 +1,146 @@
+import torch
+from torch import nn
+from typing import Tuple
+from .models.base_model import BaseKGE
+
+
+class QuantizedEmbedding(nn.Module):
+    """ Post-training per row int8 quantization of an embedding table
+
+    The j-th entry of the i-th row is approximated by (codes[i, j] - zero_point[i]) * scale[i], where the range of
+    the i-th row (extended to include zero) is mapped onto [-128, 127] as in torch.quantize_per_channel, i.e.,
+    zero_point[i] is in [-128, 127].
+    Looked up rows are dequantized into float32, so that models score triples as with nn.Embedding.
+    Scores of queries against all rows are computed over blocks of rows without dequantizing the table, i.e.,
+    q (c - z) s = s (q c - z sum(q)).
+    """
+
+    def __init__(self, codes: torch.Tensor, scale: torch.FloatTensor, zero_point: torch.Tensor):
+        super().__init__()
+        assert codes.dtype == zero_point.dtype == torch.int8 and codes.dim() == 2
+        assert scale.shape == zero_point.shape == (len(codes),)
+        self.register_buffer('codes', codes)
+        self.register_buffer('scale', scale)
+        self.register_buffer('zero_point', zero_point)
+        self.num_embeddings, self.embedding_dim = codes.shape
+
+    @classmethod
+    def from_float(cls, weight: torch.FloatTensor, block_size: int = 2 ** 16) -> 'QuantizedEmbedding':
+        """
+        Quantize rows of a float embedding matrix over blocks of rows
+        :param weight: (|E|, d) tensor
+        :param block_size: number of rows quantized at once
+        :return:
+        """
+        num_embeddings, embedding_dim = weight.shape
+        codes = torch.empty(num_embeddings, embedding_dim, dtype=torch.int8)
+        scale, zero_point = torch.empty(num_embeddings), torch.empty(num_embeddings, dtype=torch.int8)
+        for start in range(0, num_embeddings, block_size):
+            rows = slice(start, start + block_size)
+            block = weight[rows].detach().float()
+            low = torch.clamp(block.min(dim=1).values, max=0)
+            high = torch.clamp(block.max(dim=1).values, min=0)
+            block_scale = (high - low) / 255
+            # Rows of zeros.
+            block_scale[block_scale == 0] = 1.
+            block_zero_point = -128 - torch.round(low / block_scale)
+            codes[rows] = torch.clamp(torch.round(block / block_scale.unsqueeze(1)) + block_zero_point.unsqueeze(1),
+                                      -128, 127)
+            scale[rows], zero_point[rows] = block_scale, block_zero_point
+        return cls(codes, scale, zero_point)
+
+    def forward(self, x: torch.LongTensor) -> torch.FloatTensor:
+        return (self.codes[x].float() - self.zero_point[x].unsqueeze(-1).float()) * self.scale[x].unsqueeze(-1)
+
+    def __len__(self) -> int:
+        return self.num_embeddings
+
+    def __getitem__(self, x: torch.LongTensor) -> torch.FloatTensor:
+        # Dequantized rows, e.g., to rescore candidates of an approximate nearest neighbour index.
+        return self(x)
+
+    @property
+    def dtype(self) -> torch.dtype:
+        """ dtype of dequantized rows """
+        return torch.float32
+
+    @property
+    def weight(self) -> torch.FloatTensor:
+        """ Dequantized (|E|, d) table, e.g. for k vs all scores of models. Use topk to not materialize it """
+        return self.dequantize()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.nelement() * t.element_size() for t in [self.codes, self.scale, self.zero_point])
+
+    def dequantize(self, start: int = 0, end: int = None) -> torch.FloatTensor:
+        """ Dequantized rows from start to end """
+        return self(torch.arange(start, min(end or self.num_embeddings, self.num_embeddings)))
+
+    def scores(self, queries: torch.FloatTensor, start: int = 0, end: int = None) -> torch.FloatTensor:
+        """
+        Inner products of queries with dequantized rows from start to end
+        :param queries: (N, d) tensor
+        :param start:
+        :param end:
+        :return: (N, end - start) scores
+        """
+        rows = slice(start, min(end or self.num_embeddings, self.num_embeddings))
+        scores = torch.mm(queries, self.codes[rows].float().transpose(1, 0))
+        scores -= queries.sum(dim=1, keepdim=True) * self.zero_point[rows].float()
+        return scores.mul_(self.scale[rows])
+
+    def topk(self, queries: torch.FloatTensor, k: int,
+             block_size: int = 2 ** 16) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Top k rows having the highest inner products with queries, scored over blocks of block_size rows
+        :param queries: (N, d) tensor
+        :param k:
+        :param block_size:
+        :return: (N, k) scores in descending order and (N, k) row indexes
+        """
+        k = min(k, self.num_embeddings)
+        top_scores = torch.empty(len(queries), 0)
+        top_idx = torch.empty(len(queries), 0, dtype=torch.long)
+        for start in range(0, self.num_embeddings, block_size):
+            scores, idx = torch.topk(self.scores(queries, start, start + block_size),
+                                     min(k, self.num_embeddings - start), dim=1)
+            # Merge top k of the block with top k of previous blocks.
+            top_scores, best = torch.topk(torch.cat((top_scores, scores), dim=1), k, dim=1)
+            top_idx = torch.cat((top_idx, idx + start), dim=1).gather(1, best)
+        return top_scores, top_idx
+
+
+def entity_embeddings_nbytes(model: BaseKGE) -> int:
+    """ Memory of entity embedding tables of a model, tables sharing their storage are counted once """
+    tables = dict()
+    for table in [model.entity_embeddings, model.head_entity_embeddings, model.tail_entity_embeddings]:
+        if isinstance(table, QuantizedEmbedding):
+            tables[id(table)] = table.nbytes
+        elif table is not None:
+            tables[table.weight.data_ptr()] = table.weight.nelement() * table.weight.element_size()
+    return sum(tables.values())
+
+
+def quantize_entity_embeddings(model: BaseKGE) -> BaseKGE:
+    """
+    A model for inference whose entity embeddings are quantized into int8
+
+    (1) Normalization of entity embeddings is folded into head and tail entity embeddings, see export_for_inference.
+    (2) Entity, head entity and tail entity embeddings are replaced with QuantizedEmbedding. Tables sharing their
+    storage are quantized once. Relation embeddings and other parameters are not quantized.
+    """
+    # (1) Fold normalization.
+    if model.head_entity_embeddings is None:
+        model = model.export_for_inference()
+    # (2) Quantize.
+    quantized = dict()
+    for name in ['entity_embeddings', 'head_entity_embeddings', 'tail_entity_embeddings']:
+        table = getattr(model, name)
+        if isinstance(table, QuantizedEmbedding):
+            continue
+        key = table.weight.data_ptr()
+        if key not in quantized:
+            quantized[key] = QuantizedEmbedding.from_float(table.weight)
+        setattr(model, name, quantized[key])
+    return model.eval()
@@ -53,6 +53,8 @@ def config_kge_sanity_checking(args, dataset):
 
     if args.scoring_technique == 'KvsAll':
         args.neg_ratio = None
+    if getattr(args, 'bf16_embeddings', False) and args.precision != 'bf16':
+        raise ValueError(f'bf16_embeddings requires --precision bf16. Currently:{args.precision}')
     return args, dataset
 
 
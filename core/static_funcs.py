@@ -11,15 +11,23 @@ import pytorch_lightning as pl
 import sys
 from .helper_classes import CustomArg
 from .models import *
-from .trainers import DataParallelTrainer, DistributedDataParallelTrainer
+from .trainers import DataParallelTrainer, DistributedDataParallelTrainer, HogwildTrainer, \
+    PartitionedTrainer
 import time
 import pandas as pd
 import json
 import glob
 import pandas
+import multiprocessing
 from .sanity_checkers import sanity_checking_with_arguments
+from .filter_index import FilterIndex
+from .ann_index import IVFPQIndex
+from .vocabulary import Vocabulary
 from pytorch_lightning.strategies import DDPStrategy
 
+# Triples and vocabularies used by worker processes of index_triples().
+_INDEX_TRIPLES_DATA = None
+
 
 # @TODO: Could these funcs can be merged?
 def select_model(args: dict, is_continual_training: bool = None, storage_path: str = None):
@@ -43,7 +51,7 @@ def select_model(args: dict, is_continual_training: bool = None, storage_path: s
         return intialize_model(args)
 
 
-def load_model(path_of_experiment_folder, model_name='model.pt') -> Tuple[BaseKGE, pd.DataFrame, pd.DataFrame]:
+def load_model(path_of_experiment_folder, model_name='model.pt') -> Tuple[BaseKGE, Vocabulary, Vocabulary]:
     """ Load weights and initialize pytorch module from namespace arguments"""
     print(f'Loading model {model_name}...', end=' ')
     start_time = time.time()
@@ -66,13 +74,12 @@ def load_model(path_of_experiment_folder, model_name='model.pt') -> Tuple[BaseKG
     model.eval()
     start_time = time.time()
     print('Loading entity and relation indexes...', end=' ')
-    entity_to_idx = pd.read_parquet(path_of_experiment_folder + '/entity_to_idx.gzip')
-    relation_to_idx = pd.read_parquet(path_of_experiment_folder + '/relation_to_idx.gzip')
+    entity_vocabulary, relation_vocabulary = load_vocabularies(path_of_experiment_folder)
     print(f'Done! It took {time.time() - start_time:.4f}')
-    return model, entity_to_idx, relation_to_idx
+    return model, entity_vocabulary, relation_vocabulary
 
 
-def load_model_ensemble(path_of_experiment_folder: str) -> Tuple[BaseKGE, pd.DataFrame, pd.DataFrame]:
+def load_model_ensemble(path_of_experiment_folder: str) -> Tuple[BaseKGE, Vocabulary, Vocabulary]:
     """ Construct Ensemble Of weights and initialize pytorch module from namespace arguments
 
     (1) Detect models under given path
@@ -122,10 +129,9 @@ def load_model_ensemble(path_of_experiment_folder: str) -> Tuple[BaseKGE, pd.Dat
     model.eval()
     start_time = time.time()
     print('Loading entity and relation indexes...', end=' ')
-    entity_to_idx = pd.read_parquet(path_of_experiment_folder + '/entity_to_idx.gzip')
-    relation_to_idx = pd.read_parquet(path_of_experiment_folder + '/relation_to_idx.gzip')
+    entity_vocabulary, relation_vocabulary = load_vocabularies(path_of_experiment_folder)
     print(f'Done! It took {time.time() - start_time:.4f} seconds')
-    return model, entity_to_idx, relation_to_idx
+    return model, entity_vocabulary, relation_vocabulary
 
 
 def numpy_data_type_changer(train_set: np.ndarray, num: int) -> np.ndarray:
@@ -167,6 +173,12 @@ def initialize_trainer(args, callbacks: List, plugins: List) -> pl.Trainer:
         return DataParallelTrainer(args, callbacks=callbacks)
     elif args.torch_trainer == 'DistributedDataParallelTrainer':
         return DistributedDataParallelTrainer(args, callbacks=callbacks)
+    elif args.torch_trainer == 'HogwildTrainer':
+        print('Initialize HogwildTrainer Trainer')
+        return HogwildTrainer(args, callbacks=callbacks)
+    elif args.torch_trainer == 'PartitionedTrainer':
+        print('Initialize PartitionedTrainer Trainer')
+        return PartitionedTrainer(args, callbacks=callbacks)
     else:
         print('Initialize Pytorch-lightning Trainer')
         # Pytest with PL problem https://github.com/pytest-dev/pytest/discussions/7995
@@ -309,11 +321,11 @@ def store(trained_model, model_name: str = 'model', full_storage_path: str = Non
     if save_as_csv:
         # (2.1) Get embeddings.
         entity_emb, relation_ebm = trained_model.get_embeddings()
-        save_embeddings(entity_emb.numpy(), indexes=dataset.entities_str,
+        save_embeddings(entity_emb.float().numpy(), indexes=dataset.entities_str,
                         path=full_storage_path + '/' + trained_model.name + '_entity_embeddings.csv')
         del entity_emb
         if relation_ebm is not None:
-            save_embeddings(relation_ebm.numpy(), indexes=dataset.relations_str,
+            save_embeddings(relation_ebm.float().numpy(), indexes=dataset.relations_str,
                             path=full_storage_path + '/' + trained_model.name + '_relation_embeddings.csv')
             del relation_ebm
         else:
@@ -345,28 +357,168 @@ def store(trained_model, model_name: str = 'model', full_storage_path: str = Non
         """
 
 
-def index_triples(train_set, entity_to_idx: dict, relation_to_idx: dict, num_core=0) -> pd.core.frame.DataFrame:
+def save_indexed_triples(triples: np.ndarray, storage_path: str, name: str, num_entities: int,
+                         num_relations: int) -> None:
+    """
+    Serialize integer indexed triples into an uncompressed {name}_triples.npy file storing int32 values and
+    a JSON header {name}_triples.json containing dtype and counts. The .npy file can be memory-mapped.
+    :param triples: (n,3) array
+    :param storage_path:
+    :param name: train, valid or test
+    :param num_entities:
+    :param num_relations:
+    :return:
+    """
+    path = storage_path + f'/{name}_triples'
+    # Triples written in place, e.g. via out-of-core preprocessing, are not overwritten.
+    if not (isinstance(triples, np.memmap) and triples.dtype == np.int32
+            and os.path.abspath(triples.filename) == os.path.abspath(path + '.npy')):
+        np.save(path + '.npy', np.ascontiguousarray(triples, dtype=np.int32))
+    with open(path + '.json', 'w') as file_descriptor:
+        json.dump({'dtype': 'int32', 'num_triples': len(triples), 'num_entities': num_entities,
+                   'num_relations': num_relations}, file_descriptor)
+
+
+def load_indexed_triples(storage_path: str, name: str, mmap_mode: str = 'r') -> Union[np.ndarray, None]:
+    """ Memory-map {name}_triples.npy serialized via save_indexed_triples(). None if it does not exist """
+    path = storage_path + f'/{name}_triples'
+    if not (os.path.isfile(path + '.json') and os.path.isfile(path + '.npy')):
+        return None
+    header = load_json(path + '.json')
+    triples = np.load(path + '.npy', mmap_mode=mmap_mode)
+    assert triples.shape == (header['num_triples'], 3)
+    assert triples.dtype == np.dtype(header['dtype'])
+    return triples
+
+
+def store_entity_indexes(trained_model: BaseKGE, storage_path: str, triples: np.ndarray, num_lists: int = None,
+                         num_probes: int = None, k: int = 10, num_queries: int = 100, seed: int = 0) -> dict:
+    """
+    Build approximate nearest neighbour indexes over normalized tail (and head) entity embeddings of a model
+    whose scores are inner products of a query vector with entity embeddings, serialize them into
+    storage_path/tail_entity_index* (and storage_path/head_entity_index*) and report their recall@k with respect to
+    exact top k entities of queries sampled from triples.
+    :param trained_model: a model implementing k_vs_all_query (and head_entity_query)
+    :param storage_path:
+    :param triples: (n,3) integer indexed triples
+    :param num_lists: see IVFPQIndex.build
+    :param num_probes: see IVFPQIndex.build
+    :param k:
+    :param num_queries:
+    :param seed:
+    :return: {'tail_entity_index': {'Recall@k': .., 'num_probes': .., 'num_lists': ..}, ...}
+    """
+    model = trained_model.export_for_inference()
+    sample = torch.LongTensor(np.asarray(triples[np.random.default_rng(seed).integers(0, len(triples),
+                                                                                      num_queries)], dtype=np.int64))
+    report = dict()
+    with torch.no_grad():
+        for name, embeddings, queries in [
+            ('tail_entity_index', model.get_tail_entity_representation(), model.k_vs_all_query(sample[:, [0, 1]])),
+            ('head_entity_index', model.get_head_entity_representation(), model.head_entity_query(sample[:, [1, 2]]))]:
+            if queries is None:
+                continue
+            print(f'Building {name}...', end=' ')
+            start_time = time.time()
+            index = IVFPQIndex.build(embeddings, num_lists=num_lists, num_probes=num_probes, seed=seed)
+            index.save(storage_path + f'/{name}')
+            report[name] = {f'Recall@{k}': index.recall_at_k(queries, embeddings, k=k),
+                            'num_probes': index.num_probes, 'num_lists': index.num_lists}
+            print(f'Done ! It took {time.time() - start_time:.3f} seconds. {report[name]}')
+    return report
+
+
+def load_entity_indexes(storage_path: str) -> Tuple[Union[IVFPQIndex, None], Union[IVFPQIndex, None]]:
+    """ Memory-map tail and head entity indexes serialized via store_entity_indexes(). None if they do not exist """
+    return tuple(IVFPQIndex.load(storage_path + f'/{name}')
+                 if os.path.isfile(storage_path + f'/{name}.json') else None
+                 for name in ['tail_entity_index', 'head_entity_index'])
+
+
+def load_vocabularies(storage_path: str) -> Tuple[Vocabulary, Vocabulary]:
+    """
+    Memory-map entity and relation vocabularies.
+    At the first loading, they are constructed from entity_to_idx.gzip and relation_to_idx.gzip and serialized into
+    {entity,relation}_vocabulary_{labels,ids}.npy if storage_path is writable.
+    """
+    vocabularies = []
+    for name in ['entity', 'relation']:
+        path = storage_path + f'/{name}_vocabulary'
+        if Vocabulary.exists(path):
+            vocabularies.append(Vocabulary.load(path, name=name))
+            continue
+        vocabulary = Vocabulary.from_dataframe(pd.read_parquet(storage_path + f'/{name}_to_idx.gzip'), name=name)
+        try:
+            vocabulary.save(path)
+        except OSError as e:
+            print(f'{name} vocabulary could not be serialized: {str(e)}')
+        vocabularies.append(vocabulary)
+    return tuple(vocabularies)
+
+
+def vocab_to_index(vocab_to_idx) -> pd.Index:
+    """
+    Construct a pandas Index whose i-th item is the string (e.g. URI) having the integer index i
+    :param vocab_to_idx: a mapping from str to integer index, i.e., a dictionary, a dataframe or a pandas Index
+    :return:
+    """
+    if isinstance(vocab_to_idx, pd.Index):
+        return vocab_to_idx
+    if isinstance(vocab_to_idx, pd.DataFrame):
+        assert vocab_to_idx.shape[1] == 1
+        keys, values = vocab_to_idx.index.values, vocab_to_idx.iloc[:, 0].values
+    else:
+        keys = np.array(list(vocab_to_idx.keys()), dtype=object)
+        values = np.fromiter(vocab_to_idx.values(), dtype=np.int64, count=len(vocab_to_idx))
+    ordered = np.empty(len(keys), dtype=object)
+    ordered[values] = keys
+    return pd.Index(ordered)
+
+
+def index_columns(df: pd.DataFrame, entity_index: pd.Index, relation_index: pd.Index) -> pd.DataFrame:
+    """ Map string columns of triples into integer indexes via hash table lookups of pandas Index """
+    return pd.DataFrame({'subject': entity_index.get_indexer(df['subject']),
+                         'relation': relation_index.get_indexer(df['relation']),
+                         'object': entity_index.get_indexer(df['object'])}, index=df.index)
+
+
+def _index_chunk(start_end: Tuple[int, int]) -> pd.DataFrame:
+    # Triples and vocabularies are inherited from the parent process, see index_triples().
+    df, entity_index, relation_index = _INDEX_TRIPLES_DATA
+    return index_columns(df.iloc[start_end[0]:start_end[1]], entity_index, relation_index)
+
+
+def index_triples(train_set, entity_to_idx, relation_to_idx, num_core=0) -> pd.core.frame.DataFrame:
     """
     :param train_set: pandas dataframe
     :param entity_to_idx: a mapping from str to integer index
     :param relation_to_idx: a mapping from str to integer index
-    :param num_core: number of cores to be used
+    :param num_core: number of cores to be used. If num_core > 1, chunks of train_set are indexed in parallel
     :return: indexed triples, i.e., pandas dataframe
     """
+    global _INDEX_TRIPLES_DATA
+    if not isinstance(train_set, pd.core.frame.DataFrame):
+        raise KeyError('Wrong type training data')
     n, d = train_set.shape
-    train_set['subject'] = train_set['subject'].apply(lambda x: entity_to_idx.get(x))
-    train_set['relation'] = train_set['relation'].apply(lambda x: relation_to_idx.get(x))
-    train_set['object'] = train_set['object'].apply(lambda x: entity_to_idx.get(x))
-    # train_set = train_set.dropna(inplace=True)
-    if isinstance(train_set, pd.core.frame.DataFrame):
-        assert (n, d) == train_set.shape
-    elif isinstance(train_set, dask.dataframe.core.DataFrame):
-        nn, dd = train_set.shape
-        assert isinstance(dd, int)
-        if isinstance(nn, int):
-            assert n == nn and d == dd
+    entity_index, relation_index = vocab_to_index(entity_to_idx), vocab_to_index(relation_to_idx)
+    if num_core is not None and num_core > 1 and n >= 1_000_000:
+        # (1) Build hash tables of vocabularies before forking so that workers inherit them.
+        entity_index.get_indexer(entity_index[:1]), relation_index.get_indexer(relation_index[:1])
+        # (2) Workers are forked after the data is set so that only integer indexes are pickled.
+        _INDEX_TRIPLES_DATA = (train_set, entity_index, relation_index)
+        try:
+            boundaries = np.linspace(0, n, num_core + 1, dtype=np.int64)
+            with multiprocessing.get_context('fork').Pool(num_core) as pool:
+                train_set = pd.concat(pool.map(_index_chunk, list(zip(boundaries[:-1], boundaries[1:]))))
+        finally:
+            # Release the input data even if a worker fails.
+            _INDEX_TRIPLES_DATA = None
     else:
-        raise KeyError('Wrong type training data')
+        train_set = index_columns(train_set, entity_index, relation_index)
+    unknown = (train_set.values < 0).any(axis=1)
+    if unknown.any():
+        raise KeyError(f'{unknown.sum()} triples contain entities or relations that are not in the vocabulary.')
+    assert (n, d) == train_set.shape
     return train_set
 
 
@@ -426,7 +578,8 @@ def read_preprocess_index_serialize_kg(args, cls):
              add_noise_rate=args.add_noise_rate,
              min_freq_for_vocab=args.min_freq_for_vocab,
              dnf_predicates=args.dnf_predicates,
-             backend=args.backend)
+             backend=args.backend,
+             memory_budget=getattr(args, 'preprocessing_memory_budget', None))
     print(f'Preprocessing took: {time.time() - start_time:.3f} seconds')
     print(kg.description_of_input)
     return kg
@@ -503,7 +656,7 @@ def preprocesses_input_args(arg):
     if arg.sample_triples_ratio is not None:
         assert 1.0 >= arg.sample_triples_ratio >= 0.0
 
-    assert arg.backend in ["modin", "pandas", "vaex", "polars"]
+    assert arg.backend in ["modin", "pandas", "vaex", "polars", "pyarrow"]
 
     sanity_checking_with_arguments(arg)
     # if arg.num_folds_for_cv > 0:
@@ -514,7 +667,7 @@ def preprocesses_input_args(arg):
     return arg
 
 
-def create_constraints(triples: np.ndarray) -> Tuple[dict, dict]:
+def create_constraints(triples: np.ndarray) -> Tuple[FilterIndex, FilterIndex]:
     """
     (1) Extract domains and ranges of relations
     (2) Store a mapping from relations to entities that are outside of the domain and range.
@@ -526,22 +679,32 @@ def create_constraints(triples: np.ndarray) -> Tuple[dict, dict]:
     assert triples.shape[1] == 3
 
     # (1) Compute the range and domain of each relation
-    range_constraints_per_rel = dict()
-    domain_constraints_per_rel = dict()
-    set_of_entities = set()
-    set_of_relations = set()
-    for (e1, p, e2) in triples:
-        range_constraints_per_rel.setdefault(p, set()).add(e2)
-        domain_constraints_per_rel.setdefault(p, set()).add(e1)
-        set_of_entities.add(e1)
-        set_of_relations.add(p)
-        set_of_entities.add(e2)
+    range_per_rel = FilterIndex.from_pairs(triples[:, 1], triples[:, 2])
+    domain_per_rel = FilterIndex.from_pairs(triples[:, 1], triples[:, 0])
+    return constraints_from_ranges(range_per_rel, domain_per_rel, np.unique(triples[:, [0, 2]]))
 
-    for rel in set_of_relations:
-        range_constraints_per_rel[rel] = list(set_of_entities - range_constraints_per_rel[rel])
-        domain_constraints_per_rel[rel] = list(set_of_entities - domain_constraints_per_rel[rel])
 
-    return domain_constraints_per_rel, range_constraints_per_rel
+def constraints_from_ranges(range_per_rel: FilterIndex, domain_per_rel: FilterIndex,
+                            set_of_entities: np.ndarray) -> Tuple[FilterIndex, FilterIndex]:
+    """
+    Map relations to entities that are outside of their domains and ranges, see create_constraints
+    :param range_per_rel: relation => tail entities
+    :param domain_per_rel: relation => head entities
+    :param set_of_entities: sorted unique entities of triples
+    :return:
+    """
+    relations = range_per_rel.keys()
+    # (2) Entities outside of the range and the domain of each relation
+    domain_constraints, range_constraints = [], []
+    for rel in relations[:, 0]:
+        range_constraints.append(np.setdiff1d(set_of_entities, range_per_rel[rel], assume_unique=True))
+        domain_constraints.append(np.setdiff1d(set_of_entities, domain_per_rel[rel], assume_unique=True))
+
+    def to_index(constraints: List[np.ndarray]) -> FilterIndex:
+        return FilterIndex.from_pairs(np.repeat(relations[:, 0], [len(i) for i in constraints]),
+                                      np.concatenate(constraints) if constraints else np.zeros(0))
+
+    return to_index(domain_constraints), to_index(range_constraints)
 
 
 def create_logger(*, name, p):
@@ -635,28 +798,19 @@ def extract_model_summary(s):
     return {'NumParam': s.total_parameters, 'EstimatedSizeMB': s.model_size}
 
 
-def get_er_vocab(data):
-    # head entity and relation
-    er_vocab = defaultdict(list)
-    for triple in data:
-        er_vocab[(triple[0], triple[1])].append(triple[2])
-    return er_vocab
+def get_er_vocab(data) -> FilterIndex:
+    # head entity and relation => tail entities
+    return FilterIndex.from_triples(data, key_columns=(0, 1), value_column=2)
 
 
-def get_re_vocab(data):
-    # head entity and relation
-    re_vocab = defaultdict(list)
-    for triple in data:
-        re_vocab[(triple[1], triple[2])].append(triple[0])
-    return re_vocab
+def get_re_vocab(data) -> FilterIndex:
+    # relation and tail entity => head entities
+    return FilterIndex.from_triples(data, key_columns=(1, 2), value_column=0)
 
 
-def get_ee_vocab(data):
-    # head entity and relation
-    ee_vocab = defaultdict(list)
-    for triple in data:
-        ee_vocab[(triple[0], triple[2])].append(triple[1])
-    return ee_vocab
+def get_ee_vocab(data) -> FilterIndex:
+    # head entity and tail entity => relations
+    return FilterIndex.from_triples(data, key_columns=(0, 2), value_column=1)
 
 
 def load_json(p: str) -> dict:
@@ -912,45 +1066,3 @@ def vocab_to_parquet(vocab_to_idx, name, path_for_serialization, print_into):
     print(print_into)
     vocab_to_idx.to_parquet(path_for_serialization + f'/{name}', compression='gzip', engine='pyarrow')
     print('Done !\n')
-
-
-def dask_remove_triples_with_condition(dask_kg_dataframe,  # ,: dask.dataframe.core.DataFrame,
-                                       min_freq_for_vocab: int = None):  # -> dask.dataframe.core.DataFrame:
-    """
-    Remove rows/triples from an input dataframe
-    """
-    raise NotImplementedError
-    """
-    assert isinstance(dask_kg_dataframe, dask.dataframe.core.DataFrame)
-    if min_freq_for_vocab is not None:
-        assert isinstance(min_freq_for_vocab, int)
-        assert min_freq_for_vocab > 0
-        print(
-            f'Dropping triples having infrequent entities or relations (>{min_freq_for_vocab})...',
-            end=' ')
-        num_triples = dask_kg_dataframe.size.compute()
-        print('Total num triples:', num_triples, end=' ')
-        # Compute entity frequency: index is URI, val is number of occurrences.
-        entity_frequency = dd.concat([dask_kg_dataframe['subject'], dask_kg_dataframe['object']],
-                                     ignore_index=True).value_counts().compute()
-        relation_frequency = dask_kg_dataframe['relation'].value_counts().compute()
-        # low_frequency_entities index and values are the same URIs: dask.dataframe.core.DataFrame
-        low_frequency_entities = entity_frequency[
-            entity_frequency <= min_freq_for_vocab].index.values
-        low_frequency_relation = relation_frequency[
-            relation_frequency <= min_freq_for_vocab].index.values
-
-        # If triple contains subject that is in low_freq, set False do not select
-        dask_kg_dataframe = dask_kg_dataframe[~dask_kg_dataframe['subject'].isin(low_frequency_entities)]
-        # If triple contains object that is in low_freq, set False do not select
-        dask_kg_dataframe = dask_kg_dataframe[~dask_kg_dataframe['object'].isin(low_frequency_entities)]
-        # If triple contains relation that is in low_freq, set False do not select
-        dask_kg_dataframe = dask_kg_dataframe[~dask_kg_dataframe['relation'].isin(low_frequency_relation)]
-        # print('\t after dropping:', df_str_kg.size.compute(scheduler=scheduler_flag))
-        print('\t after dropping:', dask_kg_dataframe.size.compute())
-        print('Done !')
-        return dask_kg_dataframe
-    else:
-        return dask_kg_dataframe
-    """
-    return None
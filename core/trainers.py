@@ -3,30 +3,46 @@
 * DataParallelTrainer implements a trainer class as in pytorch lightning based on torch.nn.DataParallel
 
 * DistributedDataParallelTrainer implements a trainer class based on torch.nn.parallel.DistributedDataParallel
+on GPUs (nccl) or on CPUs (gloo)
+
+* HogwildTrainer implements lock-free asynchronous training of a shared model on CPUs
+
+* PartitionedTrainer implements training of entity embeddings stored in memory-mapped partitions
 
 Although DistributedDataParallel is faster than DataParallel, the former is more memory extensive.
 
 """
 import torch
+import numpy as np
 import time
 import torch.multiprocessing as mp
 from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.distributed.optim import ZeroRedundancyOptimizer
 import torch.distributed as dist
 import os
-import tempfile
+import copy
+import socket
 from core.custom_opt.sls import Sls
 from core.custom_opt.adam_sls import AdamSLS
+from core.dataset_classes import worker_init_fn
+from core.helper_classes import mixed_precision
+from typing import Tuple
 
 
 class AbstractTrainer:
     def __init__(self, args, callbacks):
         self.attributes = vars(args)
         self.callbacks = callbacks
+        # Measurements of the training, e.g. throughput.
+        self.report = dict()
         print(self.attributes)
 
     def __getattr__(self, attr):
-        return self.attributes[attr]
+        # Missing attributes raise AttributeError so that trainers can be pickled into spawned processes.
+        try:
+            return self.__dict__['attributes'][attr]
+        except KeyError:
+            raise AttributeError(attr)
 
     def on_fit_start(self, *args, **kwargs):
         """ """
@@ -80,10 +96,18 @@ class DataParallelTrainer(AbstractTrainer):
         else:
             self.use_closure = False
 
-        data_loader = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
-                                                  shuffle=True,
-                                                  num_workers=self.num_core,
-                                                  collate_fn=dataset.collate_fn)
+        # Memory usage of workers is reported if --report_worker_memory is given.
+        init_fn = worker_init_fn if self.attributes.get('report_worker_memory') else None
+        if hasattr(dataset, 'batch_loader'):
+            # Batches of triples are sliced at once.
+            data_loader = dataset.batch_loader(batch_size=self.batch_size, shuffle=True, num_workers=self.num_core,
+                                               worker_init_fn=init_fn)
+        else:
+            data_loader = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
+                                                      shuffle=True,
+                                                      num_workers=self.num_core,
+                                                      collate_fn=dataset.collate_fn,
+                                                      worker_init_fn=init_fn)
 
         num_total_batches = len(data_loader)
         print_period = max(num_total_batches // 10, 1)
@@ -116,14 +140,22 @@ class DataParallelTrainer(AbstractTrainer):
 
         self.on_fit_end(self, self.model)
 
+    def forward_loss(self, x_batch: torch.Tensor, y_batch: torch.Tensor) -> torch.Tensor:
+        """ Compute the forward and loss """
+        with mixed_precision(self.attributes.get('precision'), self.device.type):
+            if self.model.module.k_vs_all_block_size:
+                # k vs all scores are reduced over blocks of entities, see BaseKGE.batch_loss
+                return self.model.module.batch_loss(x_batch, y_batch)
+            return self.loss_function(self.model(x_batch), y_batch)
+
     def compute_forward_loss_backward(self, x_batch: torch.Tensor, y_batch: torch.Tensor) -> torch.Tensor:
         """ Compute the forward, loss and backward """
         if self.use_closure:
-            batch_loss = self.optimizer.step(closure=lambda: self.loss_function(self.model(x_batch), y_batch))
+            batch_loss = self.optimizer.step(closure=lambda: self.forward_loss(x_batch, y_batch))
             return batch_loss
         else:
             # (4) Backpropagate the gradient of (3) w.r.t. parameters.
-            batch_loss = self.loss_function(self.model(x_batch), y_batch)
+            batch_loss = self.forward_loss(x_batch, y_batch)
             # Backward pass
             batch_loss.backward()
             # Adjust learning weights
@@ -145,12 +177,19 @@ class DataParallelTrainer(AbstractTrainer):
             raise ValueError('Unexpected batch shape..')
 
 
-def setup(rank, world_size):
+def find_free_port() -> int:
+    """ A free TCP port on localhost for the rendezvous of processes """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def setup(rank, world_size, backend='nccl', port=12355):
     os.environ['MASTER_ADDR'] = 'localhost'
-    os.environ['MASTER_PORT'] = '12355'
-    # initialize the process group, nccl
+    os.environ['MASTER_PORT'] = str(port)
+    # initialize the process group, nccl on GPUs and gloo on CPUs
     # gloo, mpi or ncclhttps://pytorch.org/docs/stable/distributed.html#torch.distributed.init_process_group
-    dist.init_process_group(backend='nccl', rank=rank, world_size=world_size)
+    dist.init_process_group(backend=backend, rank=rank, world_size=world_size)
 
 
 def cleanup():
@@ -162,6 +201,33 @@ def print_peak_memory(prefix, device):
         print(f"{prefix}: {torch.cuda.max_memory_allocated(device) // 1e6}MB ")
 
 
+def available_cores() -> list:
+    return sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+
+
+def pin_to_cores(rank: int, world_size: int) -> list:
+    """ Pin the process of rank to its own disjoint set of available cores and use one thread per core """
+    cores = available_cores()
+    cores_per_process = max(len(cores) // world_size, 1)
+    selected = cores[rank * cores_per_process:(rank + 1) * cores_per_process] or [cores[rank % len(cores)]]
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, selected)
+    torch.set_num_threads(len(selected))
+    return selected
+
+
+class BatchLoss(torch.nn.Module):
+    """ BaseKGE.batch_loss as the forward pass, so that DistributedDataParallel synchronizes gradients of
+    the loss of a model including the loss reduced over blocks of entities """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x_batch, y_batch):
+        return self.model.batch_loss(x_batch, y_batch)
+
+
 def distributed_training(rank: int, *args):
     """
     distributed_training is called as the entrypoint of the spawned process.
@@ -169,89 +235,429 @@ def distributed_training(rank: int, *args):
     This is a requirement imposed by multiprocessing.
 
     The function is called as ``fn(i, *args)``, where ``i`` is the process index and ``args`` is the passed through tuple of arguments.
+
+    (1) Each process trains a replica of the model on its shard of the dataset given by a DistributedSampler.
+    (2) Gradients are averaged over processes in the backward pass.
+    (3) The process of rank 0 calls epoch end callbacks and writes the trained parameters into the model
+    shared with the parent process.
     """
-    world_size, model, dataset, batch_size, max_epochs, lr = args
-    print(f"Running basic DDP example on rank {rank}.")
-    print(f"torch.utils.data.get_worker_info():{torch.utils.data.get_worker_info()}")
-    print(f"torch.initial_seed():{torch.initial_seed()}")
-    setup(rank, world_size)
-    # Move the model to GPU with id rank
-    model = model.to(rank)
-    ddp_model = DDP(model, device_ids=[rank])
-
-    loss_function = torch.nn.BCEWithLogitsLoss()
-    optimizer = torch.optim.SGD(ddp_model.parameters(), lr=lr)
+    world_size, backend, port, trainer, model, dataset, elapsed_time = args
+    setup(rank, world_size, backend=backend, port=port)
+    if backend == 'nccl':
+        device = torch.device(f'cuda:{rank}')
+    else:
+        device = torch.device('cpu')
+        cores = pin_to_cores(rank, world_size)
+        print(f'Rank {rank}: {len(cores)} threads on cores {cores}')
+    replica = copy.deepcopy(model).to(device)
+    ddp_model = DDP(BatchLoss(replica), device_ids=[rank] if device.type == 'cuda' else None)
+    optimizer = replica.configure_optimizers(ddp_model.parameters())
+    if isinstance(optimizer, Sls) or isinstance(optimizer, AdamSLS):
+        raise ValueError(f'{type(optimizer).__name__} evaluating closures is not supported in '
+                         f'DistributedDataParallelTrainer')
     # https://pytorch.org/tutorials/recipes/zero_redundancy_optimizer.html
     # Note: ZeroRedundancy Increases the computation time quite a bit. DBpedia/10 => 3mins
     # Without ZeroReundancy optimizer we have 0.770 minutes
     # optimizer = ZeroRedundancyOptimizer(ddp_model.parameters(),optimizer_class=torch.optim.SGD, lr=lr )
-
-    train_sampler = torch.utils.data.distributed.DistributedSampler(dataset,
-                                                                    num_replicas=world_size,
-                                                                    rank=rank)
-    # worker_init_fn?
-    data_loader = torch.utils.data.DataLoader(dataset,
-                                              batch_size=batch_size,
-                                              num_workers=0,
-                                              collate_fn=dataset.collate_fn,
-                                              sampler=train_sampler)  # , pin_memory=False)
+    train_sampler = torch.utils.data.distributed.DistributedSampler(dataset, num_replicas=world_size, rank=rank,
+                                                                    shuffle=True, seed=trainer.seed_for_computation)
+    if hasattr(dataset, 'batch_loader'):
+        # Batches of triples are sliced at once.
+        data_loader = torch.utils.data.DataLoader(dataset, batch_size=None, collate_fn=dataset.collate_fn,
+                                                  sampler=torch.utils.data.BatchSampler(train_sampler,
+                                                                                        trainer.batch_size,
+                                                                                        drop_last=False))
+    else:
+        data_loader = torch.utils.data.DataLoader(dataset, batch_size=trainer.batch_size, num_workers=0,
+                                                  collate_fn=dataset.collate_fn, sampler=train_sampler)
     num_total_batches = len(data_loader)
-    print_period = max(num_total_batches // 10, 1)
-    print(f'Number of batches for an epoch:{num_total_batches}\t printing period:{print_period}')
-    for epoch in range(max_epochs):
+    print(f'Rank {rank}: Number of batches for an epoch:{num_total_batches}')
+    start_time = time.time()
+    for epoch in range(trainer.max_epochs):
+        train_sampler.set_epoch(epoch)
         epoch_loss = 0
-        start_time = time.time()
+        epoch_start_time = time.time()
         for i, z in enumerate(data_loader):
             # Zero your gradients for every batch!
             optimizer.zero_grad()
-            x_batch, y_batch = z
-            # the data transfer should be overlapped by the kernel execution
-            x_batch, y_batch = x_batch.to(rank, non_blocking=True), y_batch.to(rank, non_blocking=True)
-            yhat_batch = model(x_batch)
-            batch_loss = loss_function(yhat_batch, y_batch)
-            epoch_loss += batch_loss.item()
-            if i > 0 and i % print_period == 0:
-                print(
-                    f"Batch:{i}\t avg. batch loss until now:\t{epoch_loss / i}\t TotalRuntime:{(time.time() - start_time) / 60:.3f} minutes")
-            # Backward pass
+            x_batch, y_batch = trainer.extract_input_outputs(z, device)
+            with mixed_precision(trainer.attributes.get('precision'), device.type):
+                batch_loss = ddp_model(x_batch, y_batch)
+            # Backward pass averages gradients over processes.
             batch_loss.backward()
             # Adjust learning weights
             optimizer.step()
-
-        print(f"Epoch took {(time.time() - start_time) / 60:.3f} minutes")
-        if i > 0:
-            print(f"{epoch} epoch: Average batch loss:{epoch_loss / i}")
-        else:
-            print(f"{epoch} epoch: Average batch loss:{epoch_loss}")
-
+            epoch_loss += batch_loss.item()
+        # Average batch loss over processes.
+        epoch_loss = torch.tensor([epoch_loss, num_total_batches], dtype=torch.float64)
+        dist.all_reduce(epoch_loss)
         if rank == 0:
-            torch.save(ddp_model.module.state_dict(), "model.pt")
+            print(f"{epoch} epoch: Runtime: {(time.time() - epoch_start_time) / 60:.3f} minutes \t"
+                  f"Average loss:{epoch_loss[0].item() / max(epoch_loss[1].item(), 1)}")
+            trainer.on_train_epoch_end(trainer, replica)
+    dist.barrier()
+    if rank == 0:
+        elapsed_time[0] = time.time() - start_time
+        model.load_state_dict(replica.to('cpu').state_dict())
+    cleanup()
 
 
 class DistributedDataParallelTrainer(AbstractTrainer):
-    """ A Trainer based on torch.nn.parallel.DistributedDataParallel (https://pytorch.org/docs/stable/notes/ddp.html#ddp)"""
+    """ A Trainer based on torch.nn.parallel.DistributedDataParallel (https://pytorch.org/docs/stable/notes/ddp.html#ddp)
+
+    On GPUs, a process per GPU communicates via nccl. On CPUs, num_processes processes communicate via gloo and
+    each process is pinned to a disjoint set of available cores.
+    """
 
     def __init__(self, args, callbacks):
         super().__init__(args, callbacks)
         self.attributes = vars(args)
         self.callbacks = callbacks
-
+        self.model = None
+        self.is_global_zero = True
         torch.manual_seed(self.seed_for_computation)
         torch.cuda.manual_seed_all(self.seed_for_computation)
 
     def fit(self, *args, **kwargs):
         assert len(args) == 1
         model, = args
-
-        # nodes * gpus
-        world_size = self.num_nodes * torch.cuda.device_count()
+        self.on_fit_start(trainer=self, pl_module=model)
         dataset = kwargs['train_dataloaders'].dataset
-        print(model)
-        mp.spawn(fn=distributed_training, args=(world_size, model, dataset, self.batch_size, self.max_epochs, self.lr),
+        if torch.cuda.is_available():
+            # nodes * gpus
+            backend, world_size = 'nccl', self.num_nodes * torch.cuda.device_count()
+        else:
+            backend, world_size = 'gloo', self.attributes.get('num_processes') or len(available_cores())
+        print(f'Number of processes:{world_size}\tBackend:{backend}')
+        # Parameters of model are updated in place by the process of rank 0.
+        model.share_memory()
+        elapsed_time = torch.zeros(1, dtype=torch.float64).share_memory_()
+        mp.spawn(fn=distributed_training,
+                 args=(world_size, backend, find_free_port(), self, model, dataset, elapsed_time),
                  nprocs=world_size,
                  join=True)
+        self.model = model
+        self.report['NumProcesses'] = world_size
+        self.report['SamplesPerSecond'] = len(dataset) * self.max_epochs / elapsed_time.item()
+        print(f"Samples per second of {world_size} processes:{self.report['SamplesPerSecond']:.3f}")
+        self.on_fit_end(self, self.model)
 
-        model = model.load_state_dict(torch.load('model.pt'))
-        os.remove('model.pt')
+    @staticmethod
+    def extract_input_outputs(z: list, device: torch.device) -> tuple:
+        """ Construct inputs and outputs from a batch and move them to device """
+        if len(z) == 2:
+            x_batch, y_batch = z
+            return x_batch.to(device), y_batch.to(device)
+        elif len(z) == 3:
+            x_batch, y_idx_batch, y_batch, = z
+            return (x_batch.to(device), y_idx_batch.to(device)), y_batch.to(device)
+        else:
+            raise ValueError('Unexpected batch shape..')
+
+
+def hogwild_training(rank: int, *args):
+    """
+    Entrypoint of a spawned process of HogwildTrainer.
+
+    (1) In every epoch, a permutation of the triples is split into disjoint shards, one per process.
+    (2) Batches of the shard are scored and the shared model is updated without locks.
+    (3) At the end of an epoch, the process reports its progress and waits until the parent process releases
+    the next epoch.
+    """
+    world_size, model, optimizer, dataset, batch_size, max_epochs, seed, precision, progress, release, losses, \
+        elapsed_time = args
+    pin_to_cores(rank, world_size)
+    # Negative examples are sampled differently in every process.
+    torch.manual_seed(seed + rank)
+    generator = torch.Generator()
+    for epoch in range(max_epochs):
+        start_time = time.time()
+        # (1) Shard of the process.
+        generator.manual_seed(seed + epoch)
+        shard = torch.randperm(len(dataset), generator=generator)[rank::world_size]
+        epoch_loss, num_batches = 0, 0
+        for batch_idx in torch.split(shard, batch_size):
+            # (2) Lock-free update of the shared model.
+            x_batch, y_batch = dataset.collate_fn(dataset[batch_idx])
+            optimizer.zero_grad()
+            with mixed_precision(precision):
+                batch_loss = model.batch_loss(x_batch, y_batch)
+            batch_loss.backward()
+            optimizer.step()
+            epoch_loss += batch_loss.item()
+            num_batches += 1
+        elapsed_time[rank] += time.time() - start_time
+        losses[rank] = epoch_loss / max(num_batches, 1)
+        # (3) Wait for the end of the epoch in all processes.
+        progress[rank] = epoch + 1
+        while release[0] < epoch + 1:
+            time.sleep(0.001)
+
+
+class HogwildTrainer(AbstractTrainer):
+    """ Lock-free asynchronous training on CPUs (Hogwild!, https://arxiv.org/abs/1106.5730)
+
+    The model and the optimizer state are placed in shared memory and num_processes processes, each pinned to a
+    disjoint set of cores, update them with sparse gradients of their own shards of triples without
+    synchronization. Batches of negative sampling reference few embedding rows, so that concurrent updates rarely
+    collide. Processes are synchronized only at the end of epochs to call callbacks in the parent process.
+    """
+
+    def __init__(self, args, callbacks):
+        super().__init__(args, callbacks)
+        self.model = None
+        self.is_global_zero = True
+        torch.manual_seed(self.seed_for_computation)
+
+    def fit(self, *args, **kwargs):
+        assert len(args) == 1
+        model, = args
+        dataset = kwargs['train_dataloaders'].dataset
+        if not hasattr(dataset, 'batch_loader'):
+            raise ValueError('HogwildTrainer requires a dataset of triples, i.e., NegSample scoring technique')
+        if not model.sparse_gradients or model.optimizer_name not in ['SGD', 'Adagrad']:
+            raise ValueError('HogwildTrainer requires sparse_gradients and SGD or Adagrad. '
+                             f'Currently:{model.sparse_gradients} and {model.optimizer_name}')
+        self.on_fit_start(trainer=self, pl_module=model)
+        world_size = self.attributes.get('num_processes') or len(available_cores())
+        print(f'Number of processes:{world_size}')
+        # (1) Parameters and optimizer states are shared by all processes.
+        model.train()
+        model.share_memory()
+        optimizer = model.configure_optimizers()
+        if isinstance(optimizer, torch.optim.Adagrad):
+            optimizer.share_memory()
+        # (2) Progress of processes in epochs, the last epoch released by the parent process, and measurements.
+        progress = torch.zeros(world_size, dtype=torch.long).share_memory_()
+        release = torch.zeros(1, dtype=torch.long).share_memory_()
+        losses = torch.zeros(world_size, dtype=torch.float64).share_memory_()
+        elapsed_time = torch.zeros(world_size, dtype=torch.float64).share_memory_()
+        context = mp.spawn(fn=hogwild_training,
+                           args=(world_size, model, optimizer, dataset, self.batch_size, self.max_epochs,
+                                 self.seed_for_computation, self.attributes.get('precision'), progress, release,
+                                 losses, elapsed_time),
+                           nprocs=world_size,
+                           join=False)
+        for epoch in range(self.max_epochs):
+            start_time = time.time()
+            while progress.min() < epoch + 1:
+                # Raises an exception if a process fails.
+                context.join(timeout=0.01)
+            print(f"{epoch} epoch: Runtime: {(time.time() - start_time) / 60:.3f} minutes \t"
+                  f"Average loss:{losses.mean().item()}")
+            self.on_train_epoch_end(self, model)
+            release[0] = epoch + 1
+        while not context.join():
+            pass
         self.model = model
+        self.report['NumProcesses'] = world_size
+        self.report['SamplesPerSecond'] = len(dataset) * self.max_epochs / elapsed_time.max().item()
+        print(f"Triples per second of {world_size} processes:{self.report['SamplesPerSecond']:.3f}")
         self.on_fit_end(self, self.model)
+
+
+class PartitionedTrainer(AbstractTrainer):
+    """ Training of entity embeddings exceeding the memory as in PyTorch-BigGraph (https://arxiv.org/abs/1903.12287)
+
+    Entities are split into num_entity_partitions contiguous partitions and triples are bucketed by the partitions of
+    their head and tail entities. Entity embeddings and their optimizer state are stored in memory-mapped files and
+    only the (at most two) partitions of the current bucket are loaded into memory. Relation embeddings and other
+    parameters remain in memory. Negative examples of a bucket are sampled from entities of its partitions.
+    """
+
+    def __init__(self, args, callbacks):
+        super().__init__(args, callbacks)
+        self.model = None
+        self.is_global_zero = True
+        torch.manual_seed(self.seed_for_computation)
+        # Boundaries of partitions, i.e., entities of the p-th partition are bounds[p] <= idx < bounds[p+1].
+        self.bounds = None
+        # Memory-mapped entity embeddings and the state of Adagrad (sums of squared gradients).
+        self.entity_embeddings = None
+        self.entity_optimizer_state = None
+        # Partitions loaded into memory: partition index => (embeddings, optimizer state)
+        self.partitions = dict()
+        self.max_resident_entities = 0
+
+    def rows(self, partition: int) -> slice:
+        return slice(self.bounds[partition].item(), self.bounds[partition + 1].item())
+
+    def load_partitions(self, partitions: list) -> None:
+        """ Store partitions not in partitions and load missing partitions of partitions """
+        for p in [p for p in self.partitions if p not in partitions]:
+            self.store_partition(p)
+        for p in partitions:
+            if p not in self.partitions:
+                rows = self.rows(p)
+                state = None
+                if self.entity_optimizer_state is not None:
+                    state = torch.from_numpy(np.array(self.entity_optimizer_state[rows]))
+                self.partitions[p] = (torch.from_numpy(np.array(self.entity_embeddings[rows])), state)
+        self.max_resident_entities = max(self.max_resident_entities,
+                                         sum(len(embeddings) for embeddings, _ in self.partitions.values()))
+
+    def store_partition(self, partition: int) -> None:
+        """ Write a partition into memory-mapped files and remove it from memory """
+        embeddings, state = self.partitions.pop(partition)
+        rows = self.rows(partition)
+        self.entity_embeddings[rows] = embeddings.numpy()
+        if state is not None:
+            self.entity_optimizer_state[rows] = state.numpy()
+
+    def store_partitions(self, model) -> None:
+        """ Store all partitions and let the model use the memory-mapped entity embeddings """
+        for p in list(self.partitions):
+            self.store_partition(p)
+        self.entity_embeddings.flush()
+        if self.entity_optimizer_state is not None:
+            self.entity_optimizer_state.flush()
+        model.entity_embeddings = torch.nn.Embedding.from_pretrained(torch.from_numpy(self.entity_embeddings),
+                                                                     freeze=False, sparse=model.sparse_gradients)
+
+    def bucket_triples(self, triples: torch.LongTensor) -> Tuple[torch.LongTensor, torch.LongTensor]:
+        """ Sort triples by buckets, i.e., head partition * num_entity_partitions + tail partition and return
+        offsets of buckets in sorted triples """
+        num_partitions = len(self.bounds) - 1
+        head_partitions = torch.bucketize(triples[:, 0], self.bounds[1:], right=True)
+        tail_partitions = torch.bucketize(triples[:, 2], self.bounds[1:], right=True)
+        buckets = head_partitions * num_partitions + tail_partitions
+        order = torch.from_numpy(np.argsort(buckets.numpy(), kind='stable'))
+        counts = torch.bincount(buckets, minlength=num_partitions ** 2)
+        return triples[order], torch.cat((torch.zeros(1, dtype=torch.long), torch.cumsum(counts, dim=0)))
+
+    def train_bucket(self, model, optimizer, entity_optimizer, dataset, triples: torch.LongTensor,
+                     head_partition: int, tail_partition: int) -> Tuple[float, int]:
+        """
+        (1) Load the head and tail partitions and concatenate them into entity embeddings of the model. The entity
+        optimizer updates (1), i.e., its parameter and its state are swapped.
+        (2) Map indexes of entities to rows of (1).
+        (3) Train on triples of the bucket and negative examples sampled from (1).
+        (4) Write updated embeddings and optimizer states back into partitions.
+        """
+        # (1) Embeddings and optimizer states of partitions.
+        partitions = [head_partition] if head_partition == tail_partition else [head_partition, tail_partition]
+        self.load_partitions(partitions)
+        starts = dict()
+        for p in partitions:
+            starts[p] = sum(len(self.partitions[q][0]) for q in partitions[:partitions.index(p)])
+        weights = torch.cat([self.partitions[p][0] for p in partitions])
+        model.entity_embeddings = torch.nn.Embedding.from_pretrained(weights, freeze=False,
+                                                                     sparse=model.sparse_gradients)
+        state = dict()
+        for group in entity_optimizer.param_groups:
+            if group['params']:
+                state = entity_optimizer.state.pop(group['params'][0], state)
+                group['params'] = [model.entity_embeddings.weight]
+        if self.entity_optimizer_state is not None:
+            state['sum'] = torch.cat([self.partitions[p][1] for p in partitions])
+        entity_optimizer.state[model.entity_embeddings.weight] = state
+        # (2) Local indexes of entities.
+        triples = triples.clone()
+        triples[:, 0] += starts[head_partition] - self.bounds[head_partition]
+        triples[:, 2] += starts[tail_partition] - self.bounds[tail_partition]
+        bucket_dataset = copy.copy(dataset)
+        bucket_dataset.num_entities = len(weights)
+        # (3) Train.
+        bucket_loss, num_batches = 0, 0
+        for batch_idx in torch.randperm(len(triples)).split(self.batch_size):
+            x_batch, y_batch = bucket_dataset.collate_fn(triples[batch_idx])
+            optimizer.zero_grad()
+            entity_optimizer.zero_grad()
+            with mixed_precision(self.attributes.get('precision')):
+                batch_loss = model.batch_loss(x_batch, y_batch)
+            batch_loss.backward()
+            optimizer.step()
+            entity_optimizer.step()
+            bucket_loss += batch_loss.item()
+            num_batches += 1
+        # (4) Updated partitions.
+        for p in partitions:
+            embeddings, state = self.partitions[p]
+            rows = slice(starts[p], starts[p] + len(embeddings))
+            embeddings.copy_(model.entity_embeddings.weight.data[rows])
+            if state is not None:
+                state.copy_(entity_optimizer.state[model.entity_embeddings.weight]['sum'][rows])
+        return bucket_loss, num_batches
+
+    def fit(self, *args, **kwargs):
+        assert len(args) == 1
+        model, = args
+        dataset = kwargs['train_dataloaders'].dataset
+        if not hasattr(dataset, 'batch_loader'):
+            raise ValueError('PartitionedTrainer requires a dataset of triples, i.e., NegSample scoring technique')
+        if model.optimizer_name not in ['SGD', 'Adagrad']:
+            raise ValueError(f'PartitionedTrainer requires SGD or Adagrad. Currently:{model.optimizer_name}')
+        self.on_fit_start(trainer=self, pl_module=model)
+        num_partitions = self.attributes.get('num_entity_partitions') or 1
+        num_entities, embedding_dim = model.entity_embeddings.weight.shape
+        assert num_entities >= num_partitions
+        self.bounds = (torch.arange(num_partitions + 1) * num_entities) // num_partitions
+        print(f'Number of entity partitions:{num_partitions}')
+        # (1) Memory-mapped entity embeddings and optimizer states.
+        path = self.attributes['full_storage_path']
+        self.entity_embeddings = np.lib.format.open_memmap(path + '/entity_embeddings.npy', mode='w+',
+                                                           dtype=np.float32, shape=(num_entities, embedding_dim))
+        if model.optimizer_name == 'Adagrad':
+            self.entity_optimizer_state = np.lib.format.open_memmap(path + '/entity_optimizer_state.npy',
+                                                                    mode='w+', dtype=np.float32,
+                                                                    shape=(num_entities, embedding_dim))
+        # (2) Initialize embeddings partition by partition. Entity embeddings of BaseKGE are not allocated, if they
+        # are on the meta device. Otherwise, they are copied and released.
+        for p in range(num_partitions):
+            rows = self.rows(p)
+            if model.entity_embeddings.weight.is_meta:
+                # xavier_normal_ of the (num_entities, embedding_dim) weight as in BaseKGE.
+                std = (2.0 / (num_entities + embedding_dim)) ** 0.5
+                self.entity_embeddings[rows] = (torch.randn(rows.stop - rows.start, embedding_dim) * std).numpy()
+            else:
+                self.entity_embeddings[rows] = model.entity_embeddings.weight.data[rows].numpy()
+        model.entity_embeddings = torch.nn.Embedding(num_entities, embedding_dim, sparse=model.sparse_gradients,
+                                                     device='meta')
+        # (3) The entity optimizer is configured once and updates entity embeddings of buckets (see train_bucket).
+        # Relation embeddings and other parameters remain in memory and are updated by the optimizer of the model.
+        entity_optimizer = model.configure_optimizers([model.entity_embeddings.weight])
+        optimizer = model.configure_optimizers([parameter for name, parameter in model.named_parameters()
+                                                if name != 'entity_embeddings.weight'])
+        # (4) Buckets of triples.
+        triples, offsets = self.bucket_triples(dataset.triples_idx.long())
+        model.train()
+        start_time = time.time()
+        for epoch in range(self.max_epochs):
+            epoch_start_time = time.time()
+            epoch_loss, num_batches = 0, 0
+            for head_partition in range(num_partitions):
+                for tail_partition in range(num_partitions):
+                    bucket = head_partition * num_partitions + tail_partition
+                    if offsets[bucket] == offsets[bucket + 1]:
+                        continue
+                    bucket_loss, bucket_batches = self.train_bucket(model, optimizer, entity_optimizer, dataset,
+                                                                    triples[offsets[bucket]:offsets[bucket + 1]],
+                                                                    head_partition, tail_partition)
+                    epoch_loss += bucket_loss
+                    num_batches += bucket_batches
+            self.store_partitions(model)
+            print(f"{epoch} epoch: Runtime: {(time.time() - epoch_start_time) / 60:.3f} minutes \t"
+                  f"Average loss:{epoch_loss / max(num_batches, 1)}")
+            self.on_train_epoch_end(self, model)
+        self.model = model
+        # (5) Optimizer states are not needed after training.
+        if self.entity_optimizer_state is not None:
+            self.entity_optimizer_state = None
+            os.remove(path + '/entity_optimizer_state.npy')
+        self.report['NumEntityPartitions'] = num_partitions
+        self.report['MaxResidentEntities'] = self.max_resident_entities
+        self.report['SamplesPerSecond'] = len(triples) * self.max_epochs / (time.time() - start_time)
+        print(f'At most {self.max_resident_entities} of {num_entities} entity embeddings were in memory')
+        self.on_fit_end(self, self.model)
+
+
+def scaling_efficiency(samples_per_second: dict) -> dict:
+    """
+    Parallel efficiency of data-parallel training, i.e., the speedup over a single process divided by the number
+    of processes.
+
+    :param samples_per_second: a mapping from a number of processes to the throughput, including 1
+    :return: a mapping from a number of processes to the efficiency in [0, 1]
+    """
+    assert 1 in samples_per_second
+    return {n: throughput / (n * samples_per_second[1]) for n, throughput in samples_per_second.items()}
@@ -0,0 +1,125 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from typing import List, Iterable
+
+
+class Vocabulary:
+    """ Immutable bijection between string labels and integer indexes
+
+    (1) labels: (n,) sorted array of UTF-8 encoded labels of a fixed-length bytes dtype.
+    (2) ids: (n,) int32 array, ids[i] is the index of labels[i].
+
+    Labels are encoded via a binary search in (1) and indexes are decoded via the inverse permutation of (2),
+    which is computed at the first decoding. Both arrays are stored in .npy files and can be memory-mapped.
+    """
+
+    def __init__(self, labels: np.ndarray, ids: np.ndarray, name: str = 'entity'):
+        assert labels.ndim == 1 and labels.dtype.kind == 'S'
+        assert len(labels) == len(ids) and ids.dtype == np.int32
+        self.labels = labels
+        self.ids = ids
+        self.name = name
+        self._positions = None
+
+    @classmethod
+    def from_labels(cls, labels: Iterable[str], ids: Iterable[int] = None, name: str = 'entity') -> 'Vocabulary':
+        """
+        :param labels: labels of indexes
+        :param ids: indexes of labels, 0, 1, ... if None
+        :param name:
+        :return:
+        """
+        labels = np.array([str(i).encode('utf-8') for i in labels], dtype=bytes)
+        ids = np.arange(len(labels), dtype=np.int32) if ids is None else np.asarray(ids, dtype=np.int32)
+        if len(np.unique(labels)) != len(labels):
+            raise ValueError(f'Labels of {name} vocabulary are not unique')
+        order = np.argsort(labels, kind='stable')
+        return cls(labels[order], ids[order], name=name)
+
+    @classmethod
+    def from_dataframe(cls, vocab_to_idx: pd.DataFrame, name: str = 'entity') -> 'Vocabulary':
+        """ Vocabulary of an entity_to_idx or relation_to_idx DataFrame having labels as index """
+        return cls.from_labels(vocab_to_idx.index.values, vocab_to_idx[name].values, name=name)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label: str) -> bool:
+        position = np.searchsorted(self.labels, label.encode('utf-8'))
+        return position < len(self.labels) and self.labels[position] == label.encode('utf-8')
+
+    def encode(self, labels: List[str]) -> np.ndarray:
+        """
+        Indexes of labels
+
+        :param labels: list of labels
+        :return: (n,) int64 array
+        :raises KeyError: if a label is not in the vocabulary
+        """
+        queries = np.array([i.encode('utf-8') for i in labels], dtype=bytes)
+        if len(queries) == 0:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.labels, queries), len(self.labels) - 1)
+        found = self.labels[positions] == queries
+        if not found.all():
+            raise KeyError(f'{[labels[i] for i in np.flatnonzero(~found)]} not in the {self.name} vocabulary')
+        return self.ids[positions].astype(np.int64)
+
+    def decode(self, ids) -> np.ndarray:
+        """
+        Labels of indexes
+
+        :param ids: array-like of indexes
+        :return: array of str having the shape of ids
+        """
+        if self._positions is None:
+            self._positions = np.empty(len(self.ids), dtype=np.int32)
+            self._positions[self.ids] = np.arange(len(self.ids), dtype=np.int32)
+        ids = np.asarray(ids, dtype=np.int64)
+        return np.char.decode(self.labels[self._positions[ids]], 'utf-8')
+
+    def sample(self, n: int, random_state: np.random.Generator = None) -> List[str]:
+        """ n labels sampled without replacement """
+        random_state = random_state if random_state is not None else np.random.default_rng()
+        return self.decode(random_state.choice(len(self), size=n, replace=False)).tolist()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """ DataFrame having labels as index and indexes in the name column in the order of indexes """
+        ids = np.arange(len(self))
+        return pd.DataFrame(data=ids, columns=[self.name], index=self.decode(ids).astype(object))
+
+    def save(self, path: str) -> None:
+        """ Serialize into path_labels.npy and path_ids.npy """
+        np.save(path + '_labels.npy', np.ascontiguousarray(self.labels))
+        np.save(path + '_ids.npy', np.ascontiguousarray(self.ids))
+
+    @classmethod
+    def load(cls, path: str, name: str = 'entity', mmap_mode: str = 'r') -> 'Vocabulary':
+        """ Load a vocabulary serialized via save(). Arrays are memory-mapped """
+        return cls(np.load(path + '_labels.npy', mmap_mode=mmap_mode), np.load(path + '_ids.npy', mmap_mode=mmap_mode),
+                   name=name)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.isfile(path + '_labels.npy') and os.path.isfile(path + '_ids.npy')
+
+
+class ParquetVocabulary:
+    """ Vocabulary kept in an entity_to_idx.gzip or relation_to_idx.gzip parquet file whose rows are in the order of
+    indexes. Only the number of labels is kept in memory, labels are read from the file on demand.
+    """
+
+    def __init__(self, path: str, name: str = 'entity'):
+        assert os.path.isfile(path)
+        self.path = path
+        self.name = name
+        self.num_labels = pq.ParquetFile(path).metadata.num_rows
+
+    def __len__(self):
+        return self.num_labels
+
+    def keys(self) -> List[str]:
+        """ Labels in the order of indexes """
+        return pq.read_table(self.path, columns=['__index_level_0__']).column(0).to_pylist()
@@ -55,6 +55,8 @@ def run(args: dict):
     # (1) Train a knowledge graph embedding model
     # (2) Give the path of serialized (1)
     pre_trained_kge = KGE(path_of_pretrained_model_dir=args['path_of_experiment_folder'])
+    # (3) Fold dropout and normalization into embedding tables as the model is only queried.
+    pre_trained_kge.export_for_inference()
     print(f'Done!\n')
     launch_kge(args, pre_trained_kge)
 
@@ -0,0 +1,105 @@
+""" A microbenchmark for KvsAll scoring of QMult and OMult:
+(1) Multiple matrix multiplications with transposed hsplit views of entity embeddings and elementwise
+hypercomplex multiplication (previous implementation)
+(2) Hypercomplex multiplication with structure constants yielding a single query and a single matrix multiplication
+"""
+import time
+import argparse
+import torch
+from main import argparse_default
+from core.static_funcs import intialize_model
+from core.models.static_funcs import quaternion_mul, octonion_mul
+
+
+def multi_gemm_k_vs_all(model, x: torch.LongTensor) -> torch.FloatTensor:
+    head_ent_emb, rel_ent_emb = model.get_head_relation_representation(x)
+    num_components = 4 if model.args['model'] == 'QMult' else 8
+    if num_components == 4:
+        parts = quaternion_mul(Q_1=torch.hsplit(head_ent_emb, 4), Q_2=torch.hsplit(rel_ent_emb, 4))
+    else:
+        parts = octonion_mul(O_1=torch.hsplit(head_ent_emb, 8), O_2=torch.hsplit(rel_ent_emb, 8))
+    emb_tails = [i.transpose(1, 0) for i in torch.hsplit(model.entity_embeddings.weight, num_components)]
+    return sum(torch.mm(part, emb_tail) for part, emb_tail in zip(parts, emb_tails))
+
+
+def single_gemm_k_vs_all(model, x: torch.LongTensor) -> torch.FloatTensor:
+    return model.forward_k_vs_all(x)
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start_time) / repeat * 1000
+
+
+def run(model_name: str, num_entities: int, embedding_dim: int, batch_size: int, repeat: int):
+    args = argparse_default([])
+    args.model = model_name
+    args.num_entities = num_entities
+    args.num_relations = 100
+    args.embedding_dim = embedding_dim
+    args.scoring_technique = 'KvsAll'
+    args.normalization = 'LayerNorm'
+    model, _ = intialize_model(vars(args))
+    x = torch.stack((torch.randint(0, num_entities, (batch_size,)), torch.randint(0, 100, (batch_size,))), dim=1)
+    assert torch.allclose(multi_gemm_k_vs_all(model, x), single_gemm_k_vs_all(model, x), atol=1e-4)
+    for name, fn in [('multi-GEMM', multi_gemm_k_vs_all), ('single-GEMM', single_gemm_k_vs_all)]:
+        with torch.no_grad():
+            inference = timeit(lambda: fn(model, x), repeat)
+        training = timeit(lambda: fn(model, x).sum().backward(), repeat)
+        print(f'{model_name}\t|E|:{num_entities}\td:{embedding_dim}\tB:{batch_size}\t{name}:\t'
+              f'Inference {inference:.3f} ms\tTraining {training:.3f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_entities", type=int, nargs='+', default=[1_000, 40_000])
+    parser.add_argument("--embedding_dim", type=int, nargs='+', default=[32, 256])
+    parser.add_argument("--batch_size", type=int, nargs='+', default=[1, 1024])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--num_threads", type=int, default=1)
+    benchmark_args = parser.parse_args()
+    torch.set_num_threads(benchmark_args.num_threads)
+    for model_name in ['QMult', 'OMult']:
+        for num_entities in benchmark_args.num_entities:
+            for embedding_dim in benchmark_args.embedding_dim:
+                for batch_size in benchmark_args.batch_size:
+                    run(model_name, num_entities, embedding_dim, batch_size, benchmark_args.repeat)
+
+"""
+# Single thread, PYTHONPATH=. python documents/SoftwareBenchmarks/hypercomplex_scoring_benchmark.py
+QMult	|E|:1000	d:32	B:1	multi-GEMM:	Inference 0.275 ms	Training 1.465 ms
+QMult	|E|:1000	d:32	B:1	single-GEMM:	Inference 0.192 ms	Training 0.774 ms
+QMult	|E|:1000	d:32	B:1024	multi-GEMM:	Inference 7.061 ms	Training 19.387 ms
+QMult	|E|:1000	d:32	B:1024	single-GEMM:	Inference 1.505 ms	Training 7.920 ms
+QMult	|E|:1000	d:256	B:1	multi-GEMM:	Inference 0.231 ms	Training 3.908 ms
+QMult	|E|:1000	d:256	B:1	single-GEMM:	Inference 0.186 ms	Training 1.479 ms
+QMult	|E|:1000	d:256	B:1024	multi-GEMM:	Inference 18.565 ms	Training 48.724 ms
+QMult	|E|:1000	d:256	B:1024	single-GEMM:	Inference 8.799 ms	Training 26.975 ms
+QMult	|E|:40000	d:32	B:1	multi-GEMM:	Inference 1.708 ms	Training 17.658 ms
+QMult	|E|:40000	d:32	B:1	single-GEMM:	Inference 0.707 ms	Training 8.442 ms
+QMult	|E|:40000	d:32	B:1024	multi-GEMM:	Inference 859.805 ms	Training 2035.694 ms
+QMult	|E|:40000	d:32	B:1024	single-GEMM:	Inference 141.986 ms	Training 502.546 ms
+QMult	|E|:40000	d:256	B:1	multi-GEMM:	Inference 14.253 ms	Training 259.679 ms
+QMult	|E|:40000	d:256	B:1	single-GEMM:	Inference 6.553 ms	Training 110.087 ms
+QMult	|E|:40000	d:256	B:1024	multi-GEMM:	Inference 1444.633 ms	Training 3023.746 ms
+QMult	|E|:40000	d:256	B:1024	single-GEMM:	Inference 326.787 ms	Training 1004.997 ms
+OMult	|E|:1000	d:32	B:1	multi-GEMM:	Inference 0.732 ms	Training 4.224 ms
+OMult	|E|:1000	d:32	B:1	single-GEMM:	Inference 0.148 ms	Training 0.725 ms
+OMult	|E|:1000	d:32	B:1024	multi-GEMM:	Inference 15.353 ms	Training 45.875 ms
+OMult	|E|:1000	d:32	B:1024	single-GEMM:	Inference 2.979 ms	Training 12.139 ms
+OMult	|E|:1000	d:256	B:1	multi-GEMM:	Inference 0.961 ms	Training 7.977 ms
+OMult	|E|:1000	d:256	B:1	single-GEMM:	Inference 0.401 ms	Training 1.778 ms
+OMult	|E|:1000	d:256	B:1024	multi-GEMM:	Inference 27.197 ms	Training 59.510 ms
+OMult	|E|:1000	d:256	B:1024	single-GEMM:	Inference 9.093 ms	Training 30.400 ms
+OMult	|E|:40000	d:32	B:1	multi-GEMM:	Inference 3.433 ms	Training 35.860 ms
+OMult	|E|:40000	d:32	B:1	single-GEMM:	Inference 0.833 ms	Training 7.450 ms
+OMult	|E|:40000	d:32	B:1024	multi-GEMM:	Inference 1826.843 ms	Training 3884.130 ms
+OMult	|E|:40000	d:32	B:1024	single-GEMM:	Inference 141.776 ms	Training 372.136 ms
+OMult	|E|:40000	d:256	B:1	multi-GEMM:	Inference 14.764 ms	Training 350.938 ms
+OMult	|E|:40000	d:256	B:1	single-GEMM:	Inference 5.820 ms	Training 89.880 ms
+OMult	|E|:40000	d:256	B:1024	multi-GEMM:	Inference 1844.228 ms	Training 4821.657 ms
+OMult	|E|:40000	d:256	B:1024	single-GEMM:	Inference 329.250 ms	Training 1145.367 ms
+"""
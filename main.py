@@ -21,7 +21,7 @@ def argparse_default(description=None):
                         help="Available models: ConEx, ConvQ, ConvO,  QMult, OMult, "
                              "Shallom, ConEx, ComplEx, DistMult")
     parser.add_argument('--optim', type=str, default='Adam',
-                        help='[Adan,NAdam, Adam, SGD, Sls, AdamSLS]')
+                        help='[Adan,NAdam, Adam, Adagrad, SGD, Sls, AdamSLS]')
     parser.add_argument('--embedding_dim', type=int, default=100,help='Number of dimensions for an embedding vector. ')
     parser.add_argument("--num_epochs", type=int, default=100, help='Number of epochs for training. ')
     parser.add_argument('--batch_size', type=int, default=1024, help='Mini batch size')
@@ -44,18 +44,42 @@ def argparse_default(description=None):
     parser.add_argument("--eval", type=str, default='train_val_test',
                         help='train, val, test, constraint, combine them anyway you want, e.g. '
                              'train_val,train_val_test, val_test, val_test_constraint ')
+    parser.add_argument("--eval_batch_size", type=int, default=None,
+                        help='Number of test triples ranked together. If None, batch_size is used.')
+    parser.add_argument("--eval_memory_budget", type=int, default=1024,
+                        help='Memory ceiling in MB for scores computed at once during evaluation. '
+                             'If 0, all entities are scored for all triples of a batch at once.')
     # Additional training params
     parser.add_argument("--save_model_at_every_epoch", type=int, default=None,
                         help='At every X number of epochs model will be saved. If None, we save 4 times.')
     parser.add_argument("--label_smoothing_rate", type=float, default=None, help='None for not using it.')
     parser.add_argument("--label_relaxation_rate", type=float, default=None, help='None for not using it.')
+    parser.add_argument("--k_vs_all_block_size", type=int, default=None,
+                        help='Number of entities scored at once in KvsAll and 1vsAll training. '
+                             'If None, all entities are scored at once.')
+    parser.add_argument("--sparse_gradients", type=bool, default=False,
+                        help='Compute sparse gradients of entity and relation embeddings and update only rows of '
+                             'a batch with Adam, Adan, Adagrad or SGD. Only for NegSample.')
+    parser.add_argument("--build_ann_index", type=bool, default=False,
+                        help='Build approximate nearest neighbour indexes over entity embeddings after training '
+                             'for top-k entity prediction of DistMult, ComplEx, QMult and OMult.')
+    parser.add_argument("--ann_num_lists", type=int, default=None,
+                        help='Number of inverted lists of the index. If None, 4 * sqrt(number of entities).')
+    parser.add_argument("--ann_num_probes", type=int, default=None,
+                        help='Number of inverted lists scanned per query. If None, max(8, ann_num_lists / 64).')
+    parser.add_argument("--report_worker_memory", type=bool, default=False,
+                        help='Print RSS, PSS and USS of each DataLoader worker when it exits.')
     parser.add_argument("--add_noise_rate", type=float, default=None, help='None for not using it. '
                                                                            '.1 means extend train data by adding 10% random data')
     parser.add_argument("--backend", type=str, default='pandas',
-                        help='Select [modin, pandas, vaex, polars]')
+                        help='Select [modin, pandas, vaex, polars, pyarrow]')
 
     parser.add_argument("--torch_trainer", type=str, default='DataParallelTrainer',
-                        help='None, DistributedDataParallelTrainer or DataParallelTrainer')
+                        help='None, DistributedDataParallelTrainer, HogwildTrainer, PartitionedTrainer or DataParallelTrainer')
+    parser.add_argument("--bf16_embeddings", type=bool, default=False,
+                        help='Store embeddings of the trained model in bfloat16. Requires --precision bf16')
+    parser.add_argument("--num_entity_partitions", type=int, default=4,
+                        help='Number of partitions of entity embeddings in PartitionedTrainer')
     parser.add_argument("--kernel_size", type=int, default=3, help="Square kernel size for ConEx")
     parser.add_argument("--num_of_output_channels", type=int, default=3, help="# of output channels in convolution")
 
@@ -69,6 +93,9 @@ def argparse_default(description=None):
     parser.add_argument("--read_only_few", type=int, default=None, help='READ only first N triples. If 0, read all.')
     parser.add_argument("--min_freq_for_vocab", type=int, default=None,
                         help='Min number of triples for a vocab term to be considered')
+    parser.add_argument("--preprocessing_memory_budget", type=int, default=None,
+                        help='Memory budget in MB for indexing input data out-of-core in chunks. '
+                             'If None, input data is read into memory.')
 
     if description is None:
         return parser.parse_args()
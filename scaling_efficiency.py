@@ -0,0 +1,33 @@
+""" Scaling efficiency of DistributedDataParallelTrainer and HogwildTrainer on CPUs
+
+python scaling_efficiency.py --path_dataset_folder KGs/UMLS --model DistMult --scoring_technique KvsAll
+--num_epochs 10 --num_processes 4
+
+python scaling_efficiency.py --path_dataset_folder KGs/UMLS --model DistMult --scoring_technique NegSample
+--sparse_gradients True --optim Adagrad --torch_trainer HogwildTrainer --num_epochs 10 --num_processes 4
+
+trains the same configuration with 1, 2, 4 processes and reports samples per second and the efficiency,
+i.e., the speedup in samples (triples for HogwildTrainer) per second over a single process divided by the number of processes.
+"""
+import copy
+import json
+from main import argparse_default
+from core.executer import Execute
+from core.trainers import scaling_efficiency
+
+if __name__ == '__main__':
+    args = argparse_default()
+    if args.torch_trainer != 'HogwildTrainer':
+        args.torch_trainer = 'DistributedDataParallelTrainer'
+    max_num_processes = args.num_processes or 1
+    samples_per_second = dict()
+    num_processes = 1
+    while num_processes <= max_num_processes:
+        args.num_processes = num_processes
+        # Execute modifies its arguments.
+        report = Execute(copy.deepcopy(args)).start()
+        samples_per_second[num_processes] = report['SamplesPerSecond']
+        num_processes *= 2
+    efficiency = scaling_efficiency(samples_per_second)
+    print(json.dumps({n: {'SamplesPerSecond': samples_per_second[n], 'Efficiency': efficiency[n]}
+                      for n in samples_per_second}, indent=4))
@@ -0,0 +1,46 @@
+from main import argparse_default
+from core.executer import Execute
+from core.ann_index import IVFPQIndex
+from core import KGE
+import torch
+import pytest
+
+
+class TestANNIndex:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_ivfpq_search(self, tmp_path):
+        torch.manual_seed(1)
+        embeddings = torch.randn(2000, 16)
+        index = IVFPQIndex.build(embeddings, num_lists=32, num_probes=4)
+        queries = torch.randn(20, 16)
+        # Scanning all lists with exact rescoring retrieves the exact top k.
+        assert index.recall_at_k(queries, embeddings, k=10, num_probes=32) == 1.0
+        assert index.recall_at_k(queries, embeddings, k=10) >= 0.5
+        index.save(str(tmp_path / 'index'))
+        loaded = IVFPQIndex.load(str(tmp_path / 'index'))
+        assert loaded.num_probes == 4 and len(loaded) == 2000
+        for a, b in zip(index.search(queries, 5), loaded.search(queries, 5)):
+            assert torch.equal(a, b)
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_predict_topk_with_index(self):
+        args = argparse_default([])
+        args.model = 'ComplEx'
+        args.scoring_technique = 'KvsAll'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 1
+        args.embedding_dim = 32
+        args.build_ann_index = True
+        args.ann_num_lists = 8
+        result = Execute(args).start()
+        assert result['ANN']['tail_entity_index']['num_lists'] == 8
+        assert 0 <= result['ANN']['head_entity_index']['Recall@10'] <= 1
+        exact_kge = KGE(path_of_pretrained_model_dir=result['path_experiment_folder'], use_ann_index=False)
+        kge = KGE(path_of_pretrained_model_dir=result['path_experiment_folder'], ann_num_probes=8)
+        assert kge.inference_engine.tail_entity_index is not None
+        head, relation, tail = exact_kge.sample_entity(1), exact_kge.sample_relation(1), exact_kge.sample_entity(1)
+        for kwargs in [dict(head_entity=head, relation=relation), dict(relation=relation, tail_entity=tail)]:
+            exact_scores, exact_entities = exact_kge.predict_topk(**kwargs, k=5)
+            scores, entities = kge.predict_topk(**kwargs, k=5)
+            assert torch.allclose(scores, exact_scores, atol=1e-5)
+            assert entities.tolist() == exact_entities.tolist()
@@ -0,0 +1,21 @@
+from core.knowledge_graph import KG
+from core.dataset_classes import TriplePredictionDataset
+import torch
+import pytest
+
+
+class TestBatchIndexSampler:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_batches_cover_all_triples_once(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', path_for_serialization=str(tmp_path))
+        neg_sample_ratio = 2
+        dataset = TriplePredictionDataset(kg.train_set, num_entities=kg.num_entities,
+                                          num_relations=kg.num_relations, neg_sample_ratio=neg_sample_ratio)
+        positives = []
+        for x, y in dataset.batch_loader(batch_size=100, shuffle=True):
+            batch_size = len(x) // (1 + 3 * neg_sample_ratio)
+            assert x.shape == (batch_size * (1 + 3 * neg_sample_ratio), 3) and x.dtype == torch.long
+            assert y.shape == (len(x),)
+            positives.append(x[:batch_size])
+        positives = torch.cat(positives)
+        assert sorted(positives.tolist()) == sorted(torch.LongTensor(kg.train_set).tolist())
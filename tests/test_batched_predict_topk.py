@@ -0,0 +1,38 @@
+from main import argparse_default
+from core.executer import Execute
+from core import KGE
+import torch
+import pytest
+
+
+class TestBatchedPredictTopk:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_batched_equals_single_queries(self):
+        for model_name, scoring_technique in [('DistMult', 'KvsAll'), ('ConvQ', 'KvsAll'), ('TransE', 'NegSample')]:
+            args = argparse_default([])
+            args.model = model_name
+            args.scoring_technique = scoring_technique
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.num_epochs = 1
+            args.embedding_dim = 16
+            result = Execute(args).start()
+            kge = KGE(path_of_pretrained_model_dir=result['path_experiment_folder'])
+            # A small chunk size to score queries over several chunks.
+            kge.max_scores_per_chunk = 2 * kge.num_entities
+            if kge.inference_engine is not None:
+                kge.inference_engine.max_scores_per_chunk = 2 * kge.num_entities
+            heads, relations, tails = kge.sample_entity(5), kge.sample_relation(5), kge.sample_entity(5)
+            for kwargs in [dict(head_entity=heads, relation=relations), dict(relation=relations, tail_entity=tails),
+                           dict(head_entity=heads, tail_entity=tails)]:
+                scores, candidates = kge.predict_topk(**kwargs, k=3)
+                assert scores.shape == (5, 3) and candidates.shape == (5, 3)
+                for i in range(5):
+                    single_scores, single_candidates = kge.predict_topk(
+                        **{key: [value[i]] for key, value in kwargs.items()}, k=3)
+                    assert single_scores.shape == (3,)
+                    assert torch.allclose(scores[i], single_scores, atol=1e-5)
+                    assert candidates[i].tolist() == single_candidates.tolist()
+            # An item given once is used in all queries.
+            scores, candidates = kge.predict_topk(head_entity=heads[:1], relation=relations, k=3)
+            assert torch.allclose(scores[4], kge.predict_topk(head_entity=heads[:1], relation=relations[4:], k=3)[0],
+                                  atol=1e-5)
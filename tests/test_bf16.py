@@ -0,0 +1,51 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import load_model
+import torch
+import pytest
+
+
+def train(model, scoring_technique, path_dataset_folder, precision, **kwargs):
+    args = argparse_default([])
+    args.model = model
+    args.scoring_technique = scoring_technique
+    args.path_dataset_folder = path_dataset_folder
+    args.num_epochs = 10
+    args.embedding_dim = 32
+    args.precision = precision
+    args.eval = 'test'
+    for key, value in kwargs.items():
+        setattr(args, key, value)
+    return Execute(args).start()
+
+
+class TestBFloat16:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_mrr_within_tolerance_of_fp32(self):
+        for model, scoring_technique, path_dataset_folder, kwargs in [
+            ('DistMult', 'KvsAll', 'KGs/UMLS', dict()),
+            ('QMult', 'KvsAll', 'KGs/Family', dict(k_vs_all_block_size=16)),
+            ('ConEx', 'KvsAll', 'KGs/UMLS', dict()),
+            ('ComplEx', 'NegSample', 'KGs/UMLS', dict())]:
+            fp32 = train(model, scoring_technique, path_dataset_folder, 32, **kwargs)
+            bf16 = train(model, scoring_technique, path_dataset_folder, 'bf16', **kwargs)
+            assert abs(fp32['Test']['MRR'] - bf16['Test']['MRR']) <= 0.03
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_bf16_embeddings(self):
+        for model, scoring_technique, kwargs in [('DistMult', 'KvsAll', dict(build_ann_index=True)),
+                                                 ('QMult', 'KvsAll', dict(k_vs_all_block_size=16))]:
+            fp32 = train(model, scoring_technique, 'KGs/UMLS', 32, **kwargs)
+            bf16 = train(model, scoring_technique, 'KGs/UMLS', 'bf16', bf16_embeddings=True, **kwargs)
+            assert abs(fp32['Test']['MRR'] - bf16['Test']['MRR']) <= 0.03
+        fp32 = train('TransE', 'NegSample', 'KGs/UMLS', 32)
+        bf16 = train('TransE', 'NegSample', 'KGs/UMLS', 'bf16', bf16_embeddings=True)
+        assert abs(fp32['Test']['MRR'] - bf16['Test']['MRR']) <= 0.03
+        weights = torch.load(bf16['path_experiment_folder'] + '/model.pt')
+        assert weights['entity_embeddings.weight'].dtype == torch.bfloat16
+        assert weights['relation_embeddings.weight'].dtype == torch.bfloat16
+        # Models loaded for inference are float32.
+        model, _, _ = load_model(bf16['path_experiment_folder'])
+        assert model.entity_embeddings.weight.dtype == torch.float32
+        with pytest.raises(ValueError):
+            train('TransE', 'NegSample', 'KGs/UMLS', 32, bf16_embeddings=True)
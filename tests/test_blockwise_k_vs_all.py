@@ -0,0 +1,41 @@
+from main import argparse_default
+from core.static_funcs import intialize_model
+from core.dataset_classes import SparseTargets
+import torch
+import pytest
+
+
+class TestBlockwiseKvsAll:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_blockwise_scores_loss_and_topk(self):
+        args = argparse_default([])
+        args.embedding_dim = 16
+        args.num_entities = 50
+        args.num_relations = 5
+        args.scoring_technique = 'KvsAll'
+        args.label_smoothing_rate = 0.1
+        x = torch.stack((torch.randint(0, 50, (8,)), torch.randint(0, 5, (8,))), dim=1)
+        y = SparseTargets.from_positives([torch.randperm(50)[:i + 1] for i in range(8)], target_dim=50,
+                                         label_smoothing_rate=0.1)
+        for model_name in ['DistMult', 'ComplEx', 'QMult', 'OMult', 'ConEx', 'ConvQ', 'ConvO']:
+            args.model = model_name
+            args.k_vs_all_block_size = 7
+            model, _ = intialize_model(vars(args))
+            model.eval()
+            scores = model.forward_k_vs_all(x)
+            # (1) Scores of blocks.
+            assert torch.allclose(torch.cat([block for _, block in model.k_vs_all_score_blocks(x)], dim=1), scores,
+                                  atol=1e-6)
+            # (2) Running top k.
+            top_scores, top_idx = model.forward_k_vs_all_topk(x, k=10)
+            assert torch.allclose(top_scores, torch.topk(scores, k=10).values, atol=1e-6)
+            assert torch.allclose(torch.gather(scores, 1, top_idx), top_scores, atol=1e-6)
+            # (3) Loss and gradients reduced over blocks.
+            blockwise_loss = model.batch_loss(x, y)
+            blockwise_grads = torch.autograd.grad(blockwise_loss, model.entity_embeddings.weight)
+            model.k_vs_all_block_size = None
+            loss = model.batch_loss(x, y)
+            grads = torch.autograd.grad(loss, model.entity_embeddings.weight)
+            assert torch.isclose(blockwise_loss, loss)
+            assert torch.allclose(blockwise_grads[0], grads[0], atol=1e-7)
+            assert torch.isclose(loss, torch.nn.BCEWithLogitsLoss()(scores, y.to_dense()))
@@ -1,5 +1,7 @@
 from main import argparse_default
 from core.executer import Execute
+from core.knowledge_graph import KG, FILTER_INDICES
+import numpy as np
 import sys
 import pytest
 
@@ -11,3 +13,80 @@ class TestPolyak:
         args.path_dataset_folder = 'KGs/UMLS'
         args.backend = 'pandas'
         Execute(args).start()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_pyarrow_as_backend(self):
+        args = argparse_default([])
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.backend = 'pyarrow'
+        Execute(args).start()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_pyarrow_and_pandas_backends_index_same_triples(self):
+        kgs = []
+        for backend in ['pandas', 'pyarrow']:
+            args = argparse_default([])
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.backend = backend
+            args.num_epochs = 1
+            result = Execute(args).start()
+            kgs.append(KG(deserialize_flag=result['path_experiment_folder']))
+        for split in ['train_set', 'valid_set', 'test_set']:
+            decoded = []
+            for kg in kgs:
+                idx_to_entity = {v: k for k, v in kg.entity_to_idx.items()}
+                idx_to_relation = {v: k for k, v in kg.relation_to_idx.items()}
+                decoded.append(sorted((idx_to_entity[h], idx_to_relation[r], idx_to_entity[t])
+                                      for h, r, t in getattr(kg, split).tolist()))
+            assert decoded[0] == decoded[1]
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_pyarrow_and_pandas_backends_split_whitespace_runs(self, tmp_path):
+        (tmp_path / 'KG').mkdir()
+        (tmp_path / 'KG' / 'train.txt').write_text('a  r1   b\n  c\t r2\tb \nd r1\t\te\n')
+        decoded = []
+        for backend in ['pandas', 'pyarrow']:
+            (tmp_path / backend).mkdir()
+            kg = KG(data_dir=str(tmp_path / 'KG'), backend=backend, path_for_serialization=str(tmp_path / backend))
+            idx_to_entity = {v: k for k, v in kg.entity_to_idx.items()}
+            idx_to_relation = {v: k for k, v in kg.relation_to_idx.items()}
+            decoded.append(sorted((idx_to_entity[h], idx_to_relation[r], idx_to_entity[t])
+                                  for h, r, t in kg.train_set.tolist()))
+        assert decoded[0] == decoded[1] == [('a', 'r1', 'b'), ('c', 'r2', 'b'), ('d', 'r1', 'e')]
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_out_of_core_and_pandas_index_same_triples(self):
+        kgs = []
+        for memory_budget in [None, 1]:
+            args = argparse_default([])
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.preprocessing_memory_budget = memory_budget
+            args.min_freq_for_vocab = 5
+            args.num_epochs = 1
+            result = Execute(args).start()
+            kgs.append(KG(deserialize_flag=result['path_experiment_folder']))
+        for split in ['train_set', 'valid_set', 'test_set']:
+            decoded = []
+            for kg in kgs:
+                idx_to_entity = {v: k for k, v in kg.entity_to_idx.items()}
+                idx_to_relation = {v: k for k, v in kg.relation_to_idx.items()}
+                decoded.append(sorted((idx_to_entity[h], idx_to_relation[r], idx_to_entity[t])
+                                      for h, r, t in getattr(kg, split).tolist()))
+            assert decoded[0] == decoded[1]
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_out_of_core_filter_indices(self):
+        args = argparse_default([])
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.preprocessing_memory_budget = 1
+        args.num_epochs = 1
+        result = Execute(args).start()
+        kg = KG(deserialize_flag=result['path_experiment_folder'], eval_model=True)
+        # Indices constructed from memory-mapped splits in chunks.
+        out_of_core = {name: getattr(kg, name) for name in FILTER_INDICES}
+        kg.construct_filter_indices()
+        for name in FILTER_INDICES:
+            expected = getattr(kg, name)
+            assert np.array_equal(out_of_core[name].keys(), expected.keys())
+            assert np.array_equal(out_of_core[name].offsets, expected.offsets)
+            assert np.array_equal(out_of_core[name].values, expected.values)
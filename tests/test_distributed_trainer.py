@@ -0,0 +1,43 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import intialize_model
+from core.dataset_classes import TriplePredictionDataset
+from core.trainers import DistributedDataParallelTrainer, scaling_efficiency
+import torch
+import pytest
+
+
+class TestDistributedDataParallelTrainer:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_parameters_are_trained_in_place(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'NegSample'
+        args.num_entities, args.num_relations, args.embedding_dim = 50, 5, 8
+        args.max_epochs, args.batch_size, args.num_processes = 2, 16, 2
+        model, _ = intialize_model(vars(args))
+        triples = torch.stack((torch.randint(0, 50, (64,)), torch.randint(0, 5, (64,)),
+                               torch.randint(0, 50, (64,))), dim=1)
+        dataset = TriplePredictionDataset(triples, num_entities=50, num_relations=5)
+        initial_weights = model.entity_embeddings.weight.detach().clone()
+        trainer = DistributedDataParallelTrainer(args, callbacks=[])
+        trainer.fit(model, train_dataloaders=torch.utils.data.DataLoader(dataset))
+        assert not torch.equal(initial_weights, model.entity_embeddings.weight)
+        assert trainer.report['NumProcesses'] == 2 and trainer.report['SamplesPerSecond'] > 0
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_kvsall(self):
+        args = argparse_default([])
+        args.model = 'ComplEx'
+        args.scoring_technique = 'KvsAll'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 2
+        args.optim = 'Adam'
+        args.k_vs_all_block_size = 16
+        args.torch_trainer = 'DistributedDataParallelTrainer'
+        args.num_processes = 2
+        result = Execute(args).start()
+        assert result['NumProcesses'] == 2
+        assert 0 <= result['Test']['MRR'] <= 1
+        efficiency = scaling_efficiency({1: 100.0, 2: 150.0, 4: 200.0})
+        assert efficiency == {1: 1.0, 2: 0.75, 4: 0.5}
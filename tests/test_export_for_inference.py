@@ -0,0 +1,33 @@
+from main import argparse_default
+from core.static_funcs import intialize_model
+import torch
+import pytest
+
+
+class TestExportForInference:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_exported_model_scores_equal(self):
+        for model_name in ['DistMult', 'ComplEx', 'QMult', 'ConvO']:
+            for scoring_technique, normalization in [('NegSample', 'LayerNorm'), ('NegSample', 'BatchNorm1d'),
+                                                     ('KvsAll', 'LayerNorm'), ('KvsAll', 'BatchNorm1d')]:
+                args = argparse_default([])
+                args.model = model_name
+                args.scoring_technique = scoring_technique
+                args.normalization = normalization
+                args.input_dropout_rate = 0.2
+                args.num_entities, args.num_relations, args.embedding_dim = 50, 5, 16
+                model, _ = intialize_model(vars(args))
+                # Populate running statistics of normalizers.
+                model(torch.randint(0, 5, (32, 3)))
+                model.eval()
+                exported = model.export_for_inference()
+                x = torch.stack((torch.randint(0, 50, (20,)), torch.randint(0, 5, (20,)),
+                                 torch.randint(0, 50, (20,))), dim=1)
+                with torch.no_grad():
+                    assert torch.allclose(model(x), exported(x), atol=1e-5)
+                    assert torch.allclose(model(x[:, :2]), exported(x[:, :2]), atol=1e-5)
+                assert not exported.training
+                assert not any(parameter.requires_grad for parameter in exported.parameters())
+                # Parameters of the model are not altered and entity embeddings are not copied.
+                assert model.entity_embeddings.weight.requires_grad and model.head_entity_embeddings is None
+                assert exported.entity_embeddings.weight.data_ptr() == model.entity_embeddings.weight.data_ptr()
@@ -0,0 +1,58 @@
+from main import argparse_default
+from core.executer import Execute
+from core.knowledge_graph import KG
+from core.static_funcs import get_er_vocab
+from core.filter_index import FilterIndex
+import numpy as np
+import pandas as pd
+import pytest
+
+
+class TestFilterIndex:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_lookups_on_umls(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', eval_model='train_val_test', path_for_serialization=str(tmp_path))
+        data = np.concatenate([kg.train_set, kg.valid_set, kg.test_set])
+        for (h, r, t) in data[:100]:
+            assert sorted(set(data[(data[:, 0] == h) & (data[:, 1] == r)][:, 2])) == kg.er_vocab[(h, r)].tolist()
+            assert sorted(set(data[(data[:, 1] == r) & (data[:, 2] == t)][:, 0])) == kg.re_vocab[(r, t)].tolist()
+            assert sorted(set(data[(data[:, 0] == h) & (data[:, 2] == t)][:, 1])) == kg.ee_vocab[(h, t)].tolist()
+        # Batched lookups
+        rows, cols = kg.er_vocab.coordinates(data[:100, [0, 1]])
+        padded = kg.er_vocab.padded(data[:100, [0, 1]])
+        for i, (h, r, t) in enumerate(data[:100]):
+            assert cols[rows == i].tolist() == kg.er_vocab[(h, r)].tolist()
+            assert padded[i][padded[i] >= 0].tolist() == kg.er_vocab[(h, r)].tolist()
+        # Unseen key
+        assert len(kg.er_vocab[(kg.num_entities, 0)]) == 0
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_save_and_memory_map(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', eval_model='train_val_test', path_for_serialization=str(tmp_path))
+        kg.er_vocab.save(str(tmp_path / 'er_vocab'))
+        er_vocab = FilterIndex.load(str(tmp_path / 'er_vocab'), mmap_mode='r')
+        assert isinstance(er_vocab.values, np.memmap)
+        assert len(er_vocab) == len(kg.er_vocab)
+        for (h, r, _) in kg.train_set[:100]:
+            assert er_vocab[(h, r)].tolist() == kg.er_vocab[(h, r)].tolist()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_reload_serialized_indices(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'NegSample'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 1
+        args.batch_size = 1024
+        args.embedding_dim = 32
+        args.eval = 'train_val_test'
+        args.torch_trainer = 'DataParallelTrainer'
+        result = Execute(args).start()
+        kg = KG(deserialize_flag=result['path_experiment_folder'], eval_model='train_val_test')
+        assert isinstance(kg.er_vocab.values, np.memmap)
+        assert isinstance(kg.range_constraints_per_rel.values, np.memmap)
+        data = np.concatenate([kg.train_set, kg.valid_set, kg.test_set])
+        assert kg.er_vocab.keys().tolist() == get_er_vocab(data).keys().tolist()
+        # Indexed splits are memory-mapped from int32 .npy files.
+        assert isinstance(kg.train_set, np.memmap) and kg.train_set.dtype == np.int32
+        assert (kg.train_set == pd.read_parquet(result['path_experiment_folder'] + '/idx_train_df.gzip').values).all()
@@ -0,0 +1,48 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import intialize_model
+from core.dataset_classes import TriplePredictionDataset
+from core.trainers import HogwildTrainer
+import torch
+import pytest
+
+
+class TestHogwildTrainer:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_parameters_are_trained_in_place(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'NegSample'
+        args.num_entities, args.num_relations, args.embedding_dim = 50, 5, 8
+        args.max_epochs, args.batch_size, args.num_processes = 2, 16, 2
+        args.optim, args.sparse_gradients = 'Adagrad', True
+        model, _ = intialize_model(vars(args))
+        triples = torch.stack((torch.randint(0, 50, (64,)), torch.randint(0, 5, (64,)),
+                               torch.randint(0, 50, (64,))), dim=1)
+        dataset = TriplePredictionDataset(triples, num_entities=50, num_relations=5)
+        initial_weights = model.entity_embeddings.weight.detach().clone()
+        trainer = HogwildTrainer(args, callbacks=[])
+        trainer.fit(model, train_dataloaders=torch.utils.data.DataLoader(dataset))
+        assert not torch.equal(initial_weights, model.entity_embeddings.weight)
+        assert trainer.report['NumProcesses'] == 2 and trainer.report['SamplesPerSecond'] > 0
+        # Dense gradients or stateful optimizers are not supported.
+        args.optim = 'Adam'
+        model, _ = intialize_model(vars(args))
+        with pytest.raises(ValueError):
+            trainer.fit(model, train_dataloaders=torch.utils.data.DataLoader(dataset))
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_negative_sampling(self):
+        for optim in ['SGD', 'Adagrad']:
+            args = argparse_default([])
+            args.model = 'QMult'
+            args.scoring_technique = 'NegSample'
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.num_epochs = 2
+            args.optim = optim
+            args.sparse_gradients = True
+            args.torch_trainer = 'HogwildTrainer'
+            args.num_processes = 2
+            result = Execute(args).start()
+            assert result['NumProcesses'] == 2 and result['SamplesPerSecond'] > 0
+            assert 0 <= result['Test']['MRR'] <= 1
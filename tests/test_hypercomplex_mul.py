@@ -0,0 +1,17 @@
+from core.models.static_funcs import quaternion_mul, octonion_mul, hypercomplex_mul, \
+    QUATERNION_STRUCTURE_CONSTANTS, OCTONION_STRUCTURE_CONSTANTS
+import torch
+import pytest
+
+
+class TestHypercomplexMul:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_structure_constants_equal_elementwise_multiplication(self):
+        for constants, mul in [(QUATERNION_STRUCTURE_CONSTANTS, lambda x, y: quaternion_mul(Q_1=x, Q_2=y)),
+                               (OCTONION_STRUCTURE_CONSTANTS, lambda x, y: octonion_mul(O_1=x, O_2=y))]:
+            dim = len(constants)
+            x = torch.randn(5, dim * 3, dtype=torch.float64, requires_grad=True)
+            y = torch.randn(5, dim * 3, dtype=torch.float64, requires_grad=True)
+            assert torch.allclose(hypercomplex_mul(x, y, constants),
+                                  torch.cat(mul(torch.hsplit(x, dim), torch.hsplit(y, dim)), dim=1))
+            assert torch.autograd.gradcheck(lambda a, b: hypercomplex_mul(a, b, constants), (x, y))
@@ -0,0 +1,44 @@
+from main import argparse_default
+from core.static_funcs import intialize_model
+from core.inference_engine import KvsAllInferenceEngine
+import torch
+import pytest
+
+
+class TestKvsAllInferenceEngine:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_topk_tails_equal_triple_scores(self):
+        for model_name in ['DistMult', 'ComplEx', 'QMult', 'OMult', 'ConvQ']:
+            for scoring_technique, normalization in [('NegSample', 'LayerNorm'), ('NegSample', 'BatchNorm1d'),
+                                                     ('KvsAll', 'LayerNorm')]:
+                args = argparse_default([])
+                args.model = model_name
+                args.scoring_technique = scoring_technique
+                args.normalization = normalization
+                args.num_entities, args.num_relations, args.embedding_dim = 100, 5, 16
+                model, _ = intialize_model(vars(args))
+                # Populate running statistics of normalizers.
+                model(torch.randint(0, 5, (32, 3)))
+                model.eval()
+                engine = KvsAllInferenceEngine(model)
+                x = torch.stack((torch.full((100,), 7), torch.full((100,), 3), torch.arange(100)), dim=1)
+                expected_scores, expected_idx = torch.topk(model(x), 10)
+                scores, idx = engine.predict_tail_topk(7, 3, k=10)
+                assert torch.allclose(scores, expected_scores, atol=1e-5)
+                assert idx.tolist() == expected_idx.tolist()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_query_cache_is_bounded(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.num_entities, args.num_relations = 100, 5
+        model, _ = intialize_model(vars(args))
+        engine = KvsAllInferenceEngine(model, cache_size=2)
+        for h, r in [(0, 0), (1, 0), (0, 0), (2, 0), (0, 0), (1, 0)]:
+            engine.predict_tail_topk(h, r, k=3)
+        # (1, 0) is evicted when (2, 0) is inserted as (0, 0) was used more recently.
+        assert (engine.hits, engine.misses) == (2, 4)
+        assert list(engine._queries) == [(0, 0), (1, 0)]
+        engine.clear()
+        assert len(engine._queries) == 0 and engine._entity_matrix is None
+        assert not KvsAllInferenceEngine.is_applicable(intialize_model(dict(vars(args), model='Shallom'))[0])
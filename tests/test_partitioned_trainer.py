@@ -0,0 +1,90 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import intialize_model, load_model
+from core.knowledge_graph_embeddings import KGE
+from core.dataset_classes import TriplePredictionDataset
+from core.trainers import PartitionedTrainer
+import numpy as np
+import torch
+import pytest
+
+
+class TestPartitionedTrainer:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_partitions_of_buckets(self, tmp_path):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'NegSample'
+        args.torch_trainer = 'PartitionedTrainer'
+        args.num_entities, args.num_relations, args.embedding_dim = 50, 5, 8
+        args.max_epochs, args.batch_size, args.num_entity_partitions = 2, 16, 4
+        args.optim, args.full_storage_path = 'Adagrad', str(tmp_path)
+        model, _ = intialize_model(vars(args))
+        # (1) Entity embeddings are not allocated.
+        assert model.entity_embeddings.weight.is_meta
+        triples = torch.stack((torch.randint(0, 50, (64,)), torch.randint(0, 5, (64,)),
+                               torch.randint(0, 50, (64,))), dim=1)
+        dataset = TriplePredictionDataset(triples, num_entities=50, num_relations=5)
+        initial_relations = model.relation_embeddings.weight.detach().clone()
+        trainer = PartitionedTrainer(args, callbacks=[])
+        trainer.fit(model, train_dataloaders=torch.utils.data.DataLoader(dataset))
+        # (2) Entity embeddings are read from the memory-mapped file.
+        assert model.entity_embeddings.weight.shape == (50, 8)
+        assert np.array_equal(np.load(tmp_path / 'entity_embeddings.npy'), model.entity_embeddings.weight.detach().numpy())
+        assert not torch.equal(initial_relations, model.relation_embeddings.weight)
+        # The optimizer of the model updates parameters other than entity embeddings.
+        assert {id(p) for group in model.selected_optimizer.param_groups for p in group['params']} == \
+               {id(p) for name, p in model.named_parameters() if name != 'entity_embeddings.weight'}
+        assert trainer.report['NumEntityPartitions'] == 4
+        assert trainer.report['MaxResidentEntities'] <= 2 * 13
+        # (3) Buckets are sorted by head and tail partitions.
+        bucket_triples, offsets = trainer.bucket_triples(triples)
+        assert offsets[-1] == 64
+        for bucket in range(16):
+            head_partition, tail_partition = divmod(bucket, 4)
+            for h, _, t in bucket_triples[offsets[bucket]:offsets[bucket + 1]].tolist():
+                assert trainer.bounds[head_partition] <= h < trainer.bounds[head_partition + 1]
+                assert trainer.bounds[tail_partition] <= t < trainer.bounds[tail_partition + 1]
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_negative_sampling(self):
+        for optim, sparse_gradients in [('SGD', True), ('Adagrad', True), ('Adagrad', False)]:
+            args = argparse_default([])
+            args.model = 'QMult'
+            args.scoring_technique = 'NegSample'
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.num_epochs = 2
+            args.optim = optim
+            args.sparse_gradients = sparse_gradients
+            args.torch_trainer = 'PartitionedTrainer'
+            args.num_entity_partitions = 3
+            args.eval = 'train_test'
+            result = Execute(args).start()
+            assert result['NumEntityPartitions'] == 3
+            assert 0 <= result['Test']['MRR'] <= 1
+
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_load_model(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'NegSample'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 2
+        args.optim = 'Adagrad'
+        args.torch_trainer = 'PartitionedTrainer'
+        args.eval = 'train_test'
+        result = Execute(args).start()
+        # (1) Entity embeddings of the saved model are allocated on load.
+        model, _, _ = load_model(result['path_experiment_folder'])
+        assert not model.entity_embeddings.weight.is_meta
+        assert np.array_equal(np.load(result['path_experiment_folder'] + '/entity_embeddings.npy'),
+                              model.entity_embeddings.weight.numpy())
+        # (2) The saved model is served.
+        kge = KGE(path_of_pretrained_model_dir=result['path_experiment_folder'])
+        heads, relations = kge.sample_entity(2), kge.sample_relation(2)
+        scores, candidates = kge.predict_topk(head_entity=heads, relation=relations, k=3)
+        assert torch.isfinite(scores).all()
+        triple_scores = kge.triple_score(head_entity=[heads[0]] * 3, relation=[relations[0]] * 3,
+                                         tail_entity=candidates[0].tolist())
+        assert torch.allclose(scores[0], triple_scores, atol=1e-5)
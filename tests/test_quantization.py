@@ -0,0 +1,72 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import intialize_model
+from core.inference_engine import KvsAllInferenceEngine
+from core.quantization import QuantizedEmbedding, quantize_entity_embeddings
+from core import KGE
+import torch
+import pytest
+
+
+class TestQuantization:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_quantized_embedding(self):
+        torch.manual_seed(1)
+        weight = torch.randn(100, 16)
+        weight[3] = 0.
+        weight[4] = 2.
+        quantized = QuantizedEmbedding.from_float(weight, block_size=32)
+        # (1) Dequantization error is at most half of the scale of a row.
+        error = (quantized.dequantize() - weight).abs().max(dim=1).values
+        assert torch.all(error <= quantized.scale / 2 + 1e-6)
+        assert torch.equal(quantized(torch.LongTensor([3, 4])), weight[[3, 4]])
+        assert quantized.nbytes < weight.nelement() * weight.element_size() / 2
+        # (2) Blockwise top k equals top k of dequantized embeddings.
+        queries = torch.randn(7, 16)
+        scores, idx = quantized.topk(queries, k=5, block_size=13)
+        expected_scores, expected_idx = torch.topk(torch.mm(queries, quantized.weight.transpose(1, 0)), 5)
+        assert torch.allclose(scores, expected_scores, atol=1e-4)
+        assert idx.tolist() == expected_idx.tolist()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_quantized_models(self):
+        for model_name, scoring_technique in [('DistMult', 'NegSample'), ('QMult', 'NegSample'), ('ComplEx', 'KvsAll'),
+                                              ('TransE', 'NegSample')]:
+            args = argparse_default([])
+            args.model = model_name
+            args.scoring_technique = scoring_technique
+            args.num_entities, args.num_relations, args.embedding_dim = 100, 5, 16
+            model, _ = intialize_model(vars(args))
+            model(torch.randint(0, 5, (32, 3)))
+            model.eval()
+            quantized_model = quantize_entity_embeddings(model)
+            x = torch.stack((torch.full((100,), 7), torch.full((100,), 3), torch.arange(100)), dim=1)
+            with torch.no_grad():
+                assert torch.allclose(quantized_model(x), model(x), atol=0.05)
+            if KvsAllInferenceEngine.is_applicable(quantized_model):
+                engine = KvsAllInferenceEngine(quantized_model)
+                assert isinstance(engine.entity_matrix, QuantizedEmbedding)
+                with torch.no_grad():
+                    expected_scores, expected_idx = torch.topk(quantized_model(x), 10)
+                scores, idx = engine.predict_tail_topk(7, 3, k=10)
+                assert torch.allclose(scores, expected_scores, atol=1e-4)
+                assert idx.tolist() == expected_idx.tolist()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_kge(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'KvsAll'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 10
+        args.embedding_dim = 64
+        result = Execute(args).start()
+        kge = KGE(path_of_pretrained_model_dir=result['path_experiment_folder'], quantize=True)
+        assert kge.quantization_report['MemorySaving'] > 0.7
+        assert kge.quantization_report['Top10Overlap'] > 0.8
+        heads, relations = kge.sample_entity(5), kge.sample_relation(5)
+        scores, candidates = kge.predict_topk(head_entity=heads, relation=relations, k=3)
+        for i in range(5):
+            triple_scores = kge.triple_score(head_entity=[heads[i]] * 3, relation=[relations[i]] * 3,
+                                             tail_entity=candidates[i].tolist())
+            assert torch.allclose(scores[i], triple_scores, atol=1e-4)
@@ -0,0 +1,48 @@
+from core.knowledge_graph import KG
+from core.dataset_classes import KvsAll, KvsSampleDataset, OnevsAllDataset, TriplePredictionDataset, worker_init_fn, \
+    StandardDataModule
+from torch.utils.data import DataLoader
+import torch
+import pytest
+
+
+class TestSharedMemoryDatasets:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_datasets_are_in_shared_memory(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', path_for_serialization=str(tmp_path))
+        datasets = [KvsAll(kg.train_set, entity_idxs=kg.entity_to_idx, relation_idxs=kg.relation_to_idx,
+                           form='EntityPrediction'),
+                    KvsSampleDataset(kg.train_set, entity_idxs=kg.entity_to_idx, relation_idxs=kg.relation_to_idx,
+                                     form='KvsSample', neg_sample_ratio=3),
+                    OnevsAllDataset(kg.train_set, entity_idxs=kg.entity_to_idx, relation_idxs=kg.relation_to_idx,
+                                    form='1VsAll'),
+                    TriplePredictionDataset(kg.train_set, num_entities=kg.num_entities,
+                                            num_relations=kg.num_relations)]
+        for dataset in datasets:
+            for tensor in vars(dataset).values():
+                if isinstance(tensor, torch.Tensor):
+                    assert tensor.is_shared()
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_kvsall_labels_with_workers(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', path_for_serialization=str(tmp_path))
+        dataset = KvsAll(kg.train_set, entity_idxs=kg.entity_to_idx, relation_idxs=kg.relation_to_idx,
+                         form='EntityPrediction')
+        num_labels = 0
+        for x, y in DataLoader(dataset, batch_size=256, num_workers=2, collate_fn=dataset.collate_fn,
+                               worker_init_fn=worker_init_fn):
+            assert x.dtype == torch.long
+            num_labels += int(y.to_dense().sum())
+        assert num_labels == len({(h, r, t) for h, r, t in kg.train_set.tolist()})
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_worker_memory_report_is_opt_in(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', path_for_serialization=str(tmp_path))
+        for form in ['EntityPrediction', 'NegativeSampling']:
+            for report_worker_memory in [False, True]:
+                data_module = StandardDataModule(train_set_idx=kg.train_set, entity_to_idx=kg.entity_to_idx,
+                                                 relation_to_idx=kg.relation_to_idx, batch_size=256, form=form,
+                                                 num_workers=1, neg_sample_ratio=1,
+                                                 report_worker_memory=report_worker_memory)
+                expected = worker_init_fn if report_worker_memory else None
+                assert data_module.train_dataloader().worker_init_fn is expected
@@ -0,0 +1,52 @@
+from main import argparse_default
+from core.executer import Execute
+from core.static_funcs import intialize_model
+from core.custom_opt import Adan, LazyAdam
+import torch
+import pytest
+
+
+class TestSparseGradients:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_lazy_updates_equal_dense_updates_on_touched_rows(self):
+        torch.manual_seed(1)
+        for optimizer_class, dense_optimizer_class in [(LazyAdam, torch.optim.Adam), (Adan, Adan)]:
+            sparse_embeddings, dense_embeddings = torch.nn.Embedding(10, 4, sparse=True), torch.nn.Embedding(10, 4)
+            dense_embeddings.weight.data.copy_(sparse_embeddings.weight.data)
+            sparse_optimizer = optimizer_class(sparse_embeddings.parameters(), lr=.1, weight_decay=.01)
+            dense_optimizer = dense_optimizer_class(dense_embeddings.parameters(), lr=.1, weight_decay=.01)
+            # (1) If all rows are referenced in every step, lazy updates are dense updates.
+            for _ in range(5):
+                idx, weights = torch.cat((torch.randperm(10), torch.randint(0, 10, (5,)))), torch.randn(15, 4)
+                for embeddings, optimizer in [(sparse_embeddings, sparse_optimizer),
+                                              (dense_embeddings, dense_optimizer)]:
+                    optimizer.zero_grad()
+                    (embeddings(idx) * weights).sum().backward()
+                    optimizer.step()
+            assert torch.allclose(sparse_embeddings.weight, dense_embeddings.weight, atol=1e-6)
+            # (2) Rows not referenced are not updated.
+            before = sparse_embeddings.weight.detach().clone()
+            sparse_optimizer.zero_grad()
+            sparse_embeddings(torch.LongTensor([2, 7])).sum().backward()
+            sparse_optimizer.step()
+            changed = (before != sparse_embeddings.weight).any(dim=1)
+            assert changed.nonzero().flatten().tolist() == [2, 7]
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_negative_sampling_with_sparse_gradients(self):
+        for optim in ['Adam', 'Adan', 'Adagrad', 'SGD']:
+            args = argparse_default([])
+            args.model = 'QMult'
+            args.scoring_technique = 'NegSample'
+            args.path_dataset_folder = 'KGs/UMLS'
+            args.num_epochs = 2
+            args.optim = optim
+            args.weight_decay = 0.01
+            args.sparse_gradients = True
+            result = Execute(args).start()
+            assert 0 <= result['Test']['MRR'] <= 1
+        args = argparse_default([])
+        args.model, args.scoring_technique, args.sparse_gradients = 'DistMult', 'KvsAll', True
+        args.num_entities, args.num_relations = 10, 2
+        with pytest.raises(ValueError):
+            intialize_model(vars(args))
@@ -0,0 +1,39 @@
+from core.knowledge_graph import KG
+from core.dataset_classes import KvsAll, OnevsAllDataset, SparseTargets
+from core.helper_classes import binary_cross_entropy_with_sparse_targets
+from torch.utils.data import DataLoader
+import torch
+import pytest
+
+
+class TestSparseTargets:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_sparse_bce_equals_dense_bce(self):
+        targets = SparseTargets.from_positives([torch.LongTensor([1, 3]), torch.LongTensor([0]),
+                                                torch.LongTensor([])], target_dim=5)
+        assert targets.shape == (3, 5)
+        assert targets.to_dense().tolist() == [[0, 1, 0, 1, 0], [1, 0, 0, 0, 0], [0, 0, 0, 0, 0]]
+        for label_smoothing_rate in [None, 0.1]:
+            targets.label_smoothing_rate = label_smoothing_rate
+            logits = torch.randn(3, 5, requires_grad=True)
+            sparse_loss = binary_cross_entropy_with_sparse_targets(logits, targets)
+            dense_loss = torch.nn.BCEWithLogitsLoss()(logits, targets.to_dense())
+            assert torch.isclose(sparse_loss, dense_loss)
+            sparse_grad, = torch.autograd.grad(sparse_loss, logits)
+            dense_grad, = torch.autograd.grad(dense_loss, logits)
+            assert torch.allclose(sparse_grad, dense_grad, atol=1e-7)
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_datasets_collate_positive_indices(self, tmp_path):
+        kg = KG(data_dir='KGs/UMLS', path_for_serialization=str(tmp_path))
+        for dataset in [KvsAll(kg.train_set, entity_idxs=kg.entity_to_idx, relation_idxs=kg.relation_to_idx,
+                               form='EntityPrediction', label_smoothing_rate=0.1),
+                        OnevsAllDataset(kg.train_set, entity_idxs=kg.entity_to_idx,
+                                        relation_idxs=kg.relation_to_idx, form='1VsAll')]:
+            triples = set()
+            for x, y in DataLoader(dataset, batch_size=128, collate_fn=dataset.collate_fn):
+                assert isinstance(y, SparseTargets) and y.shape == (len(x), kg.num_entities)
+                dense_y = y.to_dense()
+                for (h, r), row in zip(x.tolist(), (dense_y > dense_y.min(dim=1, keepdim=True).values).tolist()):
+                    triples.update((h, r, t) for t, label in enumerate(row) if label)
+            assert triples == {(h, r, t) for h, r, t in kg.train_set.tolist()}
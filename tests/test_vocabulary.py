@@ -0,0 +1,50 @@
+from main import argparse_default
+from core.executer import Execute
+from core.vocabulary import Vocabulary
+from core import KGE
+import numpy as np
+import pandas as pd
+import os
+import pytest
+
+
+class TestVocabulary:
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_encode_decode(self, tmp_path):
+        labels = ['http://b', 'a', 'Élysée', 'http://a/c', 'c']
+        vocabulary = Vocabulary.from_labels(labels)
+        assert vocabulary.encode(['c', 'a', 'Élysée']).tolist() == [4, 1, 2]
+        assert vocabulary.decode([[0, 3], [2, 4]]).tolist() == [['http://b', 'http://a/c'], ['Élysée', 'c']]
+        assert 'a' in vocabulary and 'd' not in vocabulary and 'http://a/c/d' not in vocabulary
+        with pytest.raises(KeyError):
+            vocabulary.encode(['a', 'zzz'])
+        with pytest.raises(ValueError):
+            Vocabulary.from_labels(['a', 'a'])
+        vocabulary.save(str(tmp_path / 'vocabulary'))
+        loaded = Vocabulary.load(str(tmp_path / 'vocabulary'))
+        assert isinstance(loaded.labels, np.memmap)
+        assert loaded.decode(loaded.encode(labels)).tolist() == labels
+        assert sorted(loaded.sample(5)) == sorted(labels)
+        df = loaded.to_dataframe()
+        assert df.index.to_list() == labels and df['entity'].to_list() == list(range(5))
+
+    @pytest.mark.filterwarnings('ignore::UserWarning')
+    def test_interactive_kge_vocabulary(self):
+        args = argparse_default([])
+        args.model = 'DistMult'
+        args.scoring_technique = 'KvsAll'
+        args.path_dataset_folder = 'KGs/UMLS'
+        args.num_epochs = 1
+        result = Execute(args).start()
+        path = result['path_experiment_folder']
+        kge = KGE(path_of_pretrained_model_dir=path)
+        # Vocabularies are serialized at the first loading and memory-mapped afterwards.
+        assert os.path.isfile(path + '/entity_vocabulary_labels.npy')
+        entity_to_idx = pd.read_parquet(path + '/entity_to_idx.gzip')
+        assert kge.entity_to_idx.equals(entity_to_idx)
+        kge = KGE(path_of_pretrained_model_dir=path)
+        assert isinstance(kge.entity_vocabulary.labels, np.memmap)
+        entities = kge.sample_entity(10)
+        assert kge.entity_vocabulary.encode(entities).tolist() == entity_to_idx.loc[entities]['entity'].to_list()
+        assert all(kge.is_seen(entity=i) for i in entities) and not kge.is_seen(entity='not an entity')
+        assert kge.entity_to_idx.iloc[int(kge.entity_vocabulary.encode(entities[:1])[0])].name == entities[0]